@@ -0,0 +1,414 @@
+"""Headless batch OCR for large document sets, without the web server.
+
+    python backend/batch.py /data/scans --output /data/ocr --mode Auto
+    python backend/batch.py manifest.txt --output /data/ocr --ocr-concurrency 32 --pages 24
+
+The input is a directory (searched recursively for PDFs and images) or a manifest
+file with one path per line (relative paths are relative to the manifest; blank
+lines and lines starting with # are ignored). Word files have to be converted to
+PDF first.
+
+Every input gets one result file under --output, at its path relative to the
+input directory or manifest plus the format's extension (a/b.pdf -> a/b.pdf.json).
+Finished pages and documents are recorded in checkpoint.jsonl in the output
+directory: running the same command again after an interruption skips finished
+documents and only processes the missing pages of unfinished ones.
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import ocr_service
+from metrics import STAGE_SECONDS
+from ocr_client import HunyuanOCRClient
+from page_image import PageImage
+from rasterizer import count_pdf_pages, render_pdf_window, PDF_DPI, PDF_WINDOW
+from result_writer import ResultWriter, result_filename, OUTPUT_FORMATS, BOX_FORMATS, JSON, POINTS
+
+MODES = ("Hunyuanocr", "Table", "NoTable", "Auto")
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".tiff")
+INPUT_EXTENSIONS = (".pdf",) + IMAGE_EXTENSIONS
+CHECKPOINT_NAME = "checkpoint.jsonl"
+# Same default as the upload form
+DEFAULT_PROMPT = ("检测并识别图片中的文字，输出每段文本的坐标。特别注意表格内容，如果同一个单元格内的文字分多行显示，"
+                  "请务必将其合并为单行文本输出，不要分开。例如单元格内第一行是'ABC'，第二行是'D'，应直接输出'ABCD'。"
+                  "以JSON数组形式返回，每个元素包含text与bbox，bbox为[x1,y1,x2,y2]，坐标单位为像素，禁止返回非JSON内容。")
+
+
+def find_inputs(source, exclude=None):
+    """[(key, path)] for a directory or a manifest file.
+
+    `key` is the input's path relative to the directory (or the manifest's directory),
+    with "/" separators; it names the result file and identifies the input in the checkpoint.
+    Files under `exclude` (the output directory) are skipped.
+    """
+    paths = []
+    if os.path.isdir(source):
+        root = source
+        exclude = os.path.abspath(exclude) if exclude else None
+        for dirpath, dirnames, filenames in os.walk(source):
+            dirnames[:] = sorted(d for d in dirnames if os.path.abspath(os.path.join(dirpath, d)) != exclude)
+            for name in sorted(filenames):
+                if name.lower().endswith(INPUT_EXTENSIONS):
+                    paths.append(os.path.join(dirpath, name))
+    else:
+        root = os.path.dirname(os.path.abspath(source))
+        with open(source, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith("#"):
+                    paths.append(line if os.path.isabs(line) else os.path.join(root, line))
+
+    inputs = []
+    seen = set()
+    for path in paths:
+        key = os.path.relpath(path, root)
+        if key.startswith(os.pardir):
+            # Outside the manifest's directory: mirror the absolute path instead
+            key = os.path.abspath(path).lstrip(os.sep)
+        key = key.replace(os.sep, "/")
+        if key not in seen:
+            seen.add(key)
+            inputs.append((key, path))
+    return inputs
+
+
+class Checkpoint:
+    """Append-only progress log of a batch run.
+
+    The first line holds the run's settings; after that, {"input", "page"} per finished
+    page and {"input", "done", ...} per finished document. Page results themselves are
+    kept in each document's partial file until the document is done.
+    """
+
+    def __init__(self, path, settings, restart=False):
+        self.path = path
+        self.done = {}
+        self.pages = {}
+        self._lock = threading.Lock()
+        if restart and os.path.exists(path):
+            os.remove(path)
+        existing = os.path.exists(path)
+        if existing:
+            self._load(settings)
+        self._file = open(path, "a", encoding="utf-8")
+        if not existing:
+            self._write({"settings": settings})
+
+    def _load(self, settings):
+        path = self.path
+        with open(path, "rb") as f:
+            content = f.read()
+        # A crash can leave a torn last line; drop it so new records start on a fresh line
+        end = content.rfind(b"\n") + 1
+        if end < len(content):
+            with open(path, "r+b") as f:
+                f.truncate(end)
+        for line in content[:end].decode("utf-8").splitlines():
+            record = json.loads(line)
+            if "settings" in record:
+                if record["settings"] != settings:
+                    raise ValueError(f"{path} was written with different settings {record['settings']}; "
+                                     "use another output directory or --restart")
+            elif record.get("done"):
+                self.done[record["input"]] = record
+            else:
+                self.pages.setdefault(record["input"], set()).add(record["page"])
+
+    def _write(self, record):
+        with self._lock:
+            self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self._file.flush()
+
+    def page_done(self, key, page_num):
+        self._write({"input": key, "page": page_num})
+
+    def document_done(self, key, pages, seconds):
+        self._write({"input": key, "done": True, "pages": pages, "seconds": round(seconds, 3)})
+
+    def close(self):
+        self._file.close()
+
+
+class _Document:
+    def __init__(self, key, path, result_dir, name):
+        self.key = key
+        self.path = path
+        self.result_dir = result_dir
+        self.name = name
+        self.partial_path = os.path.join(result_dir, name + ".partial.ndjson")
+        self.results = {}
+        self.total = 0
+        self.remaining = 0
+        self.error = None
+        self.started = time.perf_counter()
+        self.finished = threading.Event()
+        self.lock = threading.Lock()
+
+
+class BatchRunner:
+    """Runs documents through process_image with bounded concurrency per stage.
+
+    `render_workers` documents are rasterized at a time; their pages go to a pool of
+    `pages_in_flight` page workers, with at most twice that many pages rendered and
+    waiting. OCR and table-structure concurrency are set with ocr_service.configure_stages.
+    """
+
+    def __init__(self, output_dir, checkpoint, mode, prompt, iou_threshold, output_format=JSON,
+                 box_format=POINTS, pages_in_flight=12, render_workers=2, dpi=PDF_DPI,
+                 window=PDF_WINDOW, visualize=False):
+        self.output_dir = output_dir
+        self.checkpoint = checkpoint
+        self.mode = mode
+        self.prompt = prompt
+        self.iou_threshold = iou_threshold
+        self.output_format = output_format
+        self.box_format = box_format
+        self.dpi = dpi
+        self.window = window
+        self.visualize = visualize
+        self._page_executor = ThreadPoolExecutor(max_workers=pages_in_flight, thread_name_prefix="batch-page")
+        self._render_executor = ThreadPoolExecutor(max_workers=render_workers, thread_name_prefix="batch-render")
+        self._page_slots = threading.BoundedSemaphore(pages_in_flight * 2)
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+        self.stats = {"documents_done": 0, "documents_skipped": 0, "documents_failed": 0,
+                      "pages_processed": 0, "pages_resumed": 0}
+        self.page_seconds = []
+
+    def run(self, inputs):
+        documents = []
+        for key, path in inputs:
+            if key in self.checkpoint.done:
+                self.stats["documents_skipped"] += 1
+                continue
+            result_dir = os.path.join(self.output_dir, os.path.dirname(key))
+            doc = _Document(key, path, result_dir, os.path.basename(key))
+            documents.append(doc)
+            self._render_executor.submit(self._render_document, doc)
+        try:
+            for doc in documents:
+                doc.finished.wait()
+        except KeyboardInterrupt:
+            # Drop queued work, but let running pages finish and reach the checkpoint
+            self._stopping.set()
+            self._render_executor.shutdown(wait=False, cancel_futures=True)
+            self._page_executor.shutdown(wait=True, cancel_futures=True)
+            raise
+        self._render_executor.shutdown()
+        self._page_executor.shutdown()
+
+    # --- Rendering ---
+
+    def _render_document(self, doc):
+        todo = []
+        submitted = 0
+        try:
+            os.makedirs(doc.result_dir, exist_ok=True)
+            done_pages = self._load_partial(doc)
+            ext = os.path.splitext(doc.path)[1].lower()
+            if ext == ".pdf":
+                doc.total = count_pdf_pages(doc.path)
+            elif ext in IMAGE_EXTENSIONS:
+                doc.total = 1
+            else:
+                raise ValueError(f"Unsupported file type: {ext}")
+            todo = [n for n in range(1, doc.total + 1) if n not in done_pages]
+            with self._lock:
+                self.stats["pages_resumed"] += doc.total - len(todo)
+            doc.remaining = len(todo)
+            if not todo:
+                self._finish_document(doc)
+                return
+            for page_num, page in self._iter_pages(doc, ext, todo):
+                self._page_slots.acquire()
+                if self._stopping.is_set():
+                    self._page_slots.release()
+                    return
+                self._page_executor.submit(self._run_page, doc, page_num, page)
+                submitted += 1
+        except Exception as e:
+            doc.error = e
+            # The last submitted page finishes the document; without any, it is finished here
+            with doc.lock:
+                doc.remaining -= len(todo) - submitted
+                finished = doc.remaining == 0
+            if finished:
+                self._finish_document(doc)
+
+    def _iter_pages(self, doc, ext, todo):
+        """(page_num, PageImage) for the pages in `todo`; PDFs render only windows that contain them."""
+        if ext != ".pdf":
+            yield 1, PageImage.from_path(doc.path)
+            return
+        start = 0
+        while start < len(todo):
+            # A run of consecutive missing pages, at most `window` long
+            end = start + 1
+            while end < len(todo) and end - start < self.window and todo[end] == todo[end - 1] + 1:
+                end += 1
+            first, last = todo[start], todo[end - 1]
+            for offset, img in enumerate(render_pdf_window(doc.path, first, last, self.dpi)):
+                yield first + offset, PageImage.from_pil(img, name=f"{doc.key} page {first + offset}")
+            start = end
+
+    def _load_partial(self, doc):
+        """Results of pages finished by an earlier run (checkpointed and in the partial file)."""
+        checkpointed = self.checkpoint.pages.get(doc.key, set())
+        if checkpointed and os.path.exists(doc.partial_path):
+            with open(doc.partial_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    if record["page"] in checkpointed:
+                        doc.results[record["page"]] = record["results"]
+        # Rewrite without pages that never reached the checkpoint
+        with open(doc.partial_path, "w", encoding="utf-8") as f:
+            for page_num in sorted(doc.results):
+                f.write(json.dumps({"page": page_num, "results": doc.results[page_num]}, ensure_ascii=False) + "\n")
+        return set(doc.results)
+
+    # --- Pages ---
+
+    def _run_page(self, doc, page_num, page):
+        start = time.perf_counter()
+        try:
+            vis_path = None
+            if self.visualize:
+                vis_path = os.path.join(doc.result_dir, f"{doc.name}_page_{page_num}_vis.jpg")
+            results = ocr_service.process_image(page, self.mode, self.prompt, self.iou_threshold, vis_path)
+            line = json.dumps({"page": page_num, "results": results}, ensure_ascii=False) + "\n"
+            with doc.lock:
+                doc.results[page_num] = results
+                with open(doc.partial_path, "a", encoding="utf-8") as f:
+                    f.write(line)
+            self.checkpoint.page_done(doc.key, page_num)
+            with self._lock:
+                self.stats["pages_processed"] += 1
+                self.page_seconds.append(time.perf_counter() - start)
+        except Exception as e:
+            print(f"[batch] {doc.key} page {page_num} failed: {e}")
+            doc.error = e
+        finally:
+            page.release()
+            self._page_slots.release()
+            with doc.lock:
+                doc.remaining -= 1
+                finished = doc.remaining == 0
+            if finished:
+                self._finish_document(doc)
+
+    def _finish_document(self, doc):
+        try:
+            if doc.error is None:
+                writer = ResultWriter(doc.result_dir, doc.name, self.output_format, self.box_format)
+                for page_num in sorted(doc.results):
+                    writer.write_page(page_num, doc.results[page_num])
+                writer.close()
+                os.remove(doc.partial_path)
+                self.checkpoint.document_done(doc.key, doc.total, time.perf_counter() - doc.started)
+        except Exception as e:
+            doc.error = e
+        with self._lock:
+            if doc.error is None:
+                self.stats["documents_done"] += 1
+                output = os.path.join(os.path.dirname(doc.key), result_filename(doc.name, self.output_format))
+                print(f"[batch] {doc.key}: {doc.total} pages -> {output}")
+            else:
+                self.stats["documents_failed"] += 1
+                print(f"[batch] {doc.key} failed: {doc.error}")
+        doc.finished.set()
+
+    def summary(self, elapsed):
+        stats = dict(self.stats)
+        stats["seconds"] = round(elapsed, 3)
+        stats["pages_per_sec"] = round(stats["pages_processed"] / elapsed, 3) if elapsed else None
+        stats["documents_per_sec"] = round(stats["documents_done"] / elapsed, 3) if elapsed else None
+        latencies = sorted(self.page_seconds)
+        if latencies:
+            stats["page_p50_s"] = round(latencies[len(latencies) // 2], 3)
+            stats["page_p95_s"] = round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))], 3)
+        stats["stage_mean_s"] = {key[0]: round(total / count, 4)
+                                 for key, (count, total) in sorted(STAGE_SECONDS.totals().items()) if count}
+        return stats
+
+
+def print_summary(stats):
+    print("=" * 60)
+    print(f"Documents: {stats['documents_done']} done, {stats['documents_skipped']} already done, "
+          f"{stats['documents_failed']} failed")
+    print(f"Pages:     {stats['pages_processed']} processed, {stats['pages_resumed']} resumed from checkpoint")
+    print(f"Time:      {stats['seconds']}s, {stats['pages_per_sec']} pages/s, {stats['documents_per_sec']} documents/s")
+    if "page_p50_s" in stats:
+        print(f"Per page:  p50 {stats['page_p50_s']}s, p95 {stats['page_p95_s']}s")
+    if stats["stage_mean_s"]:
+        print("Stages:    " + ", ".join(f"{stage} {mean}s" for stage, mean in stats["stage_mean_s"].items()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("source", help="directory of PDFs/images, or a manifest file with one path per line")
+    parser.add_argument("--output", required=True, help="directory for result files and the checkpoint")
+    parser.add_argument("--mode", default="Table", choices=MODES)
+    parser.add_argument("--prompt", default=DEFAULT_PROMPT)
+    parser.add_argument("--iou-threshold", type=float, default=0.8)
+    parser.add_argument("--format", default=JSON, choices=OUTPUT_FORMATS, help="result file format")
+    parser.add_argument("--box-format", default=POINTS, choices=BOX_FORMATS)
+    parser.add_argument("--visualize", action="store_true", help="also write a visualization JPEG per page")
+    parser.add_argument("--ocr-url", action="append", help="HunyuanOCR server (repeat for several replicas)")
+    parser.add_argument("--pages", type=int, default=12, help="pages processed at once")
+    parser.add_argument("--render-workers", type=int, default=2, help="documents rasterized at once")
+    parser.add_argument("--ocr-concurrency", type=int, help=f"HunyuanOCR requests at once (default {ocr_service.OCR_CONCURRENCY})")
+    parser.add_argument("--table-concurrency", type=int, help="table structure calls at once")
+    parser.add_argument("--table-workers", type=int, help=f"table model processes (default {ocr_service.TABLE_WORKER_PROCESSES}, 0 = in-process)")
+    parser.add_argument("--dpi", type=int, default=PDF_DPI)
+    parser.add_argument("--window", type=int, default=PDF_WINDOW, help="PDF pages rendered per call")
+    parser.add_argument("--restart", action="store_true", help="ignore an existing checkpoint and start over")
+    args = parser.parse_args()
+
+    if args.ocr_url:
+        ocr_service.client = HunyuanOCRClient(args.ocr_url, model=ocr_service.HUNYUAN_MODEL,
+                                              timeout=ocr_service.OCR_REQUEST_TIMEOUT,
+                                              max_retries=ocr_service.OCR_MAX_RETRIES,
+                                              max_in_flight=max(ocr_service.OCR_MAX_IN_FLIGHT, args.ocr_concurrency or 0))
+    ocr_service.configure_stages(args.ocr_concurrency, args.table_concurrency, args.table_workers)
+
+    os.makedirs(args.output, exist_ok=True)
+    settings = {"mode": args.mode, "prompt": args.prompt, "iou_threshold": args.iou_threshold,
+                "format": args.format, "box_format": args.box_format, "dpi": args.dpi}
+    try:
+        checkpoint = Checkpoint(os.path.join(args.output, CHECKPOINT_NAME), settings, restart=args.restart)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        sys.exit(2)
+
+    inputs = find_inputs(args.source, exclude=args.output)
+    print(f"[batch] {len(inputs)} inputs, {len(checkpoint.done)} already done")
+    runner = BatchRunner(args.output, checkpoint, args.mode, args.prompt, args.iou_threshold,
+                         output_format=args.format, box_format=args.box_format, pages_in_flight=args.pages,
+                         render_workers=args.render_workers, dpi=args.dpi, window=args.window,
+                         visualize=args.visualize)
+    start = time.perf_counter()
+    interrupted = False
+    try:
+        runner.run(inputs)
+    except KeyboardInterrupt:
+        interrupted = True
+        print("[batch] Interrupted. Run the same command again to resume.")
+    stats = runner.summary(time.perf_counter() - start)
+    checkpoint.close()
+    print_summary(stats)
+    if interrupted:
+        sys.exit(130)
+    if stats["documents_failed"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
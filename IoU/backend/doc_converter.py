@@ -0,0 +1,253 @@
+import asyncio
+import html
+import os
+import re
+import shutil
+import signal
+import uuid
+import zipfile
+
+# Seconds one conversion may take before its process is killed
+DOC_CONVERT_TIMEOUT = 180
+DOC_CONVERT_WORKERS = 2
+# Worker i's LibreOffice listener serves conversions on DOC_CONVERT_PORT + 2 * i, and its
+# soffice takes UNO connections on the port after that
+DOC_CONVERT_PORT = 2103
+# Seconds a newly started listener may take to accept connections
+DOC_LISTENER_START_TIMEOUT = 60
+
+
+class ConversionError(Exception):
+    """Raised when a document could not be converted to PDF."""
+
+
+class LibreOfficeConverter:
+    """Long-lived headless LibreOffice listener with its own user profile.
+
+    Every worker starts one `unoserver` (soffice running with `--accept=`) on its own
+    ports and profile directory and keeps it for the service's life; conversions are
+    handed to it with `unoconvert`, so only the first one pays for LibreOffice start-up
+    and profile creation, and concurrent conversions never fight over a profile lock.
+    A listener that exited, or was stopped because a conversion hung, is started again
+    on the next conversion. Without unoserver installed, or when the listener does not
+    start, a conversion runs a one-shot `soffice --convert-to` on the worker's profile.
+    """
+
+    def __init__(self, profile_dir, port=DOC_CONVERT_PORT, binary=None):
+        self.profile_dir = profile_dir
+        self.port = port
+        self.uno_port = port + 1
+        self.binary = binary or shutil.which("soffice") or shutil.which("libreoffice") or "libreoffice"
+        self.server_binary = shutil.which("unoserver")
+        self.client_binary = shutil.which("unoconvert")
+        self._server = None
+        os.makedirs(profile_dir, exist_ok=True)
+
+    @property
+    def listening(self):
+        return self.server_binary is not None and self.client_binary is not None
+
+    async def start(self):
+        """Start the listener now rather than on the first conversion."""
+        if self.listening:
+            await self._ensure_listener()
+
+    async def _ensure_listener(self):
+        if self._server is not None:
+            if self._server.returncode is None:
+                return
+            print(f"[convert] LibreOffice listener on port {self.port} exited ({self._server.returncode}), restarting")
+        loop = asyncio.get_running_loop()
+        self._server = await asyncio.create_subprocess_exec(
+            self.server_binary, "--interface", "127.0.0.1", "--port", str(self.port),
+            "--uno-port", str(self.uno_port), "--user-installation", os.path.abspath(self.profile_dir),
+            "--executable", self.binary,
+            stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL,
+            # Its own process group, so stopping it also takes down the soffice it spawned
+            start_new_session=True
+        )
+        deadline = loop.time() + DOC_LISTENER_START_TIMEOUT
+        while True:
+            if self._server.returncode is not None:
+                raise ConversionError(f"LibreOffice listener on port {self.port} exited with {self._server.returncode}")
+            try:
+                _, writer = await asyncio.open_connection("127.0.0.1", self.port)
+            except OSError:
+                if loop.time() > deadline:
+                    await self.aclose()
+                    raise ConversionError(f"LibreOffice listener on port {self.port} did not start "
+                                          f"within {DOC_LISTENER_START_TIMEOUT}s")
+                await asyncio.sleep(0.2)
+                continue
+            writer.close()
+            await writer.wait_closed()
+            print(f"[convert] LibreOffice listener ready on port {self.port}")
+            return
+
+    async def aclose(self):
+        """Stop the listener (and its soffice), if running."""
+        server, self._server = self._server, None
+        if server is None or server.returncode is not None:
+            return
+        server.terminate()
+        try:
+            await asyncio.wait_for(server.wait(), 10)
+        except asyncio.TimeoutError:
+            try:
+                os.killpg(server.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+            await server.wait()
+
+    async def convert(self, src_path, out_dir):
+        pdf_path = os.path.join(out_dir, os.path.splitext(os.path.basename(src_path))[0] + ".pdf")
+        listening = self.listening
+        if listening:
+            try:
+                await self._ensure_listener()
+            except ConversionError as e:
+                # e.g. unoserver installed without LibreOffice's uno module
+                print(f"[convert] Warning: {e}; converting with a one-shot LibreOffice instead")
+                listening = False
+        if listening:
+            command = [self.client_binary, "--host", "127.0.0.1", "--port", str(self.port),
+                       "--convert-to", "pdf", src_path, pdf_path]
+        else:
+            profile_url = "file://" + os.path.abspath(self.profile_dir).replace(os.sep, "/")
+            command = [self.binary, f"-env:UserInstallation={profile_url}", "--headless", "--norestore",
+                       "--convert-to", "pdf", "--outdir", out_dir, src_path]
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *command, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+            )
+        except FileNotFoundError:
+            raise ConversionError(f"LibreOffice not found ({self.binary}); install it or use the placeholder converter")
+        try:
+            _, stderr = await process.communicate()
+        except asyncio.CancelledError:
+            # Timed out or the job went away: don't leave the conversion running, and don't
+            # keep a listener that may still be stuck on this document
+            process.kill()
+            await process.wait()
+            await self.aclose()
+            raise
+        if process.returncode != 0:
+            raise ConversionError(f"LibreOffice exited with {process.returncode}: {stderr.decode(errors='replace').strip()}")
+        if not os.path.exists(pdf_path):
+            raise ConversionError("Word conversion failed to generate PDF")
+        return pdf_path
+
+
+def _docx_paragraphs(path):
+    try:
+        with zipfile.ZipFile(path) as z:
+            xml = z.read("word/document.xml").decode("utf-8", errors="replace")
+    except (zipfile.BadZipFile, KeyError):
+        return []
+    paragraphs = []
+    for para in re.findall(r"<w:p[ >].*?</w:p>", xml, flags=re.S):
+        text = "".join(re.findall(r"<w:t(?: [^>]*)?>(.*?)</w:t>", para, flags=re.S))
+        if text:
+            paragraphs.append(html.unescape(text))
+    return paragraphs
+
+
+class PlaceholderConverter:
+    """Stand-in for LibreOffice: renders the document's paragraphs onto plain A4 pages.
+
+    Layout is not preserved; it exists so the Word path can run (in tests, the bench,
+    or machines without LibreOffice) and produce a real PDF with the right text.
+    """
+
+    def __init__(self, profile_dir=None, port=None, page_size=(1654, 2339), line_height=40, margin=100):
+        self.page_size = page_size
+        self.line_height = line_height
+        self.margin = margin
+
+    def _render(self, src_path, pdf_path):
+        from PIL import Image, ImageDraw
+        lines = _docx_paragraphs(src_path) or [os.path.basename(src_path)]
+        per_page = max(1, (self.page_size[1] - 2 * self.margin) // self.line_height)
+        pages = []
+        for start in range(0, len(lines), per_page):
+            img = Image.new("RGB", self.page_size, "white")
+            draw = ImageDraw.Draw(img)
+            for i, line in enumerate(lines[start:start + per_page]):
+                draw.text((self.margin, self.margin + i * self.line_height), line, fill="black")
+            pages.append(img)
+        pages[0].save(pdf_path, "PDF", save_all=True, append_images=pages[1:], resolution=200)
+        return pdf_path
+
+    async def convert(self, src_path, out_dir):
+        pdf_path = os.path.join(out_dir, os.path.splitext(os.path.basename(src_path))[0] + ".pdf")
+        return await asyncio.to_thread(self._render, src_path, pdf_path)
+
+
+CONVERTERS = {
+    "libreoffice": LibreOfficeConverter,
+    "placeholder": PlaceholderConverter,
+}
+
+
+class ConversionService:
+    """Pool of converter workers, used from the event loop without blocking it.
+
+    Each conversion takes a free worker, runs in its own work directory (so two
+    uploads with the same file name cannot collide), is killed after `timeout`
+    seconds, and its PDF is moved to the requested destination. Workers live as
+    long as the service (for LibreOffice, one listener each); `aclose()` stops them.
+    """
+
+    def __init__(self, work_root, converter="libreoffice", workers=DOC_CONVERT_WORKERS, timeout=DOC_CONVERT_TIMEOUT):
+        factory = CONVERTERS[converter] if isinstance(converter, str) else converter
+        self.work_root = work_root
+        self.timeout = timeout
+        self.workers = [factory(os.path.join(work_root, f"profile_{i}"), port=DOC_CONVERT_PORT + 2 * i)
+                        for i in range(workers)]
+        self._idle = None
+
+    async def start(self):
+        """Start every worker's listener ahead of the first conversion; failures are only logged,
+        the next conversion on that worker tries again."""
+        if any(getattr(worker, "listening", True) is False for worker in self.workers):
+            print("[convert] Warning: unoserver/unoconvert not found on PATH; every Word conversion "
+                  "starts its own LibreOffice. Install unoserver to keep LibreOffice running.")
+        self._ensure_idle()
+        for _ in self.workers:
+            # Taken like for a conversion, so a conversion arriving meanwhile never starts a second listener
+            worker = await self._idle.get()
+            try:
+                if hasattr(worker, "start"):
+                    await worker.start()
+            except ConversionError as e:
+                print(f"[convert] {e}")
+            finally:
+                self._idle.put_nowait(worker)
+
+    async def aclose(self):
+        for worker in self.workers:
+            if hasattr(worker, "aclose"):
+                await worker.aclose()
+
+    def _ensure_idle(self):
+        # Created on first use so it belongs to the running loop
+        if self._idle is None:
+            self._idle = asyncio.Queue()
+            for worker in self.workers:
+                self._idle.put_nowait(worker)
+
+    async def convert(self, src_path, dest_path, job_id=None):
+        """Convert `src_path` to a PDF at `dest_path` and return `dest_path`."""
+        self._ensure_idle()
+        worker = await self._idle.get()
+        work_dir = os.path.join(self.work_root, "jobs", f"{job_id or 'job'}_{uuid.uuid4().hex[:8]}")
+        try:
+            os.makedirs(work_dir)
+            pdf_path = await asyncio.wait_for(worker.convert(os.path.abspath(src_path), work_dir), self.timeout)
+            os.replace(pdf_path, dest_path)
+            return dest_path
+        except asyncio.TimeoutError:
+            raise ConversionError(f"Word conversion timed out after {self.timeout}s")
+        finally:
+            self._idle.put_nowait(worker)
+            shutil.rmtree(work_dir, ignore_errors=True)
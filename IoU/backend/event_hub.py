@@ -0,0 +1,293 @@
+import asyncio
+import json
+from collections import deque
+
+from metrics import WS_CLIENTS, WS_CLIENTS_DROPPED, WS_EVENTS
+
+# Events kept per file for clients that reconnect, and how long after a file's last event
+# they are kept; a file nobody watches is forgotten then (also one that never had events)
+EVENT_HISTORY = 200
+EVENT_HISTORY_TTL = 3600
+# "progress" and "segments" events of one file go out at most this often; what arrives
+# in between is folded into the next one
+PROGRESS_INTERVAL = 0.25
+# Messages waiting per client; a client this far behind, or whose send takes longer
+# than SEND_TIMEOUT seconds, is disconnected (it can reconnect and replay)
+CLIENT_QUEUE_SIZE = 256
+SEND_TIMEOUT = 10
+
+COALESCED_TYPES = ("progress", "segments")
+# WebSocket close code for clients dropped for falling behind
+CLOSE_TOO_SLOW = 4008
+
+
+class _Client:
+    def __init__(self, websocket):
+        self.websocket = websocket
+        self.queue = asyncio.Queue(maxsize=CLIENT_QUEUE_SIZE)
+        self.file_ids = set()
+        self.everything = False
+        self.closed = False
+        self.dropping = False
+
+
+class _FileChannel:
+    def __init__(self):
+        self.seq = 0
+        self.history = deque(maxlen=EVENT_HISTORY)
+        self.subscribers = set()
+        self.pending_progress = None
+        self.pending_segments = {}
+        self.last_flush = 0.0
+        self.flush_handle = None
+        self.last_active = 0.0
+        self.expire_handle = None
+
+
+def _fold_progress(previous, message):
+    """Latest progress event, still listing every page finished since `previous`."""
+    pages = list(previous.get("pages_done", [])) if previous else []
+    if message.get("page") is not None:
+        pages.append(message["page"])
+    return {**message, "pages_done": pages}
+
+
+class EventHub:
+    """Per-file_id publish/subscribe for job events over WebSockets.
+
+    Clients subscribe to the file_ids they care about (or to everything) and get only
+    those files' events. Progress and streamed segments are coalesced to at most one
+    message per PROGRESS_INTERVAL per file. Every client has its own bounded queue and
+    sender task, so a slow client never holds up the others; one that falls behind is
+    disconnected. Events carry a per-file `seq`, and subscribing with `since` replays
+    the kept history after that point, so a reconnecting client catches up.
+
+    `broadcast(message)` is the publishing side, called on the event loop.
+    """
+
+    def __init__(self):
+        self._channels = {}
+        self._clients = set()
+        self._everything = set()
+
+    # --- Connections ---
+
+    async def serve(self, websocket):
+        """Run one WebSocket connection until it closes."""
+        await websocket.accept()
+        client = _Client(websocket)
+        self._clients.add(client)
+        WS_CLIENTS.inc()
+        sender = asyncio.create_task(self._send_loop(client))
+        try:
+            while True:
+                text = await websocket.receive_text()
+                try:
+                    request = json.loads(text)
+                except ValueError:
+                    continue
+                if isinstance(request, dict):
+                    self._handle_request(client, request)
+        except Exception:
+            # WebSocketDisconnect, or the socket was closed under us after a drop
+            pass
+        finally:
+            sender.cancel()
+            self._remove(client)
+
+    def _handle_request(self, client, request):
+        action = request.get("action")
+        file_ids = [str(f) for f in request.get("file_ids") or []]
+        if action == "subscribe":
+            since = request.get("since") or {}
+            for file_id in file_ids:
+                if file_id == "*":
+                    client.everything = True
+                    self._everything.add(client)
+                    continue
+                client.file_ids.add(file_id)
+                self._channel(file_id).subscribers.add(client)
+                self._replay(client, file_id, since.get(file_id, 0))
+        elif action == "unsubscribe":
+            for file_id in file_ids:
+                if file_id == "*":
+                    client.everything = False
+                    self._everything.discard(client)
+                    continue
+                client.file_ids.discard(file_id)
+                self._unsubscribe(client, file_id)
+
+    def _replay(self, client, file_id, since):
+        channel = self._channels.get(file_id)
+        if channel is None:
+            return
+        for message in list(channel.history):
+            if message["seq"] > since:
+                self._enqueue(client, message)
+
+    async def _send_loop(self, client):
+        try:
+            while True:
+                message = await client.queue.get()
+                await asyncio.wait_for(client.websocket.send_json(message), SEND_TIMEOUT)
+        except asyncio.CancelledError:
+            raise
+        except asyncio.TimeoutError:
+            await self._drop(client, "send_timeout")
+        except Exception:
+            await self._drop(client, "send_error")
+
+    def _enqueue(self, client, message):
+        if client.closed or client.dropping:
+            return
+        try:
+            client.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            client.dropping = True
+            asyncio.get_running_loop().create_task(self._drop(client, "queue_full"))
+
+    async def _drop(self, client, reason):
+        if client.closed:
+            return
+        print(f"[ws] Dropping client ({reason})")
+        WS_CLIENTS_DROPPED.inc(reason=reason)
+        self._remove(client)
+        try:
+            await client.websocket.close(code=CLOSE_TOO_SLOW)
+        except Exception:
+            pass
+
+    def _remove(self, client):
+        if client.closed:
+            return
+        client.closed = True
+        self._clients.discard(client)
+        self._everything.discard(client)
+        for file_id in client.file_ids:
+            self._unsubscribe(client, file_id)
+        WS_CLIENTS.dec()
+
+    def _unsubscribe(self, client, file_id):
+        channel = self._channels.get(file_id)
+        if channel is None:
+            return
+        channel.subscribers.discard(client)
+        if not channel.subscribers and channel.expire_handle is None:
+            # Expired while still watched; nothing keeps it now
+            self._forget(file_id, channel)
+
+    @property
+    def client_count(self):
+        return len(self._clients)
+
+    # --- Publishing ---
+
+    def _channel(self, file_id):
+        channel = self._channels.get(file_id)
+        if channel is None:
+            channel = self._channels[file_id] = _FileChannel()
+            self._touch(file_id, channel)
+        return channel
+
+    async def broadcast(self, message):
+        """Publish one job event (a dict with "type" and "file_id")."""
+        self.publish(message)
+
+    def publish(self, message):
+        file_id = str(message.get("file_id"))
+        channel = self._channel(file_id)
+        kind = message.get("type")
+        if kind in COALESCED_TYPES:
+            if kind == "progress":
+                if channel.pending_progress is not None:
+                    WS_EVENTS.inc(type=kind, delivery="coalesced")
+                channel.pending_progress = _fold_progress(channel.pending_progress, message)
+            else:
+                page = message.get("page")
+                previous = channel.pending_segments.get(page)
+                if previous is not None:
+                    WS_EVENTS.inc(type=kind, delivery="coalesced")
+                    if not message.get("replace"):
+                        # Appended to what is pending, keeping its "replace" flag
+                        message = {**previous, "segments": previous["segments"] + message["segments"]}
+                channel.pending_segments[page] = message
+            self._schedule_flush(file_id, channel)
+            return
+        # Anything else goes out at once, after whatever was held back for this file
+        self._flush(file_id)
+        self._emit(file_id, channel, message)
+
+    def _schedule_flush(self, file_id, channel):
+        if channel.flush_handle is not None:
+            return
+        loop = asyncio.get_running_loop()
+        delay = channel.last_flush + PROGRESS_INTERVAL - loop.time()
+        if delay <= 0:
+            self._flush(file_id)
+        else:
+            channel.flush_handle = loop.call_later(delay, self._flush, file_id)
+
+    def _flush(self, file_id):
+        channel = self._channels.get(file_id)
+        if channel is None:
+            return
+        if channel.flush_handle is not None:
+            channel.flush_handle.cancel()
+            channel.flush_handle = None
+        if channel.pending_segments:
+            for page in sorted(channel.pending_segments, key=lambda p: (p is None, p)):
+                self._emit(file_id, channel, channel.pending_segments[page], keep=False)
+            channel.pending_segments = {}
+        if channel.pending_progress is not None:
+            self._emit(file_id, channel, channel.pending_progress)
+            channel.pending_progress = None
+        channel.last_flush = asyncio.get_running_loop().time()
+
+    def _emit(self, file_id, channel, message, keep=True):
+        self._touch(file_id, channel)
+        channel.seq += 1
+        message = {**message, "seq": channel.seq}
+        WS_EVENTS.inc(type=message.get("type"), delivery="sent")
+        if keep:
+            # Streamed segments are live-only; a reconnecting client gets the finished page instead
+            kept = message
+            last = channel.history[-1] if channel.history else None
+            if message.get("type") == "progress" and last is not None and last.get("type") == "progress":
+                # Only the latest progress matters for replay, with all pages it covers
+                channel.history.pop()
+                kept = {**message, "pages_done": last.get("pages_done", []) + message.get("pages_done", [])}
+            channel.history.append(kept)
+        # A client subscribed to the file and to "*" gets it once
+        for client in channel.subscribers | self._everything:
+            self._enqueue(client, message)
+
+    # --- Expiry ---
+
+    def _touch(self, file_id, channel):
+        loop = asyncio.get_running_loop()
+        channel.last_active = loop.time()
+        if channel.expire_handle is None:
+            channel.expire_handle = loop.call_later(EVENT_HISTORY_TTL, self._expire, file_id)
+
+    def _expire(self, file_id):
+        channel = self._channels.get(file_id)
+        if channel is None:
+            return
+        loop = asyncio.get_running_loop()
+        idle = loop.time() - channel.last_active
+        if idle < EVENT_HISTORY_TTL:
+            # Active since the timer was set; check again when it has been idle long enough
+            channel.expire_handle = loop.call_later(EVENT_HISTORY_TTL - idle, self._expire, file_id)
+            return
+        channel.expire_handle = None
+        if channel.subscribers:
+            # Still watched: forget the history but keep the subscriptions
+            channel.history.clear()
+        else:
+            self._forget(file_id, channel)
+
+    def _forget(self, file_id, channel):
+        for handle in (channel.flush_handle, channel.expire_handle):
+            if handle is not None:
+                handle.cancel()
+        del self._channels[file_id]
@@ -0,0 +1,273 @@
+import asyncio
+import bisect
+import itertools
+import sqlite3
+import threading
+import time
+
+# Job states as stored in SQLite
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+CANCELLED = "cancelled"
+UNFINISHED_STATES = (QUEUED, RUNNING)
+
+
+class QueueFullError(Exception):
+    """Raised when a job cannot be queued because the scheduler is at capacity."""
+
+
+class JobCancelled(Exception):
+    """Raised inside a running job once it has been cancelled."""
+
+
+class JobStore:
+    """Job records in a local SQLite file so unfinished jobs survive a restart."""
+
+    # Columns added after the first release, created on older databases at startup
+    ADDED_COLUMNS = {
+        "trace": "INTEGER NOT NULL DEFAULT 0",
+        "output_format": "TEXT NOT NULL DEFAULT 'json'",
+        "box_format": "TEXT NOT NULL DEFAULT 'points'",
+        "content_key": "TEXT",
+        "result": "TEXT",
+    }
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    file_id TEXT PRIMARY KEY,
+                    filename TEXT NOT NULL,
+                    file_path TEXT NOT NULL,
+                    mode TEXT NOT NULL,
+                    prompt TEXT NOT NULL,
+                    iou_threshold REAL NOT NULL,
+                    priority INTEGER NOT NULL DEFAULT 0,
+                    trace INTEGER NOT NULL DEFAULT 0,
+                    output_format TEXT NOT NULL DEFAULT 'json',
+                    box_format TEXT NOT NULL DEFAULT 'points',
+                    content_key TEXT,
+                    result TEXT,
+                    status TEXT NOT NULL,
+                    error TEXT,
+                    pages_done INTEGER NOT NULL DEFAULT 0,
+                    pages_total INTEGER,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            """)
+            columns = {row["name"] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+            for name, definition in self.ADDED_COLUMNS.items():
+                if name not in columns:
+                    self._conn.execute(f"ALTER TABLE jobs ADD COLUMN {name} {definition}")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_content_key ON jobs (content_key)")
+
+    def add(self, job):
+        """Insert a queued job. A job with a `content_key` is only inserted when no queued,
+        running or completed job has the same key; that job is returned instead (None if inserted).
+        """
+        now = time.time()
+        with self._lock, self._conn:
+            if job.get("content_key"):
+                existing = self._find_by_content(job["content_key"])
+                if existing is not None:
+                    return existing
+            self._conn.execute(
+                "INSERT OR REPLACE INTO jobs (file_id, filename, file_path, mode, prompt, iou_threshold, "
+                "priority, trace, output_format, box_format, content_key, status, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (job["file_id"], job["filename"], job["file_path"], job["mode"], job["prompt"],
+                 job["iou_threshold"], job.get("priority", 0), int(bool(job.get("trace"))),
+                 job.get("output_format", "json"), job.get("box_format", "points"), job.get("content_key"),
+                 QUEUED, now, now)
+            )
+        return None
+
+    def update(self, file_id, **fields):
+        if not fields:
+            return
+        fields["updated_at"] = time.time()
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self._lock, self._conn:
+            self._conn.execute(f"UPDATE jobs SET {assignments} WHERE file_id = ?", (*fields.values(), file_id))
+
+    def get(self, file_id):
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE file_id = ?", (file_id,)).fetchone()
+        return dict(row) if row else None
+
+    def find_by_content(self, content_key):
+        """Newest queued, running or completed job for the same content and settings, or None."""
+        with self._lock:
+            return self._find_by_content(content_key)
+
+    def _find_by_content(self, content_key):
+        row = self._conn.execute(
+            "SELECT * FROM jobs WHERE content_key = ? AND status IN (?, ?, ?) ORDER BY created_at DESC LIMIT 1",
+            (content_key, QUEUED, RUNNING, COMPLETED)
+        ).fetchone()
+        return dict(row) if row else None
+
+    def unfinished(self):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT * FROM jobs WHERE status IN (?, ?) ORDER BY priority DESC, created_at",
+                UNFINISHED_STATES
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def delete(self, file_id):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM jobs WHERE file_id = ?", (file_id,))
+
+    def clear(self):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM jobs")
+
+
+class JobScheduler:
+    """Priority job queue with a fixed number of workers and a bounded backlog.
+
+    `run_job(job, cancel_event)` does the actual work and returns the final state;
+    it should check `cancel_event` before starting each page.
+    """
+
+    def __init__(self, store, run_job, workers=2, max_queued=100):
+        self.store = store
+        self.run_job = run_job
+        self.workers = workers
+        self.max_queued = max_queued
+        self._queue = asyncio.PriorityQueue()
+        self._seq = itertools.count()
+        self._queued = set()
+        # Sort keys of the waiting jobs, in queue order, for position()
+        self._order = []
+        self._order_keys = {}
+        self._running = set()
+        self._cancel_events = {}
+        self._slot_freed = asyncio.Condition()
+        self._tasks = []
+
+    @property
+    def depth(self):
+        return len(self._queued)
+
+    @property
+    def running(self):
+        return len(self._running)
+
+    async def start(self):
+        """Start the workers and re-queue jobs left unfinished by a previous run."""
+        for job in self.store.unfinished():
+            print(f"Resuming job {job['file_id']} ({job['status']})")
+            self._enqueue(job)
+        for i in range(self.workers):
+            self._tasks.append(asyncio.create_task(self._worker(i)))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def _enqueue(self, job):
+        file_id = job["file_id"]
+        self._queued.add(file_id)
+        self._cancel_events[file_id] = asyncio.Event()
+        # Higher priority first, FIFO within a priority
+        key = (-int(job.get("priority", 0)), next(self._seq))
+        self._order_keys[file_id] = key
+        bisect.insort(self._order, key)
+        self._queue.put_nowait((*key, job))
+
+    def _unqueue(self, file_id):
+        self._queued.discard(file_id)
+        key = self._order_keys.pop(file_id, None)
+        if key is not None:
+            del self._order[bisect.bisect_left(self._order, key)]
+
+    def has_capacity(self, n=1):
+        return self.depth + n <= self.max_queued
+
+    async def wait_for_capacity(self, timeout=0):
+        """Wait up to `timeout` seconds for a free queue slot; return whether one is free."""
+        if self.has_capacity():
+            return True
+        try:
+            async with self._slot_freed:
+                await asyncio.wait_for(self._slot_freed.wait_for(self.has_capacity), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    async def submit(self, job, timeout=0):
+        """Queue a job, waiting up to `timeout` seconds for room; raise QueueFullError otherwise.
+
+        Returns None once queued, or the existing job when the store already has one with
+        the same `content_key` (see JobStore.add); the new job is then not queued.
+        """
+        if not await self.wait_for_capacity(timeout):
+            raise QueueFullError(f"Job queue is full ({self.max_queued} jobs waiting)")
+        existing = self.store.add(job)
+        if existing is not None:
+            return existing
+        self._enqueue(job)
+        return None
+
+    def cancel(self, file_id):
+        """Cancel a queued or running job. Pages that already started still finish."""
+        event = self._cancel_events.get(file_id)
+        if event is None:
+            return False
+        event.set()
+        if file_id in self._queued:
+            # Frees its queue slot now; the worker drops the entry when it comes up
+            self._unqueue(file_id)
+            self.store.update(file_id, status=CANCELLED)
+            asyncio.get_running_loop().create_task(self._notify_slot_freed())
+        return True
+
+    def cancel_all(self):
+        for file_id in list(self._cancel_events):
+            self.cancel(file_id)
+
+    def position(self, file_id):
+        """1-based position in the queue, or None if the job is not waiting."""
+        key = self._order_keys.get(file_id)
+        if key is None:
+            return None
+        return bisect.bisect_left(self._order, key) + 1
+
+    async def _notify_slot_freed(self):
+        async with self._slot_freed:
+            self._slot_freed.notify_all()
+
+    async def _worker(self, worker_id):
+        while True:
+            _, _, job = await self._queue.get()
+            file_id = job["file_id"]
+            self._unqueue(file_id)
+            await self._notify_slot_freed()
+            cancel_event = self._cancel_events.get(file_id)
+            try:
+                if cancel_event is None or cancel_event.is_set():
+                    continue
+                self._running.add(file_id)
+                self.store.update(file_id, status=RUNNING)
+                try:
+                    status = await self.run_job(job, cancel_event)
+                    self.store.update(file_id, status=status)
+                except Exception as e:
+                    print(f"Job {file_id} failed: {e}")
+                    self.store.update(file_id, status=FAILED, error=str(e))
+            finally:
+                self._running.discard(file_id)
+                if file_id not in self._queued:
+                    self._cancel_events.pop(file_id, None)
+                self._queue.task_done()
@@ -1,45 +1,55 @@
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, UploadFile, File, Form, Query, HTTPException, Request, WebSocket
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, FileResponse
+from fastapi.responses import JSONResponse, FileResponse, Response
 import shutil
 import os
 import uuid
-from typing import List, Dict
+from typing import List, Dict, Optional
 import json
-from pdf2image import convert_from_path
+import time
 from docx2pdf import convert
-import subprocess
 import asyncio
+import functools
 from concurrent.futures import ThreadPoolExecutor
 
-from ocr_service import process_image
+from ocr_service import process_page, result_cache, warm_up_table_models, warmup_status, FAILED as WARMUP_FAILED
+from page_image import PageImage
+from rasterizer import count_pdf_pages, stream_pdf_pages, PDF_DPI, PDF_WINDOW
+from job_queue import JobCancelled, JobScheduler, JobStore, QueueFullError, COMPLETED, CANCELLED
+from result_cache import make_key
+from upload_ingest import (UploadBudget, UploadTooLarge, ingest, iter_upload, new_file_id,
+                           MAX_UPLOAD_FILE_BYTES, MAX_UPLOAD_REQUEST_BYTES)
+from visualization import (VisualizationCache, RemergeUnavailable, page_data_path, render_visualization, save_page_data,
+                           load_page_data, stored_pages, remerge_page_data)
+from event_hub import EventHub
+from doc_converter import ConversionService, DOC_CONVERT_WORKERS, DOC_CONVERT_TIMEOUT
+from result_writer import ResultWriter, encode_results, OUTPUT_FORMATS, BOX_FORMATS, JSON, POINTS
+from metrics import (REGISTRY, PROMETHEUS_CONTENT_TYPE, Trace, JOB_QUEUE_DEPTH, JOBS_RUNNING,
+                     PAGES_IN_PROGRESS, PAGE_WORKERS, PAGES_PROCESSED)
 
 app = FastAPI()
 
-# Thread pool for CPU-bound OCR tasks
+# Thread pool for CPU-bound conversion tasks
 executor = ThreadPoolExecutor(max_workers=3)
 
-# WebSocket connection manager
-class ConnectionManager:
-    def __init__(self):
-        self.active_connections: List[WebSocket] = []
+# Job scheduler: documents run JOB_WORKERS at a time from a bounded priority queue;
+# uploads wait up to JOB_SUBMIT_TIMEOUT seconds for room before being rejected
+JOB_WORKERS = 2
+JOB_QUEUE_SIZE = 100
+JOB_SUBMIT_TIMEOUT = 5
 
-    async def connect(self, websocket: WebSocket):
-        await websocket.accept()
-        self.active_connections.append(websocket)
+# Pages of one document processed concurrently, and the shared pool they run on
+PAGES_IN_FLIGHT = 6
+PAGE_EXECUTOR_WORKERS = 12
+page_executor = ThreadPoolExecutor(max_workers=PAGE_EXECUTOR_WORKERS)
+PAGE_WORKERS.set(PAGE_EXECUTOR_WORKERS)
 
-    def disconnect(self, websocket: WebSocket):
-        self.active_connections.remove(websocket)
+# Push raw OCR segments over the WebSocket as HunyuanOCR produces them
+STREAM_SEGMENTS = True
 
-    async def broadcast(self, message: dict):
-        for connection in self.active_connections:
-            try:
-                await connection.send_json(message)
-            except:
-                pass
-
-manager = ConnectionManager()
+# Job events go to the WebSocket clients subscribed to that file_id (see event_hub)
+manager = EventHub()
 
 # CORS configuration
 app.add_middleware(
@@ -52,13 +62,158 @@ app.add_middleware(
 
 # Directories
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-UPLOAD_DIR = os.path.join(BASE_DIR, "uploads")
-RESULT_DIR = os.path.join(BASE_DIR, "results")
+# Uploads, results, the job database and scratch space; IOU_DATA_DIR moves them out of
+# the checkout (the offline bench points it at a temporary directory)
+DATA_DIR = os.environ.get("IOU_DATA_DIR", BASE_DIR)
+UPLOAD_DIR = os.path.join(DATA_DIR, "uploads")
+RESULT_DIR = os.path.join(DATA_DIR, "results")
+JOBS_DB = os.path.join(DATA_DIR, "jobs.sqlite3")
+# LibreOffice profiles and per-conversion scratch directories
+WORK_DIR = os.path.join(DATA_DIR, "work")
 
 # Ensure directories exist
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 os.makedirs(RESULT_DIR, exist_ok=True)
 
+# Word -> PDF conversion: "libreoffice", or "placeholder" to run without LibreOffice
+DOC_CONVERTER = "libreoffice"
+converter_service = ConversionService(WORK_DIR, DOC_CONVERTER, workers=DOC_CONVERT_WORKERS, timeout=DOC_CONVERT_TIMEOUT)
+
+# Rendered page visualizations, produced on first request
+vis_cache = VisualizationCache()
+
+# Must be registered before the /results static mount so it takes precedence
+@app.get("/results/{file_id}_page_{page_num:int}_vis.jpg")
+async def get_visualization(file_id: str, page_num: int, max_side: Optional[int] = None,
+                            iou_threshold: Optional[float] = None):
+    data_path = page_data_path(RESULT_DIR, file_id, page_num)
+    if not os.path.exists(data_path):
+        # Results produced before visualizations became lazy
+        vis_path = os.path.join(RESULT_DIR, f"{file_id}_page_{page_num}_vis.jpg")
+        if os.path.exists(vis_path):
+            return FileResponse(vis_path)
+        raise HTTPException(status_code=404, detail="Page not found")
+    loop = asyncio.get_running_loop()
+    try:
+        content = await loop.run_in_executor(
+            executor, vis_cache.get_or_render, (file_id, page_num, max_side, iou_threshold),
+            functools.partial(render_visualization, data_path, UPLOAD_DIR, max_side, iou_threshold=iou_threshold)
+        )
+    except RemergeUnavailable as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return Response(content=content, media_type="image/jpeg")
+
+# Results of one finished page, available while the rest of the document is still running
+@app.get("/results/{file_id}/pages/{page_num}")
+async def get_page_results(file_id: str, page_num: int, box_format: str = POINTS):
+    if box_format not in BOX_FORMATS:
+        raise HTTPException(status_code=400, detail=f"box_format must be one of {', '.join(BOX_FORMATS)}")
+    data_path = page_data_path(RESULT_DIR, file_id, page_num)
+    if not os.path.exists(data_path):
+        raise HTTPException(status_code=404, detail="Page not found or not finished yet")
+    data = await asyncio.get_running_loop().run_in_executor(executor, load_page_data, data_path)
+    return {"page": page_num, "results": encode_results(data["results"], box_format)}
+
+# Thresholds one re-merge request may sweep
+REMERGE_MAX_THRESHOLDS = 50
+
+def remerge_file(file_id, thresholds):
+    """Merge every stored page of `file_id` again at each threshold.
+
+    Returns {page_num: (page data, [results per threshold])}; only merge_results runs,
+    from the raw OCR segments and table cells kept in the page data.
+    """
+    pages = {}
+    for page_num in stored_pages(RESULT_DIR, file_id):
+        data = load_page_data(page_data_path(RESULT_DIR, file_id, page_num))
+        pages[page_num] = (data, remerge_page_data(data, thresholds))
+    return pages
+
+def apply_remerge(file_id, job, pages):
+    """Make a single-threshold re-merge the file's results: page data and result file."""
+    writer = ResultWriter(RESULT_DIR, file_id, job["output_format"], job["box_format"])
+    try:
+        for page_num, (data, (results,)) in pages.items():
+            save_page_data(page_data_path(RESULT_DIR, file_id, page_num), data["image"], results,
+                           data["table_cells"], data.get("ocr_results"))
+            writer.write_page(page_num, results)
+    except Exception:
+        writer.abort()
+        raise
+    writer.close()
+    return writer.filename
+
+# Re-run only the merge for a processed file, at one or several IoU thresholds.
+# Must be registered before the /results static mount so it takes precedence
+@app.post("/results/{file_id}/remerge")
+async def remerge_results(
+    file_id: str,
+    iou_threshold: List[float] = Form(...),
+    visualize: bool = Form(False),
+    include_results: bool = Form(True),
+    apply: bool = Form(False),
+    box_format: str = Form(POINTS)
+):
+    """Merge the stored OCR segments and cells again with new thresholds.
+
+    Repeat `iou_threshold` to sweep several values in one request. Each threshold gets
+    per-page results (unless `include_results` is false), a summary and, with `visualize`,
+    visualization URLs rendered on first request. `apply` (one threshold only) replaces
+    the file's stored results with the re-merged ones.
+    """
+    if box_format not in BOX_FORMATS:
+        raise HTTPException(status_code=400, detail=f"box_format must be one of {', '.join(BOX_FORMATS)}")
+    if len(iou_threshold) > REMERGE_MAX_THRESHOLDS:
+        raise HTTPException(status_code=400, detail=f"At most {REMERGE_MAX_THRESHOLDS} thresholds per request")
+    if any(not 0 <= t <= 1 for t in iou_threshold):
+        raise HTTPException(status_code=400, detail="iou_threshold must be between 0 and 1")
+    job = job_store.get(file_id)
+    if apply:
+        if len(iou_threshold) != 1:
+            raise HTTPException(status_code=400, detail="apply needs exactly one iou_threshold")
+        if job is None:
+            raise HTTPException(status_code=404, detail="Job not found")
+        if job["status"] != COMPLETED:
+            raise HTTPException(status_code=409, detail=f"Job is {job['status']}, only completed jobs can be re-merged")
+
+    start = time.perf_counter()
+    loop = asyncio.get_running_loop()
+    try:
+        pages = await loop.run_in_executor(executor, remerge_file, file_id, iou_threshold)
+    except RemergeUnavailable as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if not pages:
+        raise HTTPException(status_code=404, detail="No stored pages for this file")
+
+    sweep = []
+    for i, threshold in enumerate(iou_threshold):
+        summary = {"items": 0, "table_cells": 0, "segments_in_cells": 0}
+        page_entries = []
+        for page_num, (data, page_results) in pages.items():
+            results = page_results[i]
+            in_cells = [item for item in results if item.get("is_table_cell")]
+            segments = len(data.get("ocr_results", data["results"]))
+            summary["items"] += len(results)
+            summary["table_cells"] += len(in_cells)
+            summary["segments_in_cells"] += segments - (len(results) - len(in_cells))
+            entry = {"page": page_num}
+            if include_results:
+                entry["results"] = encode_results(results, box_format)
+            if visualize:
+                entry["vis_url"] = f"/results/{file_id}_page_{page_num}_vis.jpg?iou_threshold={threshold}"
+            page_entries.append(entry)
+        sweep.append({"iou_threshold": threshold, "summary": summary, "pages": page_entries})
+
+    response = {"file_id": file_id, "pages": len(pages), "thresholds": sweep}
+    if apply:
+        filename = await loop.run_in_executor(executor, apply_remerge, file_id, job, pages)
+        # The results no longer match the upload settings, so later uploads must not dedup to them
+        job_store.update(file_id, iou_threshold=iou_threshold[0], content_key=None)
+        vis_cache.invalidate(file_id)
+        response["result_url"] = f"/results/{filename}"
+    response["elapsed_ms"] = round((time.perf_counter() - start) * 1000, 3)
+    return response
+
 # Mount static files for frontend
 app.mount("/static", StaticFiles(directory=os.path.join(BASE_DIR, "frontend")), name="static")
 app.mount("/results", StaticFiles(directory=RESULT_DIR), name="results")
@@ -69,17 +224,46 @@ async def read_root():
 
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
-    await manager.connect(websocket)
+    """Job events. Send {"action": "subscribe", "file_ids": [...], "since": {file_id: seq}} to
+    receive a file's events, replaying those after `seq`; "unsubscribe" stops them, "*" means all files."""
+    await manager.serve(websocket)
+
+def run_ocr_task(page, mode, prompt, iou_threshold, image_path, data_path, trace=None, page_num=None,
+                 on_segments=None, cancel_event=None):
     try:
-        while True:
-            await websocket.receive_text()
-    except WebSocketDisconnect:
-        manager.disconnect(websocket)
+        # Pages wait in the executor queue; one whose job was cancelled meanwhile is skipped
+        if cancel_event is not None and cancel_event.is_set():
+            raise JobCancelled()
+        with PAGES_IN_PROGRESS.track():
+            output = process_page(page, mode, prompt, iou_threshold, trace=trace, page_num=page_num,
+                                  on_segments=on_segments)
+        # Keep what a lazy visualization needs instead of drawing every page up front
+        if not os.path.exists(image_path):
+            with open(image_path, "wb") as f:
+                f.write(page.data)
+        # Raw segments let /results/{file_id}/remerge redo the merge without OCR; pure OCR has no merge
+        save_page_data(data_path, os.path.basename(image_path), output["results"], output["table_cells"],
+                       output["ocr_results"] if mode != "Hunyuanocr" else None)
+        return output
+    finally:
+        page.release()
+
+async def process_file_async(file_path, filename, file_id, mode, prompt, iou_threshold,
+                             cancel_event=None, on_progress=None, trace=False,
+                             output_format=JSON, box_format=POINTS, on_complete=None):
+    """Process one uploaded file and return its final job state.
 
-def run_ocr_task(img_path, mode, prompt, iou_threshold, vis_path):
-    return process_image(img_path, mode, prompt, iou_threshold, vis_path)
+    Setting `cancel_event` stops pages that have not started yet; `on_progress(done, total)`
+    is called as pages complete and `on_complete(file_result)` once the file is done. With
+    `trace`, per-page stage spans are written to {file_id}_trace.json next to the results. Results are written as `output_format`
+    (see result_writer) with boxes encoded as `box_format`.
+    """
+    job_trace = Trace(file_id) if trace else None
+    writer = None
+    def check_cancelled():
+        if cancel_event is not None and cancel_event.is_set():
+            raise JobCancelled()
 
-async def process_file_async(file_path, filename, file_id, mode, prompt, iou_threshold):
     try:
         ext = os.path.splitext(filename)[1].lower()
         temp_images = []
@@ -91,89 +275,147 @@ async def process_file_async(file_path, filename, file_id, mode, prompt, iou_thr
             "message": f"Start processing {filename}..."
         })
 
-        # 1. Convert to images
+        # 1. Work out where pages come from; PDFs are rendered lazily, window by window
+        loop = asyncio.get_running_loop()
+        pdf_path = None
         if ext == ".pdf":
-            await manager.broadcast({"type": "log", "file_id": file_id, "message": "Converting PDF to images..."})
-            
-            # Run conversion in thread pool to avoid blocking
-            loop = asyncio.get_event_loop()
-            images = await loop.run_in_executor(executor, convert_from_path, file_path)
-            
-            for i, img in enumerate(images):
-                img_path = os.path.join(UPLOAD_DIR, f"{file_id}_page_{i}.jpg")
-                img.save(img_path, "JPEG")
-                temp_images.append((i+1, img_path))
+            pdf_path = file_path
                 
         elif ext in [".docx", ".doc"]:
             await manager.broadcast({"type": "log", "file_id": file_id, "message": "Converting Word to PDF..."})
             
-            pdf_path = os.path.join(UPLOAD_DIR, f"{file_id}.pdf")
-            subprocess.run(["libreoffice", "--headless", "--convert-to", "pdf", "--outdir", UPLOAD_DIR, file_path], check=True)
-            
-            generated_pdf = os.path.join(UPLOAD_DIR, f"{file_id}.pdf")
-            if os.path.exists(generated_pdf):
-                loop = asyncio.get_event_loop()
-                images = await loop.run_in_executor(executor, convert_from_path, generated_pdf)
-                for i, img in enumerate(images):
-                    img_path = os.path.join(UPLOAD_DIR, f"{file_id}_page_{i}.jpg")
-                    img.save(img_path, "JPEG")
-                    temp_images.append((i+1, img_path))
-            else:
-                 raise Exception("Word conversion failed to generate PDF")
+            pdf_path = await converter_service.convert(file_path, os.path.join(UPLOAD_DIR, f"{file_id}.pdf"), job_id=file_id)
                  
         elif ext in [".jpg", ".jpeg", ".png", ".bmp", ".tiff"]:
             temp_images.append((1, file_path))
-            
-        total_pages = len(temp_images)
-        ocr_data = []
+
+        if pdf_path is not None:
+            await manager.broadcast({"type": "log", "file_id": file_id, "message": "Converting PDF to images..."})
+            total_pages = await loop.run_in_executor(executor, count_pdf_pages, pdf_path)
+        else:
+            total_pages = len(temp_images)
+
+        writer = ResultWriter(RESULT_DIR, file_id, output_format, box_format)
         file_result = {
             "filename": filename,
             "file_id": file_id,
             "pages": [],
+            "format": output_format,
+            "result_url": "",
             "json_url": ""
         }
 
-        # 2. Process each page
-        for idx, (page_num, img_path) in enumerate(temp_images):
+        # 2. Process pages, several in flight at once; OCR and table stages are
+        #    throttled separately inside ocr_service. A page slot is taken before the
+        #    next page is rendered, which keeps rendered-but-unprocessed pages bounded.
+        page_slots = asyncio.Semaphore(PAGES_IN_FLIGHT)
+        completed = 0
+
+        async def run_page(page_num, page, image_path):
+            nonlocal completed
+            try:
+                check_cancelled()
+                print(f"[{file_id}] Processing page {page_num}/{total_pages} - {page.name}")
+                
+                vis_filename = f"{file_id}_page_{page_num}_vis.jpg"
+                data_path = page_data_path(RESULT_DIR, file_id, page_num)
+
+                on_segments = None
+                if STREAM_SEGMENTS:
+                    # Called from OCR threads; hop back onto this loop to broadcast
+                    def on_segments(segments, replace=False, page_num=page_num):
+                        asyncio.run_coroutine_threadsafe(manager.broadcast({
+                            "type": "segments",
+                            "file_id": file_id,
+                            "page": page_num,
+                            "segments": segments,
+                            "replace": replace
+                        }), loop)
+                
+                try:
+                    page_output = await loop.run_in_executor(page_executor, run_ocr_task, page, mode, prompt, iou_threshold,
+                                                             image_path, data_path, job_trace, page_num, on_segments,
+                                                             cancel_event)
+                    PAGES_PROCESSED.inc(mode=mode, outcome="ok")
+                    print(f"[{file_id}] Page {page_num} completed.")
+                except JobCancelled:
+                    raise
+                except Exception as e:
+                    PAGES_PROCESSED.inc(mode=mode, outcome="error")
+                    print(f"[{file_id}] Error processing page {page_num}: {e}")
+                    raise e
+            finally:
+                page_slots.release()
+
+            # Each page goes out as soon as it is done instead of being held until the end
+            writer.write_page(page_num, page_output["results"])
+            completed += 1
+            if on_progress is not None:
+                on_progress(completed, total_pages)
             await manager.broadcast({
                 "type": "progress", 
                 "file_id": file_id, 
-                "current": idx + 1, 
+                "current": completed, 
                 "total": total_pages,
-                "message": f"Processing page {page_num}/{total_pages}..."
-            })
-            
-            print(f"[{file_id}] Processing page {page_num}/{total_pages} - {img_path}")
-            
-            vis_filename = f"{file_id}_page_{page_num}_vis.jpg"
-            vis_path = os.path.join(RESULT_DIR, vis_filename)
-            
-            # Run OCR in thread pool
-            loop = asyncio.get_event_loop()
-            try:
-                page_ocr = await loop.run_in_executor(executor, run_ocr_task, img_path, mode, prompt, iou_threshold, vis_path)
-                print(f"[{file_id}] Page {page_num} completed.")
-            except Exception as e:
-                print(f"[{file_id}] Error processing page {page_num}: {e}")
-                raise e
-            
-            ocr_data.append({
+                "message": f"Processed {completed}/{total_pages} pages (page {page_num} done)...",
                 "page": page_num,
-                "results": page_ocr
+                "page_url": f"/results/{file_id}/pages/{page_num}",
+                "table_gate": page_output["table_gate"]
             })
-            
+            return page_num, vis_filename, page_output["table_gate"]
+
+        async def iter_pages():
+            if pdf_path is None:
+                for page_num, img_path in temp_images:
+                    yield page_num, await loop.run_in_executor(executor, PageImage.from_path, img_path), img_path
+                return
+            # Rendered pages go straight to the pipeline in memory; the encoded page is only
+            # written out afterwards, for on-demand visualization
+            async for page_num, img in stream_pdf_pages(pdf_path, executor, dpi=PDF_DPI, window=PDF_WINDOW, total_pages=total_pages):
+                img_path = os.path.join(UPLOAD_DIR, f"{file_id}_page_{page_num - 1}.jpg")
+                yield page_num, PageImage.from_pil(img, name=f"{file_id}_page_{page_num}"), img_path
+
+        await manager.broadcast({
+            "type": "progress", 
+            "file_id": file_id, 
+            "current": 0, 
+            "total": total_pages,
+            "message": f"Processing {total_pages} pages..."
+        })
+        page_tasks = []
+        try:
+            async for page_num, page, image_path in iter_pages():
+                check_cancelled()
+                await page_slots.acquire()
+                page_tasks.append(asyncio.create_task(run_page(page_num, page, image_path)))
+            # gather() keeps input order, so pages come back in page order
+            page_outputs = await asyncio.gather(*page_tasks)
+        except Exception:
+            for task in page_tasks:
+                task.cancel()
+            raise
+
+        for page_num, vis_filename, table_gate in page_outputs:
             file_result["pages"].append({
                 "page_num": page_num,
-                "vis_url": f"/results/{vis_filename}"
+                "vis_url": f"/results/{vis_filename}",
+                "results_url": f"/results/{file_id}/pages/{page_num}",
+                "table_gate": table_gate
             })
 
-        # 3. Save JSON
-        json_filename = f"{file_id}.json"
-        json_path = os.path.join(RESULT_DIR, json_filename)
-        with open(json_path, "w", encoding="utf-8") as f:
-            json.dump(ocr_data, f, ensure_ascii=False, indent=2)
-            
-        file_result["json_url"] = f"/results/{json_filename}"
+        # 3. Finish the result file
+        await loop.run_in_executor(executor, writer.close)
+        file_result["result_url"] = f"/results/{writer.filename}"
+        if output_format == JSON:
+            file_result["json_url"] = file_result["result_url"]
+        if job_trace is not None:
+            trace_filename = f"{file_id}_trace.json"
+            with open(os.path.join(RESULT_DIR, trace_filename), "w", encoding="utf-8") as f:
+                json.dump(job_trace.to_dict(), f, ensure_ascii=False, indent=2)
+            file_result["trace_url"] = f"/results/{trace_filename}"
+        print(f"[{file_id}] Result cache: {result_cache.stats()}")
+        if on_complete is not None:
+            on_complete(file_result)
         
         # Notify: Complete
         await manager.broadcast({
@@ -181,68 +423,275 @@ async def process_file_async(file_path, filename, file_id, mode, prompt, iou_thr
             "file_id": file_id, 
             "result": file_result
         })
+        return COMPLETED
+
+    except JobCancelled:
+        if writer is not None:
+            writer.abort()
+        print(f"[{file_id}] Cancelled.")
+        await manager.broadcast({
+            "type": "cancelled", 
+            "file_id": file_id, 
+            "message": "Job cancelled"
+        })
+        return CANCELLED
             
     except Exception as e:
+        if writer is not None:
+            writer.abort()
         print(f"Error processing {filename}: {e}")
         await manager.broadcast({
             "type": "error", 
             "file_id": file_id, 
             "message": str(e)
         })
+        raise
+
+async def run_job(job, cancel_event):
+    def on_progress(done, total):
+        job_store.update(job["file_id"], pages_done=done, pages_total=total)
+
+    def on_complete(file_result):
+        # Kept so a later upload of the same content can be answered without processing
+        job_store.update(job["file_id"], result=json.dumps(file_result, ensure_ascii=False))
+
+    return await process_file_async(
+        job["file_path"], job["filename"], job["file_id"], job["mode"], job["prompt"],
+        job["iou_threshold"], cancel_event=cancel_event, on_progress=on_progress,
+        trace=bool(job.get("trace")), output_format=job.get("output_format", JSON),
+        box_format=job.get("box_format", POINTS), on_complete=on_complete
+    )
+
+job_store = JobStore(JOBS_DB)
+scheduler = JobScheduler(job_store, run_job, workers=JOB_WORKERS, max_queued=JOB_QUEUE_SIZE)
+JOB_QUEUE_DEPTH.set_function(lambda: scheduler.depth)
+JOBS_RUNNING.set_function(lambda: scheduler.running)
+warmup_future = None
+
+@app.on_event("startup")
+async def start_scheduler():
+    await scheduler.start()
+
+@app.on_event("startup")
+async def start_warm_up():
+    # Not awaited: the server accepts connections right away and /readyz reports
+    # when the table models are loaded
+    global warmup_future
+    warmup_future = asyncio.get_running_loop().run_in_executor(None, warm_up_table_models)
+
+@app.on_event("startup")
+async def start_converters():
+    # LibreOffice listeners start in the background, like the table model warm-up
+    asyncio.get_running_loop().create_task(converter_service.start())
+
+@app.on_event("shutdown")
+async def stop_scheduler():
+    await scheduler.stop()
+
+@app.on_event("shutdown")
+async def stop_converters():
+    await converter_service.aclose()
+
+DEFAULT_PROMPT = "检测并识别图片中的文字，输出每段文本的坐标。特别注意表格内容，如果同一个单元格内的文字分多行显示，请务必将其合并为单行文本输出，不要分开。例如单元格内第一行是'ABC'，第二行是'D'，应直接输出'ABCD'。以JSON数组形式返回，每个元素包含text与bbox，bbox为[x1,y1,x2,y2]，坐标单位为像素，禁止返回非JSON内容。"
+
+# Requests announcing more than the per-request limit are turned away before their body is read
+@app.middleware("http")
+async def limit_upload_size(request: Request, call_next):
+    if request.method == "POST" and request.url.path.startswith("/upload"):
+        length = request.headers.get("content-length")
+        if length and length.isdigit() and int(length) > MAX_UPLOAD_REQUEST_BYTES:
+            return JSONResponse(status_code=413, content={
+                "status": "too_large",
+                "message": f"Upload exceeds the request limit of {MAX_UPLOAD_REQUEST_BYTES} bytes"
+            })
+    return await call_next(request)
+
+def validate_upload_settings(output_format, box_format):
+    if output_format not in OUTPUT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {', '.join(OUTPUT_FORMATS)}")
+    if box_format not in BOX_FORMATS:
+        raise HTTPException(status_code=400, detail=f"box_format must be one of {', '.join(BOX_FORMATS)}")
+
+async def submit_upload(incoming, filename, settings):
+    """Queue an ingested upload as a job and return its file info.
+
+    When a queued, running or finished job already has the same content and settings,
+    the upload is dropped and that job is returned instead (with its result if done).
+    Raises QueueFullError when the queue filled up in the meantime.
+    """
+    ext = os.path.splitext(filename)[1].lower()
+    content_key = make_key("upload", incoming.sha256, settings["mode"], settings["prompt"],
+                           settings["iou_threshold"], settings["output_format"], settings["box_format"],
+                           bool(settings["trace"]))
+    # Cheap check first so a duplicate is answered even when the queue is full
+    existing = job_store.find_by_content(content_key)
+    if existing is not None:
+        os.remove(incoming.path)
+        return duplicate_info(existing, filename)
+
+    file_id = new_file_id(filename)
+    file_path = os.path.join(UPLOAD_DIR, f"{file_id}{ext}")
+    os.replace(incoming.path, file_path)
+    try:
+        # The store checks again and inserts atomically, for identical uploads arriving together
+        existing = await scheduler.submit({
+            "file_id": file_id,
+            "filename": filename,
+            "file_path": file_path,
+            "content_key": content_key,
+            **settings
+        })
+    except QueueFullError:
+        os.remove(file_path)
+        raise
+    if existing is not None:
+        os.remove(file_path)
+        return duplicate_info(existing, filename)
+    return {"file_id": file_id, "filename": filename}
+
+def duplicate_info(existing, filename):
+    info = {"file_id": existing["file_id"], "filename": filename, "duplicate": True, "status": existing["status"]}
+    if existing["result"]:
+        info["result"] = json.loads(existing["result"])
+    return info
+
+def queue_full_response(accepted, total):
+    return JSONResponse(status_code=429, content={
+        "status": "queue_full",
+        "message": f"Job queue is full, {len(accepted)} of {total} files accepted. Please retry later.",
+        "files": accepted
+    })
+
+def too_large_response(error, accepted):
+    return JSONResponse(status_code=413, content={"status": "too_large", "message": str(error), "files": accepted})
 
 @app.post("/upload")
 async def upload_files(
     files: List[UploadFile] = File(...),
     mode: str = Form("Table"),
-    prompt: str = Form("检测并识别图片中的文字，输出每段文本的坐标。特别注意表格内容，如果同一个单元格内的文字分多行显示，请务必将其合并为单行文本输出，不要分开。例如单元格内第一行是'ABC'，第二行是'D'，应直接输出'ABCD'。以JSON数组形式返回，每个元素包含text与bbox，bbox为[x1,y1,x2,y2]，坐标单位为像素，禁止返回非JSON内容。"),
-    iou_threshold: float = Form(0.8)
+    prompt: str = Form(DEFAULT_PROMPT),
+    iou_threshold: float = Form(0.8),
+    priority: int = Form(0),
+    trace: bool = Form(False),
+    output_format: str = Form(JSON, alias="format"),
+    box_format: str = Form(POINTS)
 ):
-    import time
-    
-    tasks = []
-    # We need to broadcast to all connected clients? 
-    # Or assume the client who uploaded is listening. 
-    # Ideally, we should pass a session ID, but for simplicity, we broadcast or pick the first active connection.
-    # The frontend should establish WS connection first.
-    
-    # Simple strategy: Broadcast to all connected clients (assuming single user or small team)
-    # If multiple users, we need session_id. Let's assume simple use case.
-    # target_ws = manager.active_connections[0] if manager.active_connections else None
-    # Updated: Broadcast to all clients as target_ws logic was flaky
-    
+    # Progress goes to WebSocket clients that subscribe to the returned file_ids; events sent
+    # before they subscribe are replayed to them
+    validate_upload_settings(output_format, box_format)
+    settings = {"mode": mode, "prompt": prompt, "iou_threshold": iou_threshold, "priority": priority,
+                "trace": trace, "output_format": output_format, "box_format": box_format}
+
     file_info_list = []
+    budget = UploadBudget(MAX_UPLOAD_REQUEST_BYTES)
     
     for file in files:
-        timestamp = int(time.time() * 1000)
-        filename = file.filename
-        name, ext = os.path.splitext(filename)
-        ext = ext.lower()
-        file_id = f"{timestamp}_{name}"
-        
-        file_path = os.path.join(UPLOAD_DIR, f"{file_id}{ext}")
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-            
-        file_info_list.append({
-            "file_id": file_id,
-            "filename": filename
-        })
+        # Backpressure: wait briefly for room in the job queue, otherwise reject
+        if not await scheduler.wait_for_capacity(JOB_SUBMIT_TIMEOUT):
+            return queue_full_response(file_info_list, len(files))
 
-        # Create async task
-        task = asyncio.create_task(
-            process_file_async(file_path, filename, file_id, mode, prompt, iou_threshold)
-        )
-        tasks.append(task)
+        # Chunked, hashed copy off the event loop; Starlette has already spooled the part
+        try:
+            incoming = await ingest(iter_upload(file), UPLOAD_DIR, os.path.splitext(file.filename)[1].lower(),
+                                    max_bytes=MAX_UPLOAD_FILE_BYTES, budget=budget)
+        except UploadTooLarge as e:
+            return too_large_response(f"{file.filename}: {e}", file_info_list)
+        try:
+            file_info_list.append(await submit_upload(incoming, file.filename, settings))
+        except QueueFullError:
+            return queue_full_response(file_info_list, len(files))
         
     # Return immediately with file IDs so frontend can track
     return JSONResponse(content={"status": "processing_started", "files": file_info_list})
 
+# One file as the raw request body: written to disk as it arrives, without multipart spooling
+@app.post("/upload/stream")
+async def upload_stream(
+    request: Request,
+    filename: str,
+    mode: str = "Table",
+    prompt: str = DEFAULT_PROMPT,
+    iou_threshold: float = 0.8,
+    priority: int = 0,
+    trace: bool = False,
+    output_format: str = Query(JSON, alias="format"),
+    box_format: str = POINTS
+):
+    validate_upload_settings(output_format, box_format)
+    settings = {"mode": mode, "prompt": prompt, "iou_threshold": iou_threshold, "priority": priority,
+                "trace": trace, "output_format": output_format, "box_format": box_format}
+    if not await scheduler.wait_for_capacity(JOB_SUBMIT_TIMEOUT):
+        return queue_full_response([], 1)
+    try:
+        incoming = await ingest(request.stream(), UPLOAD_DIR, os.path.splitext(filename)[1].lower(),
+                                max_bytes=min(MAX_UPLOAD_FILE_BYTES, MAX_UPLOAD_REQUEST_BYTES))
+    except UploadTooLarge as e:
+        return too_large_response(f"{filename}: {e}", [])
+    try:
+        info = await submit_upload(incoming, filename, settings)
+    except QueueFullError:
+        return queue_full_response([], 1)
+    return JSONResponse(content={"status": "processing_started", "files": [info]})
+
+
+@app.get("/jobs")
+async def jobs_summary():
+    return {"queued": scheduler.depth, "running": scheduler.running, "capacity": scheduler.max_queued}
+
+@app.get("/jobs/{file_id}")
+async def job_status(file_id: str):
+    job = job_store.get(file_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    job.pop("prompt", None)
+    job.pop("file_path", None)
+    job.pop("content_key", None)
+    job["result"] = json.loads(job["result"]) if job.get("result") else None
+    job["queue_position"] = scheduler.position(file_id)
+    return job
+
+@app.post("/jobs/{file_id}/cancel")
+async def cancel_job(file_id: str):
+    if not scheduler.cancel(file_id):
+        raise HTTPException(status_code=409, detail="Job is not queued or running")
+    return {"status": "cancelling"}
+
+@app.get("/healthz")
+async def healthz():
+    """Liveness: the process is up and serving requests."""
+    return {"status": "ok"}
+
+@app.get("/readyz")
+async def readyz():
+    """Readiness: 200 once the table models are warmed up, 503 (with per-model status) until then.
+
+    A model outside WARMUP_REQUIRED_MODELS that failed gives 200 "degraded"; a required one, 503 "failed".
+    """
+    ready, models = warmup_status()
+    failed = [info for info in models.values() if info["status"] == WARMUP_FAILED]
+    if ready:
+        status = "degraded" if failed else "ready"
+    elif any(info["required"] for info in failed):
+        status = "failed"
+    else:
+        status = "warming_up"
+    return JSONResponse(status_code=200 if ready else 503, content={"status": status, "models": models})
+
+@app.get("/metrics")
+async def metrics():
+    return Response(content=REGISTRY.render(), media_type=PROMETHEUS_CONTENT_TYPE)
+
+@app.get("/cache/stats")
+async def cache_stats():
+    return result_cache.stats()
 
 @app.delete("/delete/{file_id}")
 async def delete_file(file_id: str):
     # Try to clean up uploads and results with this ID
     # This is a basic cleanup, matching patterns
     try:
+        scheduler.cancel(file_id)
+        job_store.delete(file_id)
         for root, dirs, files in os.walk(UPLOAD_DIR):
             for file in files:
                 if file.startswith(file_id):
@@ -251,6 +700,7 @@ async def delete_file(file_id: str):
             for file in files:
                 if file.startswith(file_id):
                     os.remove(os.path.join(root, file))
+        vis_cache.invalidate(file_id)
         return {"status": "success"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -258,6 +708,8 @@ async def delete_file(file_id: str):
 @app.delete("/clear")
 async def clear_all():
     try:
+        scheduler.cancel_all()
+        job_store.clear()
         for folder in [UPLOAD_DIR, RESULT_DIR]:
             for filename in os.listdir(folder):
                 file_path = os.path.join(folder, filename)
@@ -265,6 +717,8 @@ async def clear_all():
                     os.unlink(file_path)
                 elif os.path.isdir(file_path):
                     shutil.rmtree(file_path)
+        result_cache.clear()
+        vis_cache.invalidate()
         return {"status": "success"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
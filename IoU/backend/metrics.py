@@ -0,0 +1,264 @@
+import threading
+import time
+from contextlib import contextmanager
+
+
+def _label_key(labelnames, labels):
+    missing = set(labelnames) - set(labels)
+    if missing:
+        raise ValueError(f"Missing labels: {sorted(missing)}")
+    return tuple(str(labels[name]) for name in labelnames)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labelnames, key, extra=None):
+    pairs = list(zip(labelnames, key))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def header(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values = {} if self.labelnames else {(): 0}
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return self.header() + [f"{self.name}{_format_labels(self.labelnames, k)} {_format_value(v)}" for k, v in items]
+
+
+class Gauge(_Metric):
+    """Gauge set directly, tracked with `track()`, or computed at scrape time via `set_function`."""
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values = {} if self.labelnames else {(): 0}
+        self._functions = {}
+
+    def set(self, value, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set_function(self, fn, **labels):
+        with self._lock:
+            self._functions[_label_key(self.labelnames, labels)] = fn
+
+    @contextmanager
+    def track(self, **labels):
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+    def render(self):
+        with self._lock:
+            values = dict(self._values)
+            functions = dict(self._functions)
+        for key, fn in functions.items():
+            try:
+                values[key] = fn()
+            except Exception:
+                continue
+        return self.header() + [f"{self.name}{_format_labels(self.labelnames, k)} {_format_value(v)}"
+                                for k, v in sorted(values.items())]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=(0.01, 0.05, 0.1, 0.5, 1, 5, 10, 60)):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        self._series = {}
+
+    def observe(self, value, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series["buckets"][i] += 1
+                    break
+            series["sum"] += value
+            series["count"] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def totals(self):
+        """{label values: (count, sum)} for every series observed so far."""
+        with self._lock:
+            return {key: (series["count"], series["sum"]) for key, series in self._series.items()}
+
+    def render(self):
+        lines = self.header()
+        with self._lock:
+            items = sorted((k, {"buckets": list(v["buckets"]), "sum": v["sum"], "count": v["count"]})
+                           for k, v in self._series.items())
+        for key, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, series["buckets"]):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, ("le", _format_value(bound)))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(series['sum'])}")
+            lines.append(f"{self.name}_count{labels} {series['count']}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format (version 0.0.4)."""
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    "iou_stage_duration_seconds", "Time spent per pipeline stage and page.", ["stage"],
+    buckets=(0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+))
+STAGE_IN_PROGRESS = REGISTRY.register(Gauge(
+    "iou_stage_in_progress", "Stage calls currently running.", ["stage"]
+))
+STAGE_CONCURRENCY_LIMIT = REGISTRY.register(Gauge(
+    "iou_stage_concurrency_limit", "Configured concurrency limit per stage.", ["stage"]
+))
+SEGMENTS_PER_PAGE = REGISTRY.register(Histogram(
+    "iou_ocr_segments_per_page", "OCR segments detected per page.",
+    buckets=(0, 10, 50, 100, 200, 400, 800, 1600)
+))
+CELLS_PER_PAGE = REGISTRY.register(Histogram(
+    "iou_table_cells_per_page", "Table cells detected per page.", ["mode"],
+    buckets=(0, 10, 50, 100, 250, 500, 1000, 2000)
+))
+OCR_COMPLETION_TOKENS = REGISTRY.register(Histogram(
+    "iou_ocr_completion_tokens", "Tokens generated by HunyuanOCR per request.",
+    buckets=(64, 256, 512, 1024, 2048, 3072, 4096, 8192)
+))
+OCR_TRUNCATED = REGISTRY.register(Counter(
+    "iou_ocr_truncated_total", "HunyuanOCR responses cut off at max_tokens."
+))
+OCR_TILED = REGISTRY.register(Counter(
+    "iou_ocr_tiled_total", "Pages or tiles OCR'd as tiles, by reason (size or truncated).", ["reason"]
+))
+OCR_REQUESTS = REGISTRY.register(Counter(
+    "iou_ocr_requests_total", "HunyuanOCR requests by outcome.", ["outcome"]
+))
+TABLE_GATE_DECISIONS = REGISTRY.register(Counter(
+    "iou_table_gate_decisions_total",
+    "Table gate decisions by mode, decision (ruled/layout/none) and outcome "
+    "(skipped/speculated_wasted/cells/no_cells).",
+    ["mode", "decision", "outcome"]
+))
+PAGES_PROCESSED = REGISTRY.register(Counter(
+    "iou_pages_processed_total", "Pages finished, by mode and outcome.", ["mode", "outcome"]
+))
+JOB_QUEUE_DEPTH = REGISTRY.register(Gauge("iou_job_queue_depth", "Jobs waiting in the queue."))
+JOBS_RUNNING = REGISTRY.register(Gauge("iou_jobs_running", "Jobs currently being processed."))
+PAGES_IN_PROGRESS = REGISTRY.register(Gauge("iou_pages_in_progress", "Pages currently on the page executor."))
+PAGE_WORKERS = REGISTRY.register(Gauge("iou_page_workers", "Size of the page executor."))
+WS_CLIENTS = REGISTRY.register(Gauge("iou_ws_clients", "Connected WebSocket clients."))
+WS_CLIENTS_DROPPED = REGISTRY.register(Counter(
+    "iou_ws_clients_dropped_total", "WebSocket clients disconnected by the server, by reason.", ["reason"]
+))
+WS_EVENTS = REGISTRY.register(Counter(
+    "iou_ws_events_total", "Job events published, by type and whether they were sent or folded into a later one.",
+    ["type", "delivery"]
+))
+
+
+class Trace:
+    """Spans recorded for one job: stage, page, offset from job start and duration."""
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self.started_at = time.time()
+        self._origin = time.perf_counter()
+        self._spans = []
+        self._lock = threading.Lock()
+
+    def add(self, name, start, duration, page=None, **attrs):
+        span = {"name": name, "start_ms": round((start - self._origin) * 1000, 3),
+                "duration_ms": round(duration * 1000, 3)}
+        if page is not None:
+            span["page"] = page
+        span.update(attrs)
+        with self._lock:
+            self._spans.append(span)
+
+    @contextmanager
+    def span(self, name, page=None, **attrs):
+        start = time.perf_counter()
+        try:
+            yield attrs
+        finally:
+            self.add(name, start, time.perf_counter() - start, page=page, **attrs)
+
+    def to_dict(self):
+        with self._lock:
+            spans = sorted(self._spans, key=lambda s: s["start_ms"])
+        return {"job_id": self.job_id, "started_at": self.started_at, "spans": spans}
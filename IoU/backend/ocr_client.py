@@ -0,0 +1,277 @@
+import asyncio
+import random
+import threading
+import time
+from typing import List, Optional
+
+import httpx
+import openai
+from openai import AsyncOpenAI
+
+
+class CircuitOpenError(Exception):
+    """Raised when every HunyuanOCR endpoint has its circuit breaker open."""
+
+
+class CircuitBreaker:
+    """Classic closed -> open -> half-open breaker for one endpoint.
+
+    After `failure_threshold` consecutive failures the breaker opens and rejects
+    requests for `reset_timeout` seconds, then lets a single trial request through.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def allow(self):
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half-open" and not self.trial_in_flight:
+            self.trial_in_flight = True
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        self.trial_in_flight = False
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+
+    def release(self):
+        """End a request that says nothing about the endpoint (bad request, cancelled):
+        a half-open trial slot is freed for the next request."""
+        self.trial_in_flight = False
+
+
+class _Endpoint:
+    def __init__(self, base_url, client, breaker):
+        self.base_url = base_url
+        self.client = client
+        self.breaker = breaker
+        self.in_flight = 0
+
+
+class Completion:
+    def __init__(self, content, finish_reason=None, completion_tokens=None, endpoint=None):
+        self.content = content
+        self.finish_reason = finish_reason
+        self.completion_tokens = completion_tokens
+        self.endpoint = endpoint
+
+    @property
+    def truncated(self):
+        return self.finish_reason == "length"
+
+
+# Errors worth retrying on another attempt / replica; anything else (bad request, auth) is final
+RETRYABLE_ERRORS = (
+    openai.APIConnectionError,   # includes APITimeoutError
+    openai.RateLimitError,
+    openai.InternalServerError,
+    openai.ConflictError,
+)
+
+
+class HunyuanOCRClient:
+    """Asyncio client for one or more OpenAI-compatible HunyuanOCR (vLLM) endpoints.
+
+    Each endpoint keeps its own pooled httpx connection pool and circuit breaker;
+    requests go to the healthy endpoint with the fewest requests in flight and are
+    retried with jittered exponential backoff.
+    """
+
+    def __init__(self, base_urls: List[str], model="tencent/HunyuanOCR", api_key="EMPTY",
+                 timeout=600.0, connect_timeout=10.0, max_retries=3,
+                 backoff_base=0.5, backoff_max=10.0, max_in_flight=16,
+                 pool_size=32, failure_threshold=5, reset_timeout=30.0):
+        if not base_urls:
+            raise ValueError("At least one HunyuanOCR endpoint is required")
+        self.model = model
+        self.api_key = api_key
+        self.timeout = httpx.Timeout(timeout, connect=connect_timeout)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_in_flight = max_in_flight
+        self.pool_size = pool_size
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.base_urls = list(base_urls)
+        # Endpoints and the in-flight semaphore are created lazily on the loop that uses them
+        self._endpoints = None
+        self._in_flight = None
+        self._rr = 0
+
+    def _ensure_endpoints(self):
+        if self._endpoints is not None:
+            return
+        limits = httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size)
+        self._endpoints = []
+        for url in self.base_urls:
+            client = AsyncOpenAI(
+                api_key=self.api_key,
+                base_url=url,
+                timeout=self.timeout,
+                max_retries=0,  # retries are handled here, across endpoints
+                http_client=httpx.AsyncClient(limits=limits, timeout=self.timeout),
+            )
+            self._endpoints.append(_Endpoint(url, client, CircuitBreaker(self.failure_threshold, self.reset_timeout)))
+        self._in_flight = asyncio.Semaphore(self.max_in_flight)
+
+    def _pick_endpoint(self, exclude=None) -> Optional[_Endpoint]:
+        n = len(self._endpoints)
+        # Rotate the starting point so equally loaded replicas take turns
+        order = [self._endpoints[(self._rr + k) % n] for k in range(n)]
+        self._rr = (self._rr + 1) % n
+        candidates = sorted(order, key=lambda ep: (ep is exclude, ep.in_flight))
+        for ep in candidates:
+            if ep.breaker.allow():
+                return ep
+        return None
+
+    def _backoff(self, attempt):
+        # "Full jitter": uniform in [0, min(max, base * 2^attempt)]
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    async def chat(self, messages, timeout=None, **params) -> str:
+        """Run one chat completion and return the message text."""
+        completion = await self.complete(messages, timeout=timeout, **params)
+        return completion.content
+
+    async def _create(self, endpoint, messages, timeout, on_delta, params) -> "Completion":
+        kwargs = dict(model=self.model, messages=messages,
+                      timeout=timeout if timeout is not None else self.timeout, **params)
+        if on_delta is None:
+            response = await endpoint.client.chat.completions.create(**kwargs)
+            choice = response.choices[0]
+            usage = response.usage
+            return Completion(
+                choice.message.content or "",
+                choice.finish_reason,
+                usage.completion_tokens if usage is not None else None,
+                endpoint.base_url
+            )
+
+        kwargs.update(stream=True, stream_options={"include_usage": True})
+        parts = []
+        finish_reason = None
+        completion_tokens = None
+        stream = await endpoint.client.chat.completions.create(**kwargs)
+        async for chunk in stream:
+            # With include_usage the last chunk carries token counts and no choices
+            if chunk.usage is not None:
+                completion_tokens = chunk.usage.completion_tokens
+            if not chunk.choices:
+                continue
+            choice = chunk.choices[0]
+            if choice.delta is not None and choice.delta.content:
+                parts.append(choice.delta.content)
+                on_delta(choice.delta.content)
+            if choice.finish_reason is not None:
+                finish_reason = choice.finish_reason
+        return Completion("".join(parts), finish_reason, completion_tokens, endpoint.base_url)
+
+    async def complete(self, messages, timeout=None, on_delta=None, **params) -> "Completion":
+        """Run one chat completion and return its text, finish reason and token usage.
+
+        With `on_delta`, the completion is streamed and `on_delta(text)` is called for each
+        chunk as it arrives. A streamed attempt is only retried if it failed before its
+        first chunk, so `on_delta` never sees the same text twice.
+        """
+        self._ensure_endpoints()
+        last_error = None
+        last_endpoint = None
+        delivered = False
+
+        def forward(text):
+            nonlocal delivered
+            delivered = True
+            on_delta(text)
+        async with self._in_flight:
+            for attempt in range(self.max_retries + 1):
+                endpoint = self._pick_endpoint(exclude=last_endpoint)
+                if endpoint is None:
+                    last_error = CircuitOpenError("All HunyuanOCR endpoints are unavailable (circuit open)")
+                else:
+                    endpoint.in_flight += 1
+                    recorded = False
+                    try:
+                        completion = await self._create(endpoint, messages, timeout,
+                                                        forward if on_delta is not None else None, params)
+                        endpoint.breaker.record_success()
+                        recorded = True
+                        return completion
+                    except RETRYABLE_ERRORS as e:
+                        endpoint.breaker.record_failure()
+                        recorded = True
+                        if delivered:
+                            raise
+                        last_error = e
+                        print(f"HunyuanOCR request to {endpoint.base_url} failed "
+                              f"(attempt {attempt + 1}/{self.max_retries + 1}): {e}")
+                    finally:
+                        endpoint.in_flight -= 1
+                        if not recorded:
+                            # Any other error or a cancellation (CancelledError is a BaseException)
+                            # is not the endpoint's fault, but must not keep a half-open trial slot
+                            endpoint.breaker.release()
+                    last_endpoint = endpoint
+                if attempt < self.max_retries:
+                    await asyncio.sleep(self._backoff(attempt))
+        raise last_error
+
+    async def aclose(self):
+        if self._endpoints is None:
+            return
+        for ep in self._endpoints:
+            await ep.client.close()
+        self._endpoints = None
+
+
+# --- Sync bridge ---
+# ocr_service runs inside executor threads; they share one background event loop so the
+# connection pools, breakers and in-flight cap are process-wide.
+
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def get_client_loop():
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=_loop.run_forever, name="ocr-client-loop", daemon=True)
+            thread.start()
+    return _loop
+
+
+def run_sync(coro):
+    """Run a coroutine on the shared client loop from a worker thread and wait for it."""
+    return asyncio.run_coroutine_threadsafe(coro, get_client_loop()).result()
+
+
+async def run_on_client_loop(coro):
+    """Await a coroutine on the shared client loop from any other event loop."""
+    loop = get_client_loop()
+    if asyncio.get_running_loop() is loop:
+        return await coro
+    return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, loop))
@@ -3,14 +3,22 @@ import shutil
 import json
 import base64
 import numpy as np
-import cv2
-from pdf2image import convert_from_path
 from PIL import Image
-from openai import OpenAI
-from modelscope.pipelines import pipeline
-from modelscope.utils.constant import Tasks
-from shapely.geometry import Polygon
+from result_cache import ResultCache, make_key
+from page_image import PageImage, as_page, prepare_for_ocr, tile_boxes, crop_page
+from table_workers import TableStructurePool, LORE, WIRED
+from table_gate import check_ruling, check_layout, gate_image, RULED, LAYOUT
+from metrics import (STAGE_SECONDS, STAGE_IN_PROGRESS, STAGE_CONCURRENCY_LIMIT, SEGMENTS_PER_PAGE,
+                     CELLS_PER_PAGE, OCR_COMPLETION_TOKENS, OCR_TRUNCATED, OCR_TILED, OCR_REQUESTS,
+                     TABLE_GATE_DECISIONS)
+from ocr_client import HunyuanOCRClient, run_sync, run_on_client_loop
 import re
+import math
+import difflib
+import asyncio
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 # --- Configuration ---
 HUNYUAN_API_URL = "http://localhost:8000/v1"
@@ -32,11 +40,40 @@ TABLE_MODEL_PATH = "/home/ubuntu/chen/ocr/table/none_line"
 # - Table: Wired Table (placeholder or specific model if known, otherwise warn)
 # - NoTable: Lineless Table (LORE)
 
-# Initialize OpenAI client
-client = OpenAI(
-    api_key="EMPTY",
-    base_url=HUNYUAN_API_URL,
-    timeout=3600
+# HunyuanOCR replicas; pages are spread across all of them
+HUNYUAN_API_URLS = [HUNYUAN_API_URL]
+HUNYUAN_MODEL = "tencent/HunyuanOCR"
+OCR_REQUEST_TIMEOUT = 600
+OCR_MAX_RETRIES = 3
+OCR_MAX_IN_FLIGHT = 16
+# Stream HunyuanOCR output when a caller wants segments as they are recognized;
+# turn off for servers without streaming support
+OCR_STREAMING = True
+
+# Image preparation before sending a page to HunyuanOCR:
+# pages above OCR_MAX_PIXELS are downscaled; OCR_JPEG_QUALITY=None keeps the original
+# encoding when possible, a number forces JPEG re-encoding at that quality.
+OCR_MAX_PIXELS = 2560 * 2560
+OCR_JPEG_QUALITY = None
+
+# Tiled OCR: pages above OCR_TILE_PAGE_PIXELS, and pages whose output hit max_tokens, are
+# split into bands (plus columns when wider than OCR_TILE_MAX_WIDTH) of at most
+# OCR_TILE_MAX_PIXELS that overlap by OCR_TILE_OVERLAP px. Tiles that are cut off again
+# are split further, up to OCR_TILE_MAX_DEPTH levels.
+OCR_TILING = True
+OCR_TILE_PAGE_PIXELS = 2 * OCR_MAX_PIXELS
+OCR_TILE_MAX_PIXELS = OCR_MAX_PIXELS
+OCR_TILE_MAX_WIDTH = 4096
+OCR_TILE_OVERLAP = 160
+OCR_TILE_MAX_DEPTH = 2
+
+# Initialize HunyuanOCR client (async, pooled, retrying; see ocr_client.py)
+client = HunyuanOCRClient(
+    HUNYUAN_API_URLS,
+    model=HUNYUAN_MODEL,
+    timeout=OCR_REQUEST_TIMEOUT,
+    max_retries=OCR_MAX_RETRIES,
+    max_in_flight=OCR_MAX_IN_FLIGHT
 )
 
 # Global model cache
@@ -44,9 +81,81 @@ _lore_pipeline = None
 _wired_pipeline = None
 WIRED_TABLE_MODEL_PATH = "/home/ubuntu/chen/ocr/table/line"
 
+# Content-addressed cache of raw OCR segments / table cells, keyed by page bytes + settings.
+# Kept outside results/, which is served as static files; under IOU_DATA_DIR like main.py's data.
+CACHE_DIR = os.path.join(os.environ.get("IOU_DATA_DIR", os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+                         "cache")
+CACHE_MEMORY_ITEMS = 512
+CACHE_MAX_DISK_BYTES = 512 * 1024 * 1024
+result_cache = ResultCache(CACHE_DIR, max_memory_items=CACHE_MEMORY_ITEMS, max_disk_bytes=CACHE_MAX_DISK_BYTES)
+
+# Table-structure models run in worker processes (see table_workers.py), each loading its
+# model once; pages queued together are batched. 0 keeps the models in this process.
+TABLE_WORKER_PROCESSES = 2
+TABLE_MAX_BATCH = 4
+_table_pools = {}
+_table_pools_lock = threading.Lock()
+
+# Table gate (see table_gate.py): in table modes, pages with neither ruling lines nor a
+# column layout in their OCR boxes skip structure recognition. "Auto" mode uses it to pick
+# the wired model for ruled tables and LORE for lineless ones. With TABLE_GATE_SHADOW the
+# decisions are only recorded and the models always run, to measure the gate's accuracy.
+TABLE_GATE = True
+TABLE_GATE_SHADOW = False
+# When the ruling check finds no grid, the OCR layout check can still find a table only
+# after OCR. With TABLE_GATE_SPECULATE structure recognition starts anyway, next to OCR,
+# and is dropped if the layout check finds nothing. That trades the gate's savings for
+# latency on layout tables: a run that already started is wasted (counted with outcome
+# "speculated_wasted"), only one still waiting for a table slot is skipped.
+TABLE_GATE_SPECULATE = False
+
+# Per-stage concurrency limits shared by every page in flight:
+# the remote vLLM server takes many requests at once, the local table models don't.
+OCR_CONCURRENCY = 8
+TABLE_CONCURRENCY = TABLE_WORKER_PROCESSES * TABLE_MAX_BATCH if TABLE_WORKER_PROCESSES > 0 else 2
+_ocr_slots = threading.BoundedSemaphore(OCR_CONCURRENCY)
+_table_slots = threading.BoundedSemaphore(TABLE_CONCURRENCY)
+# A tiled page holds one _ocr_slots permit but sends a request per tile; this caps the
+# HunyuanOCR requests themselves (pages and tiles) at OCR_CONCURRENCY. Created on the client loop.
+_ocr_request_slots = None
+
+# Per-page stage pool: HunyuanOCR and table structure recognition run side by side
+STAGE_WORKERS = OCR_CONCURRENCY + TABLE_CONCURRENCY
+_stage_executor = ThreadPoolExecutor(max_workers=STAGE_WORKERS, thread_name_prefix="ocr-stage")
+STAGE_CONCURRENCY_LIMIT.set(OCR_CONCURRENCY, stage="ocr")
+STAGE_CONCURRENCY_LIMIT.set(TABLE_CONCURRENCY, stage="table")
+
+def configure_stages(ocr_concurrency=None, table_concurrency=None, table_workers=None):
+    """Change the per-stage limits above; call before the first page is processed."""
+    global OCR_CONCURRENCY, TABLE_CONCURRENCY, TABLE_WORKER_PROCESSES, STAGE_WORKERS
+    global _ocr_slots, _table_slots, _stage_executor, _ocr_request_slots
+    if table_workers is not None:
+        TABLE_WORKER_PROCESSES = table_workers
+        if table_concurrency is None:
+            table_concurrency = TABLE_WORKER_PROCESSES * TABLE_MAX_BATCH if TABLE_WORKER_PROCESSES > 0 else 2
+    if ocr_concurrency is not None:
+        OCR_CONCURRENCY = ocr_concurrency
+    if table_concurrency is not None:
+        TABLE_CONCURRENCY = table_concurrency
+    _ocr_slots = threading.BoundedSemaphore(OCR_CONCURRENCY)
+    _table_slots = threading.BoundedSemaphore(TABLE_CONCURRENCY)
+    _ocr_request_slots = None
+    STAGE_WORKERS = OCR_CONCURRENCY + TABLE_CONCURRENCY
+    _stage_executor.shutdown(wait=False)
+    _stage_executor = ThreadPoolExecutor(max_workers=STAGE_WORKERS, thread_name_prefix="ocr-stage")
+    STAGE_CONCURRENCY_LIMIT.set(OCR_CONCURRENCY, stage="ocr")
+    STAGE_CONCURRENCY_LIMIT.set(TABLE_CONCURRENCY, stage="table")
+
 def get_lore_pipeline():
     global _lore_pipeline
     if _lore_pipeline is None:
+        # ModelScope (and torch behind it) is only imported once a model is needed
+        try:
+            from modelscope.pipelines import pipeline
+            from modelscope.utils.constant import Tasks
+        except ImportError as e:
+            print(f"ModelScope is not available, LORE model disabled: {e}")
+            return None
         print(f"Loading LORE model from {TABLE_MODEL_PATH}...")
         try:
             _lore_pipeline = pipeline(Tasks.lineless_table_recognition, model=TABLE_MODEL_PATH)
@@ -62,6 +171,12 @@ def get_lore_pipeline():
 def get_wired_pipeline():
     global _wired_pipeline
     if _wired_pipeline is None:
+        try:
+            from modelscope.pipelines import pipeline
+            from modelscope.utils.constant import Tasks
+        except ImportError as e:
+            print(f"ModelScope is not available, Wired Table model disabled: {e}")
+            return None
         print(f"Loading Wired Table model from {WIRED_TABLE_MODEL_PATH}...")
         try:
             # Explicitly use device='gpu' or 'cpu' if needed, but default auto is usually fine.
@@ -89,10 +204,28 @@ def get_image_size(image_path):
     with Image.open(image_path) as img:
         return img.size
 
-def parse_ocr_result(text, image_size):
+COORD_PATTERN = re.compile(r'\((-?\d+),(-?\d+)\),\((-?\d+),(-?\d+)\)')
+
+def _make_segment(content, box, image_size):
+    # HunyuanOCR coordinates are 0-1000, relative to the image
     img_w, img_h = image_size
+    x1, y1, x2, y2 = box
+    x1 = int(x1 * img_w / 1000)
+    y1 = int(y1 * img_h / 1000)
+    x2 = int(x2 * img_w / 1000)
+    y2 = int(y2 * img_h / 1000)
+    points = [[x1, y1], [x2, y1], [x2, y2], [x1, y2]]
+    return {"text": content, "box": points}
+
+def _segment_from_item(item, image_size):
+    content = item.get("text", "")
+    box = item.get("bbox", [])
+    if len(box) == 4:
+        return _make_segment(content, box, image_size)
+    return None
+
+def parse_ocr_result(text, image_size):
     parsed_data = []
-    pattern = re.compile(r'\((-?\d+),(-?\d+)\),\((-?\d+),(-?\d+)\)')
     
     try:
         cleaned_text = text.strip()
@@ -105,101 +238,472 @@ def parse_ocr_result(text, image_size):
         items = data if isinstance(data, list) else data.get("data", [])
         
         for item in items:
-            content = item.get("text", "")
-            box = item.get("bbox", [])
-            if len(box) == 4:
-                x1, y1, x2, y2 = box
-                x1 = int(x1 * img_w / 1000)
-                y1 = int(y1 * img_h / 1000)
-                x2 = int(x2 * img_w / 1000)
-                y2 = int(y2 * img_h / 1000)
-                points = [[x1, y1], [x2, y1], [x2, y2], [x1, y2]]
-                parsed_data.append({"text": content, "box": points})
+            segment = _segment_from_item(item, image_size)
+            if segment is not None:
+                parsed_data.append(segment)
         return parsed_data
     except:
         pass
 
-    matches = list(pattern.finditer(text))
+    matches = list(COORD_PATTERN.finditer(text))
     start_index = 0
     for match in matches:
         end_index = match.start()
         content = text[start_index:end_index].strip()
-        x1, y1, x2, y2 = map(int, match.groups())
-        x1 = int(x1 * img_w / 1000)
-        y1 = int(y1 * img_h / 1000)
-        x2 = int(x2 * img_w / 1000)
-        y2 = int(y2 * img_h / 1000)
-        points = [[x1, y1], [x2, y1], [x2, y2], [x1, y2]]
-        parsed_data.append({"text": content, "box": points})
+        parsed_data.append(_make_segment(content, tuple(map(int, match.groups())), image_size))
         start_index = match.end()
     return parsed_data
 
-def get_hunyuan_ocr(image_path, prompt):
-    base64_img = encode_image_file(image_path)
-    image_size = get_image_size(image_path)
-    
-    messages = [
+class StreamingOCRParser:
+    """Incremental version of parse_ocr_result for streamed completions.
+
+    `feed(chunk)` returns the segments completed by that chunk. JSON output is scanned
+    for finished array elements ({"text", "bbox"} objects), anything else is read as
+    `text(x1,y1),(x2,y2)` runs. `finish()` returns the full result: parse_ocr_result on
+    the whole text, or the segments found so far if that finds nothing (e.g. JSON cut
+    off at max_tokens).
+    """
+
+    def __init__(self, image_size):
+        self.image_size = image_size
+        self.text = ""
+        self.segments = []
+        self._format = None
+        self._pos = 0
+        # JSON scanner state: open brackets, string/escape flags, where the current array
+        # element starts and how deep it sits
+        self._stack = []
+        self._in_string = False
+        self._escaped = False
+        self._item_start = None
+        self._item_depth = None
+
+    def feed(self, chunk):
+        if not chunk:
+            return []
+        self.text += chunk
+        if self._format is None:
+            head = self.text.lstrip()
+            if "```".startswith(head[:3]) and len(head) < 3:
+                return []
+            if head.startswith("```"):
+                # Wait for the fence line to complete before deciding
+                if "\n" not in head:
+                    return []
+                head = head.split("\n", 1)[1].lstrip()
+            if not head:
+                return []
+            self._format = "json" if head[0] in "[{" else "coords"
+        new = self._scan_json() if self._format == "json" else self._scan_coords()
+        self.segments.extend(new)
+        return new
+
+    def _scan_json(self):
+        found = []
+        text = self.text
+        for i in range(self._pos, len(text)):
+            ch = text[i]
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif ch == "\\":
+                    self._escaped = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"':
+                self._in_string = True
+            elif ch in "[{":
+                if ch == "{" and self._item_start is None and self._stack and self._stack[-1] == "[":
+                    self._item_start, self._item_depth = i, len(self._stack)
+                self._stack.append(ch)
+            elif ch in "]}":
+                if self._stack:
+                    self._stack.pop()
+                if self._item_start is not None and len(self._stack) == self._item_depth:
+                    try:
+                        segment = _segment_from_item(json.loads(text[self._item_start:i + 1]), self.image_size)
+                    except (ValueError, AttributeError):
+                        segment = None
+                    if segment is not None:
+                        found.append(segment)
+                    self._item_start = None
+        self._pos = len(text)
+        return found
+
+    def _scan_coords(self):
+        found = []
+        for match in COORD_PATTERN.finditer(self.text, self._pos):
+            content = self.text[self._pos:match.start()].strip()
+            found.append(_make_segment(content, tuple(map(int, match.groups())), self.image_size))
+            self._pos = match.end()
+        return found
+
+    def finish(self):
+        final = parse_ocr_result(self.text.strip(), self.image_size)
+        return final if final or not self.segments else list(self.segments)
+
+def _load_ocr_payload(page):
+    key = ("ocr_payload", OCR_MAX_PIXELS, OCR_JPEG_QUALITY)
+    payload = page.derived(key, lambda p: prepare_for_ocr(p, OCR_MAX_PIXELS, OCR_JPEG_QUALITY))
+    if payload.sent_size != payload.original_size:
+        print(f"Downscaled {page.name} for OCR: {payload.original_size} -> {payload.sent_size}")
+    # Boxes are mapped onto the original page size: HunyuanOCR answers in 0-1000
+    # coordinates relative to the image it was sent, which keeps the original aspect ratio.
+    return payload.base64, payload.original_size, payload.mime_type
+
+def build_ocr_messages(base64_img, prompt, mime_type="image/jpeg"):
+    return [
         {"role": "user", "content": [
-            {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{base64_img}"}},
+            {"type": "image_url", "image_url": {"url": f"data:{mime_type};base64,{base64_img}"}},
             {"type": "text", "text": prompt}
         ]}
     ]
+
+OCR_GENERATION_PARAMS = {
+    "temperature": 0.0,
+    "top_p": 0.95,
+    "stream": False,
+    "max_tokens": 4096
+}
+
+class PartialResult(list):
+    """OCR segments known to be incomplete (output cut off at max_tokens, tiles that failed).
+
+    Used like the plain list it is, but never cached.
+    """
+
+def _record_completion(completion, page):
+    if completion.completion_tokens is not None:
+        OCR_COMPLETION_TOKENS.observe(completion.completion_tokens)
+    if completion.truncated:
+        OCR_TRUNCATED.inc()
+        OCR_REQUESTS.inc(outcome="truncated")
+        print(f"HunyuanOCR output for {page.name} hit max_tokens={OCR_GENERATION_PARAMS['max_tokens']}, segments may be missing")
+    else:
+        OCR_REQUESTS.inc(outcome="ok")
+
+def _ocr_request(messages, image_size, on_segments):
+    """Coroutine for one OCR call plus a function turning its Completion into segments.
+
+    With `on_segments` (and OCR_STREAMING), the response is streamed and parsed as it
+    arrives; `on_segments(segments)` gets each batch of newly completed segments.
+    """
+    if on_segments is None or not OCR_STREAMING:
+        return (client.complete(messages, **OCR_GENERATION_PARAMS),
+                lambda completion: parse_ocr_result(completion.content.strip(), image_size))
+
+    parser = StreamingOCRParser(image_size)
+
+    def on_delta(text):
+        segments = parser.feed(text)
+        if segments:
+            on_segments(segments)
+
+    return (client.complete(messages, on_delta=on_delta, **OCR_GENERATION_PARAMS),
+            lambda completion: parser.finish())
+
+def _request_slots():
+    global _ocr_request_slots
+    if _ocr_request_slots is None:
+        _ocr_request_slots = asyncio.Semaphore(OCR_CONCURRENCY)
+    return _ocr_request_slots
+
+async def _ocr_once_async(page, prompt, on_segments=None):
+    """One HunyuanOCR call for the whole of `page`; returns (segments, truncated)."""
+    base64_img, image_size, mime_type = await asyncio.to_thread(_load_ocr_payload, page)
+    messages = build_ocr_messages(base64_img, prompt, mime_type)
+    request, parse = _ocr_request(messages, image_size, on_segments)
+    async with _request_slots():
+        completion = await run_on_client_loop(request)
+    _record_completion(completion, page)
+    return parse(completion), completion.truncated
+
+def _tile_grid(size, min_tiles=1):
+    """(rows, cols) so that every tile stays within OCR_TILE_MAX_PIXELS."""
+    w, h = size
+    cols = max(1, math.ceil(w / OCR_TILE_MAX_WIDTH))
+    tile_w = w / cols + OCR_TILE_OVERLAP
+    max_tile_h = max(1, OCR_TILE_MAX_PIXELS / tile_w - OCR_TILE_OVERLAP)
+    rows = max(1, math.ceil(h / max_tile_h), math.ceil(min_tiles / cols))
+    return rows, cols
+
+def _tile_segment(segment, tile, tile_box, page_size, margin=4):
+    """Shift a segment of tile number `tile` into page coordinates.
+
+    Returns (segment, clipped, tile) where `clipped` marks boxes touching a tile edge that is
+    not also a page edge, i.e. text that may have been cut by the tiling.
+    """
+    x0, y0, x1, y1 = tile_box
+    page_w, page_h = page_size
+    box = [[x + x0, y + y0] for x, y in segment["box"]]
+    xs = [p[0] for p in box]
+    ys = [p[1] for p in box]
+    clipped = ((x0 > 0 and min(xs) <= x0 + margin) or (x1 < page_w and max(xs) >= x1 - margin) or
+               (y0 > 0 and min(ys) <= y0 + margin) or (y1 < page_h and max(ys) >= y1 - margin))
+    return {"text": segment["text"], "box": box}, clipped, tile
+
+def _same_text(a, b, min_similarity):
+    if not a or not b:
+        return a == b
+    return a in b or b in a or difflib.SequenceMatcher(None, a, b).ratio() >= min_similarity
+
+def dedupe_tile_segments(candidates, min_overlap=0.6, min_similarity=0.8):
+    """Remove segments recognized twice in the overlap between tiles.
+
+    `candidates` are (segment, clipped, tile) from _tile_segment. Two segments from
+    different tiles are the same when their boxes overlap by at least `min_overlap` of the smaller box and
+    their texts match (one contains the other, or similarity >= `min_similarity`).
+    Of each group the segment not touching an inner tile edge wins, then the longer
+    text. Survivors keep their original (tile, then reading) order.
+    """
+    if not candidates:
+        return []
+    from shapely.geometry import MultiPoint
+    from shapely.strtree import STRtree
+    polys = [_make_polygon(segment["box"]) for segment, _, _ in candidates]
+    # Indexed by bounding envelope: zero-area boxes make empty polygons, which the tree would skip
+    envelopes = [MultiPoint(segment["box"]).envelope for segment, _, _ in candidates]
+    tree = STRtree(envelopes)
+    order = sorted(range(len(candidates)),
+                   key=lambda i: (candidates[i][1], -len(candidates[i][0]["text"]), -polys[i].area))
+    kept = set()
+    for i in order:
+        segment, _, tile = candidates[i]
+        duplicate = False
+        for j in (int(j) for j in tree.query(envelopes[i])):
+            # A tile never repeats itself; only the overlap with other tiles can
+            if j not in kept or candidates[j][2] == tile:
+                continue
+            smaller = min(polys[i].area, polys[j].area)
+            if smaller == 0:
+                overlap = 1.0 if segment["box"] == candidates[j][0]["box"] else 0.0
+            else:
+                overlap = polys[i].intersection(polys[j]).area / smaller
+            if overlap >= min_overlap and _same_text(segment["text"], candidates[j][0]["text"], min_similarity):
+                duplicate = True
+                break
+        if not duplicate:
+            kept.add(i)
+    return [candidates[i][0] for i in sorted(kept)]
+
+def _center_in(segment, box):
+    xs = [p[0] for p in segment["box"]]
+    ys = [p[1] for p in segment["box"]]
+    cx, cy = (min(xs) + max(xs)) / 2, (min(ys) + max(ys)) / 2
+    return box[0] <= cx < box[2] and box[1] <= cy < box[3]
+
+async def _ocr_tiled_async(page, prompt, grid, depth, fallback=None):
+    """OCR `page` as a grid of overlapping tiles and merge their segments.
+
+    A failed tile is skipped, or with `fallback` (page segments from an earlier, truncated
+    call) filled with the fallback segments centered in it. Raises only if every tile failed
+    and there is no fallback.
+    """
+    rows, cols = grid
+    boxes = tile_boxes(page.size, rows, cols, OCR_TILE_OVERLAP)
+    print(f"Running HunyuanOCR on {page.name} as {rows}x{cols} tiles")
+    tiles = await asyncio.to_thread(
+        lambda: [crop_page(page, box, name=f"{page.name}_tile_{i}") for i, box in enumerate(boxes)]
+    )
+    outputs = await asyncio.gather(*[_ocr_page_async(tile, prompt, depth=depth + 1) for tile in tiles],
+                                   return_exceptions=True)
+    failed = [tile for tile, output in enumerate(outputs) if isinstance(output, BaseException)]
+    if failed and fallback is None and len(failed) == len(tiles):
+        raise outputs[0]
+    partial = bool(failed) or any(isinstance(output, PartialResult) for output in outputs)
+    candidates = []
+    for tile, (box, tile_segments) in enumerate(zip(boxes, outputs)):
+        if tile in failed:
+            print(f"HunyuanOCR failed on tile {tile} of {page.name}: {tile_segments}")
+            if fallback is not None:
+                candidates.extend((segment, False, tile) for segment in fallback if _center_in(segment, box))
+            continue
+        candidates.extend(_tile_segment(segment, tile, box, page.size) for segment in tile_segments)
+    segments = dedupe_tile_segments(candidates)
+    return PartialResult(segments) if partial else segments
+
+async def _ocr_page_async(page, prompt, on_segments=None, depth=0):
+    w, h = page.size
+    if OCR_TILING and depth == 0 and w * h > OCR_TILE_PAGE_PIXELS:
+        OCR_TILED.inc(reason="size")
+        return await _ocr_tiled_async(page, prompt, _tile_grid(page.size), depth)
+    segments, truncated = await _ocr_once_async(page, prompt, on_segments)
+    if truncated and OCR_TILING and depth < OCR_TILE_MAX_DEPTH:
+        # Whatever came after the cut is missing; tiles each need fewer tokens
+        OCR_TILED.inc(reason="truncated")
+        segments = await _ocr_tiled_async(page, prompt, _tile_grid(page.size, min_tiles=2), depth, fallback=segments)
+        if on_segments is not None and OCR_STREAMING:
+            # The cut-off stream already went out; the tiled set supersedes it
+            on_segments(segments, replace=True)
+    elif truncated:
+        # Tiling is off or already as deep as allowed
+        return PartialResult(segments)
+    return segments
+
+async def get_hunyuan_ocr_async(image, prompt, on_segments=None):
+    page = as_page(image)
     
     try:
-        response = client.chat.completions.create(
-            model="tencent/HunyuanOCR",
-            messages=messages,
-            temperature=0.0,
-            top_p=0.95,
-            stream=False,
-            max_tokens=4096
-        )
-        content = response.choices[0].message.content.strip()
-        return parse_ocr_result(content, image_size)
+        return await run_on_client_loop(_ocr_page_async(page, prompt, on_segments))
     except Exception as e:
+        OCR_REQUESTS.inc(outcome="error")
         print(f"HunyuanOCR Error: {e}")
         return []
 
-def get_lore_structure(image_path):
-    pipeline = get_lore_pipeline()
-    if pipeline is None:
-        return []
+def get_hunyuan_ocr(image, prompt, on_segments=None):
+    page = as_page(image)
+    
     try:
-        result = pipeline(image_path)
-        cells = []
-        if 'polygons' in result:
-            for poly in result['polygons']:
-                points = np.array(poly).reshape(-1, 2).tolist()
-                cells.append(points)
-        return cells
+        return run_sync(_ocr_page_async(page, prompt, on_segments))
     except Exception as e:
-        print(f"LORE Error: {e}")
+        OCR_REQUESTS.inc(outcome="error")
+        print(f"HunyuanOCR Error: {e}")
         return []
 
-def get_wired_structure(image_path):
-    pipeline = get_wired_pipeline()
+def _cells_from_result(result):
+    cells = []
+    if 'polygons' in result:
+        for poly in result['polygons']:
+            points = np.array(poly).reshape(-1, 2).tolist()
+            cells.append(points)
+    return cells
+
+def get_table_pipeline(kind):
+    return get_lore_pipeline() if kind == LORE else get_wired_pipeline()
+
+def run_table_pipeline(kind, images):
+    """Run LORE / wired structure recognition in this process on a list of PIL images."""
+    name = "LORE" if kind == LORE else "Wired Table"
+    pipeline = get_table_pipeline(kind)
+    if pipeline is None or not images:
+        return [[] for _ in images]
+    if len(images) > 1:
+        try:
+            outputs = pipeline(images, batch_size=len(images))
+            return [_cells_from_result(result) for result in outputs]
+        except Exception as e:
+            print(f"{name} batched inference failed, running pages one by one: {e}")
+    cells_per_image = []
+    for img in images:
+        try:
+            # Use PIL image for pipeline as in merge_ocr_table.py
+            cells_per_image.append(_cells_from_result(pipeline(img)))
+        except Exception as e:
+            print(f"{name} Error: {e}")
+            cells_per_image.append([])
+    return cells_per_image
+
+def get_table_pool(kind):
+    with _table_pools_lock:
+        if kind not in _table_pools:
+            # Every worker process loads its model and runs it once on a blank page as it starts;
+            # workers restarted after a crash are warmed up again (/readyz says so meanwhile)
+            _table_pools[kind] = TableStructurePool(kind, workers=TABLE_WORKER_PROCESSES, max_batch=TABLE_MAX_BATCH,
+                                                    warmup_page=_blank_page().data,
+                                                    on_restart=lambda: warm_up_table_model(kind))
+        return _table_pools[kind]
+
+def _get_table_structure(kind, image):
+    page = as_page(image)
+    if TABLE_WORKER_PROCESSES > 0:
+        try:
+            return get_table_pool(kind).recognize(page.data)
+        except Exception as e:
+            print(f"Table worker pool Error ({kind}): {e}")
+            return []
+    return run_table_pipeline(kind, [page.pil])[0]
+
+def get_lore_structure(image):
+    return _get_table_structure(LORE, image)
+
+def get_wired_structure(image):
+    return _get_table_structure(WIRED, image)
+
+# --- Model warm-up ---
+
+# Table models loaded and run once on a blank page in the background at startup, so the
+# first user's page doesn't wait for ModelScope. An empty tuple makes the server ready at once.
+WARMUP_MODELS = (LORE, WIRED)
+# Models the server is not ready without: the table modes ("Table" is the default upload
+# mode) give pages without cells when theirs failed to load. A model left out of this list
+# that fails to warm up is still reported by /readyz but does not hold readiness back; set
+# it to () for a deployment that only serves Hunyuanocr mode.
+WARMUP_REQUIRED_MODELS = (LORE, WIRED)
+WARMUP_PAGE_SIZE = (320, 320)
+
+# Warm-up states per model
+PENDING = "pending"
+LOADING = "loading"
+READY = "ready"
+FAILED = "failed"
+
+_warmup_status = {kind: {"status": PENDING} for kind in WARMUP_MODELS}
+_warmup_lock = threading.Lock()
+
+def probe_table_model(kind, images):
+    """Load `kind` in this process and run it on `images`; raises if either step fails."""
+    pipeline = get_table_pipeline(kind)
     if pipeline is None:
-        return []
+        raise RuntimeError(f"{kind} model could not be loaded")
+    for img in images:
+        _cells_from_result(pipeline(img))
+
+def _blank_page():
+    return PageImage.from_pil(Image.new("RGB", WARMUP_PAGE_SIZE, "white"), name="warmup")
+
+def _set_warmup_status(kind, status, **info):
+    with _warmup_lock:
+        _warmup_status[kind] = {"status": status, **info}
+
+def warm_up_table_model(kind):
+    """Load one table model (in every pool worker) and run a dummy inference. Returns True when ready."""
+    _set_warmup_status(kind, LOADING)
+    start = time.perf_counter()
     try:
-        # Use PIL image for pipeline as in merge_ocr_table.py
-        img = Image.open(image_path)
-        result = pipeline(img)
-        cells = []
-        if 'polygons' in result:
-            for poly in result['polygons']:
-                points = np.array(poly).reshape(-1, 2).tolist()
-                cells.append(points)
-        return cells
+        if TABLE_WORKER_PROCESSES > 0:
+            get_table_pool(kind).warm_up()
+        else:
+            probe_table_model(kind, [_blank_page().pil])
     except Exception as e:
-        print(f"Wired Table Error: {e}")
-        return []
+        print(f"Warm-up of {kind} model failed: {e}")
+        _set_warmup_status(kind, FAILED, error=str(e))
+        return False
+    seconds = round(time.perf_counter() - start, 3)
+    print(f"{kind} model warmed up in {seconds}s")
+    _set_warmup_status(kind, READY, seconds=seconds)
+    return True
+
+def warm_up_table_models():
+    """Warm up every model in WARMUP_MODELS side by side; blocks until all are done."""
+    # Pull the libraries the request path imports lazily in as well
+    import cv2
+    import shapely.strtree
+    if not WARMUP_MODELS:
+        return True
+    with ThreadPoolExecutor(max_workers=len(WARMUP_MODELS), thread_name_prefix="warmup") as executor:
+        return all(executor.map(warm_up_table_model, WARMUP_MODELS))
+
+def warmup_status():
+    """(ready, {kind: {"status", "required", ...}}) for the readiness probe.
+
+    Ready once every model has finished warming up and every required one succeeded.
+    """
+    with _warmup_lock:
+        models = {kind: {**info, "required": kind in WARMUP_REQUIRED_MODELS} for kind, info in _warmup_status.items()}
+    ready = all(info["status"] == READY or (info["status"] == FAILED and not info["required"])
+                for info in models.values())
+    return ready, models
+
+def _make_polygon(box):
+    from shapely.geometry import Polygon
+    poly = Polygon(box)
+    if not poly.is_valid: poly = poly.buffer(0)
+    return poly
 
 def calculate_iou(box1, box2):
     try:
-        poly1 = Polygon(box1)
-        poly2 = Polygon(box2)
-        if not poly1.is_valid: poly1 = poly1.buffer(0)
-        if not poly2.is_valid: poly2 = poly2.buffer(0)
+        poly1 = _make_polygon(box1)
+        poly2 = _make_polygon(box2)
         intersection = poly1.intersection(poly2).area
         text_area = poly1.area
         if text_area == 0: return 0
@@ -207,22 +711,75 @@ def calculate_iou(box1, box2):
     except:
         return 0
 
-def merge_results(ocr_results, table_cells, iou_threshold=0.8):
-    merged_data = []
-    used_indices = set()
-    cell_contents = {i: [] for i in range(len(table_cells))}
-    
-    for i, text_item in enumerate(ocr_results):
-        text_box = text_item['box']
+class CellIndex:
+    """STRtree over the table cells of one page.
+
+    Cell polygons are built (and repaired) once; `best_cell` only runs the exact
+    intersection for cells whose bounding box overlaps the text box.
+    """
+
+    def __init__(self, table_cells):
+        from shapely.strtree import STRtree
+        self.polygons = []
+        self.cell_ids = []
+        for j, cell_box in enumerate(table_cells):
+            try:
+                poly = _make_polygon(cell_box)
+            except:
+                # calculate_iou() would return 0 for this cell on every text box
+                continue
+            if poly.is_empty: continue
+            self.polygons.append(poly)
+            self.cell_ids.append(j)
+        self.tree = STRtree(self.polygons) if self.polygons else None
+
+    def best_cell(self, text_box):
+        """Return (best_iou, best_cell_idx) exactly like the brute-force scan in merge_results."""
         best_iou = 0
         best_cell_idx = -1
-        for j, cell_box in enumerate(table_cells):
-            iou = calculate_iou(text_box, cell_box)
+        if self.tree is None:
+            return best_iou, best_cell_idx
+        try:
+            text_poly = _make_polygon(text_box)
+            text_area = text_poly.area
+        except:
+            return best_iou, best_cell_idx
+        if text_area == 0 or text_poly.is_empty:
+            return best_iou, best_cell_idx
+
+        # Visit candidates in original cell order so ties keep resolving to the lowest index
+        for k in sorted(int(k) for k in self.tree.query(text_poly)):
+            try:
+                iou = text_poly.intersection(self.polygons[k]).area / text_area
+            except:
+                iou = 0
             if iou > best_iou:
                 best_iou = iou
-                best_cell_idx = j
-        
-        if best_iou >= iou_threshold:
+                best_cell_idx = self.cell_ids[k]
+        return best_iou, best_cell_idx
+
+def match_cells(ocr_results, table_cells):
+    """(best_iou, best_cell_idx) for every OCR segment.
+
+    Doesn't depend on the threshold, so a threshold sweep computes it once.
+    """
+    cell_index = CellIndex(table_cells)
+    return [cell_index.best_cell(text_item['box']) for text_item in ocr_results]
+
+def merge_results(ocr_results, table_cells, iou_threshold=0.8, matches=None):
+    """Group OCR segments into the table cells they overlap by at least `iou_threshold`.
+
+    `matches` is match_cells() output for the same segments and cells, when already known.
+    `ocr_results` is not modified, so the raw segments can be merged again later.
+    """
+    merged_data = []
+    used_indices = set()
+    cell_contents = {i: [] for i in range(len(table_cells))}
+    if matches is None:
+        matches = match_cells(ocr_results, table_cells)
+    
+    for i, (best_iou, best_cell_idx) in enumerate(matches):
+        if best_iou >= iou_threshold and best_cell_idx >= 0:
             cell_contents[best_cell_idx].append(i)
             used_indices.add(i)
     
@@ -250,14 +807,19 @@ def merge_results(ocr_results, table_cells, iou_threshold=0.8):
         
     for i, text_item in enumerate(ocr_results):
         if i not in used_indices:
-            text_item['is_table_cell'] = False
-            merged_data.append(text_item)
+            merged_data.append({**text_item, 'is_table_cell': False})
             
     return merged_data
 
-def visualize_results(image_path, results, output_path, table_cells=None):
-    image = cv2.imread(image_path)
-    if image is None: return
+def remerge(ocr_results, table_cells, thresholds):
+    """merge_results() at each of `thresholds`, matching segments to cells only once."""
+    matches = match_cells(ocr_results, table_cells)
+    return [merge_results(ocr_results, table_cells, t, matches=matches) for t in thresholds]
+
+def draw_results(image, results, table_cells=None):
+    """Return a BGR copy of the page with cells (blue), table text (green) and other text (red)."""
+    import cv2
+    image = as_page(image).bgr.copy()
 
     if table_cells:
         for cell in table_cells:
@@ -269,36 +831,205 @@ def visualize_results(image_path, results, output_path, table_cells=None):
         is_table = item.get('is_table_cell', False)
         color = (0, 255, 0) if is_table else (0, 0, 255)
         cv2.polylines(image, [box], isClosed=True, color=color, thickness=2)
-        
-    cv2.imwrite(output_path, image)
+    return image
+
+def visualize_results(image, results, output_path, table_cells=None):
+    try:
+        canvas = draw_results(image, results, table_cells)
+    except Exception as e:
+        print(f"Visualization Error: {e}")
+        return
+    import cv2
+    cv2.imwrite(output_path, canvas)
+
+# Stage names as used in logs -> `stage` label in metrics and traces
+_STAGE_METRIC_NAMES = {"HunyuanOCR": "ocr", "LORE": "lore", "Wired Table": "wired", "Table Gate": "table_gate"}
+
+def _stage_label(stage):
+    return _STAGE_METRIC_NAMES.get(stage, stage.lower())
+
+def _timed_stage(stage, fn, *args, trace=None, page_num=None):
+    label = _stage_label(stage)
+    start = time.perf_counter()
+    with STAGE_IN_PROGRESS.track(stage=label):
+        result = fn(*args)
+    elapsed = time.perf_counter() - start
+    STAGE_SECONDS.observe(elapsed, stage=label)
+    if trace is not None:
+        trace.add(label, start, elapsed, page=page_num)
+    print(f"[timing] {stage} took {elapsed:.3f}s")
+    return result
+
+class _Speculation:
+    """A stage run that may be called off: whichever of start() and cancel() comes first wins."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._started = False
+        self._cancelled = False
+
+    def start(self):
+        """False if cancelled, else the run goes ahead."""
+        with self._lock:
+            self._started = not self._cancelled
+            return self._started
+
+    def cancel(self):
+        """True if the run never started (and now never will)."""
+        with self._lock:
+            self._cancelled = True
+            return not self._started
 
-def process_image(image_path, mode, prompt, iou_threshold, output_vis_path):
-    print(f"Starting OCR process for {image_path} in mode {mode}")
-    # 1. HunyuanOCR
-    ocr_results = get_hunyuan_ocr(image_path, prompt)
+def _limited_stage(slots, stage, fn, *args, skip=None, **trace_kwargs):
+    with slots:
+        if skip is not None and not skip.start():
+            return None
+        return _timed_stage(stage, fn, *args, **trace_kwargs)
+
+def _check_ruling_page(page):
+    return check_ruling(gate_image(page.pil))
+
+def _cached_stage(cache_key, slots, stage, fn, *args, trace=None, page_num=None, skip=None):
+    """Cached, concurrency-limited stage call. Returns None without running `fn` if the
+    `skip` _Speculation is cancelled by the time a slot is free."""
+    start = time.perf_counter()
+    cached = result_cache.get(cache_key)
+    if cached is not None:
+        print(f"[cache] {stage} hit")
+        if trace is not None:
+            trace.add(_stage_label(stage), start, time.perf_counter() - start, page=page_num, cache="hit")
+        return cached
+    result = _limited_stage(slots, stage, fn, *args, skip=skip, trace=trace, page_num=page_num)
+    # Empty output is also what a failed model call looks like, so never pin it; nor output
+    # known to be incomplete, which a later run may get in full
+    if result and not isinstance(result, PartialResult):
+        result_cache.put(cache_key, result)
+    return result
+
+def process_page(image, mode, prompt, iou_threshold, trace=None, page_num=None, on_segments=None):
+    """OCR one page (plus table structure and merge in table modes) without drawing anything.
+
+    Returns {"results": merged or plain OCR results, "table_cells": cells ([] in pure OCR mode),
+    "ocr_results": the raw OCR segments before merging, "table_gate": the gate's decision in
+    table modes, else None}.
+    Stage timings go to the metrics registry and, when given, to the job's `trace`.
+    `on_segments(segments, replace=False)` receives raw OCR segments as soon as they are
+    recognized, before table structure and merge; with `replace` the segments sent so far
+    for the page are superseded (a truncated response re-OCR'd as tiles).
+    """
+    # `image` is a path or an already loaded PageImage; either way it is decoded once
+    page = as_page(image)
+    print(f"Starting OCR process for {page.name} in mode {mode}")
+    page_start = time.perf_counter()
+    trace_kwargs = {"trace": trace, "page_num": page_num}
+
+    # "Table" / "NoTable" name the structure model; "Auto" leaves it to the gate
+    structure_mode = mode if mode in ("Table", "NoTable") else None
+
+    page_hash = page.content_hash
+
+    def submit_structure(structure_mode, skip=None):
+        if structure_mode == "NoTable":
+            # Lineless Table (LORE)
+            structure_name, structure_fn, structure_model = "LORE", get_lore_structure, TABLE_MODEL_PATH
+        else:
+            # Wired Table
+            structure_name, structure_fn, structure_model = "Wired Table", get_wired_structure, WIRED_TABLE_MODEL_PATH
+        print(f"Running {structure_name} structure recognition...")
+        cells_key = make_key("cells", page_hash, structure_mode, structure_model)
+        return structure_name, _stage_executor.submit(_cached_stage, cells_key, _table_slots, structure_name,
+                                                      structure_fn, page, skip=skip, **trace_kwargs)
+
+    # 1. HunyuanOCR (remote) and table structure (local) don't depend on each other,
+    #    so run them side by side and only join before the merge.
+    ocr_key = make_key("ocr", page_hash, HUNYUAN_MODEL, OCR_GENERATION_PARAMS, OCR_MAX_PIXELS, OCR_JPEG_QUALITY, prompt,
+                       OCR_TILING and (OCR_TILE_PAGE_PIXELS, OCR_TILE_MAX_PIXELS, OCR_TILE_MAX_WIDTH, OCR_TILE_OVERLAP))
+    streamed = []
+    if on_segments is not None:
+        def forward_segments(segments, replace=False):
+            if replace:
+                streamed.clear()
+            streamed.extend(segments)
+            on_segments(segments, replace=replace)
+    else:
+        forward_segments = None
+    ocr_future = _stage_executor.submit(_cached_stage, ocr_key, _ocr_slots, "HunyuanOCR", get_hunyuan_ocr,
+                                        page, prompt, forward_segments, **trace_kwargs)
+    # The gate only needs the image, so it runs while the OCR request is out
+    gate = None
+    if mode == "Auto" or (structure_mode is not None and TABLE_GATE):
+        # On a small grayscale copy of the decoded page, not another full-size BGR decode
+        gate = _timed_stage("Table Gate", _check_ruling_page, page, **trace_kwargs)
+        if mode == "Auto" and (gate.decision == RULED or TABLE_GATE_SHADOW):
+            structure_mode = "Table" if gate.decision == RULED else "NoTable"
+    cells_future = None
+    speculative = None
+    speculated = False
+    if structure_mode is not None and (gate is None or gate.has_table or TABLE_GATE_SHADOW):
+        structure_name, cells_future = submit_structure(structure_mode)
+    elif gate is not None and TABLE_GATE_SPECULATE:
+        # Only the layout check can still find a table; a lineless one in "Auto"
+        speculative = _Speculation()
+        structure_name, cells_future = submit_structure(structure_mode or "NoTable", skip=speculative)
+
+    ocr_results = ocr_future.result()
     print(f"HunyuanOCR completed, detected {len(ocr_results)} segments.")
+    if on_segments is not None and ocr_results and not streamed:
+        # Cache hit or streaming disabled: hand over everything at once
+        on_segments(ocr_results)
+    SEGMENTS_PER_PAGE.observe(len(ocr_results))
+
+    if gate is not None:
+        # No ruling grid: a lineless table still shows up as aligned columns of OCR boxes
+        check_layout(gate, ocr_results, page.size[0])
+        if speculative is not None:
+            if gate.decision == LAYOUT:
+                structure_mode = structure_mode or "NoTable"
+            else:
+                # No table after all: a queued speculative run never starts, a running one is ignored
+                speculated = not speculative.cancel()
+                cells_future = None
+        elif cells_future is None and gate.decision == LAYOUT:
+            structure_mode = structure_mode or "NoTable"
+            structure_name, cells_future = submit_structure(structure_mode)
     
-    if mode == "Hunyuanocr":
-        # Pure OCR
-        visualize_results(image_path, ocr_results, output_vis_path)
-        return ocr_results
-        
-    elif mode == "NoTable":
-        # Lineless Table (LORE)
-        print("Running LORE structure recognition...")
-        table_cells = get_lore_structure(image_path)
-        print(f"LORE structure recognition completed, detected {len(table_cells)} cells.")
-        merged_results = merge_results(ocr_results, table_cells, iou_threshold)
-        visualize_results(image_path, merged_results, output_vis_path, table_cells)
-        return merged_results
-        
-    elif mode == "Table":
-        # Wired Table
-        print("Running Wired Table structure recognition...")
-        table_cells = get_wired_structure(image_path)
-        print(f"Wired Table structure recognition completed, detected {len(table_cells)} cells.")
-        merged_results = merge_results(ocr_results, table_cells, iou_threshold)
-        visualize_results(image_path, merged_results, output_vis_path, table_cells)
-        return merged_results
-        
-    return ocr_results
+    if cells_future is None:
+        if gate is None:
+            output = {"results": ocr_results, "table_cells": []}
+        else:
+            if speculated:
+                print(f"Table gate found no table on {page.name}, discarded speculative {structure_name} run.")
+            else:
+                print(f"Table gate found no table on {page.name}, skipped structure recognition.")
+            TABLE_GATE_DECISIONS.inc(mode=mode, decision=gate.decision,
+                                     outcome="speculated_wasted" if speculated else "skipped")
+            output = {"results": merge_results(ocr_results, [], iou_threshold), "table_cells": []}
+    else:
+        table_cells = cells_future.result()
+        print(f"{structure_name} structure recognition completed, detected {len(table_cells)} cells.")
+        CELLS_PER_PAGE.observe(len(table_cells), mode=structure_mode)
+        if gate is not None:
+            TABLE_GATE_DECISIONS.inc(mode=mode, decision=gate.decision, outcome="cells" if table_cells else "no_cells")
+        merged_results = _timed_stage("merge", merge_results, ocr_results, table_cells, iou_threshold, **trace_kwargs)
+        output = {"results": merged_results, "table_cells": table_cells}
+
+    output["ocr_results"] = ocr_results
+    output["table_gate"] = None
+    if gate is not None:
+        output["table_gate"] = {**gate.to_dict(), "structure": structure_mode if cells_future is not None else None}
+
+    elapsed = time.perf_counter() - page_start
+    STAGE_SECONDS.observe(elapsed, stage="page")
+    if trace is not None:
+        trace.add("page", page_start, elapsed, page=page_num,
+                  segments=len(ocr_results), cells=len(output["table_cells"]))
+    print(f"[timing] page total {elapsed:.3f}s")
+    return output
+
+def process_image(image, mode, prompt, iou_threshold, output_vis_path=None):
+    """process_page() plus an eager visualization written to `output_vis_path` when given."""
+    page = as_page(image)
+    output = process_page(page, mode, prompt, iou_threshold)
+    if output_vis_path and mode in ("Hunyuanocr", "NoTable", "Table", "Auto"):
+        _timed_stage("visualize", visualize_results, page, output["results"], output_vis_path, output["table_cells"])
+    return output["results"]
@@ -0,0 +1,212 @@
+import base64
+import io
+import os
+import threading
+
+import numpy as np
+from PIL import Image
+
+from result_cache import hash_bytes
+
+PAGE_JPEG_QUALITY = 95
+
+_MIME_TYPES = {
+    "JPEG": "image/jpeg",
+    "PNG": "image/png",
+    "BMP": "image/bmp",
+    "TIFF": "image/tiff",
+    "WEBP": "image/webp",
+}
+
+
+class PageImage:
+    """One page, decoded at most once and shared by every pipeline stage.
+
+    Holds the encoded bytes (for hashing and the OCR payload) and lazily derives the
+    RGB PIL image (table models) and BGR ndarray (OpenCV drawing) from them.
+    Properties are safe to read from several stage threads at once.
+    """
+
+    def __init__(self, data=None, pil=None, name="page", image_format=None):
+        self.name = name
+        self._data = data
+        self._pil = pil
+        self._format = image_format
+        self._size = pil.size if pil is not None else None
+        self._bgr = None
+        self._base64 = None
+        self._hash = None
+        self._derived = {}
+        self._lock = threading.RLock()
+
+    @classmethod
+    def from_path(cls, path):
+        with open(path, "rb") as f:
+            data = f.read()
+        return cls(data=data, name=os.path.basename(path))
+
+    @classmethod
+    def from_bytes(cls, data, name="page"):
+        return cls(data=data, name=name)
+
+    @classmethod
+    def from_pil(cls, img, name="page"):
+        """Wrap an already decoded image (e.g. a rendered PDF page); nothing touches disk."""
+        if img.mode != "RGB":
+            img = img.convert("RGB")
+        return cls(pil=img, name=name, image_format="JPEG")
+
+    @property
+    def data(self):
+        """Encoded image bytes; in-memory pages are JPEG-encoded on first use."""
+        with self._lock:
+            if self._data is None:
+                buffer = io.BytesIO()
+                self._pil.save(buffer, "JPEG", quality=PAGE_JPEG_QUALITY)
+                self._data = buffer.getvalue()
+            return self._data
+
+    @property
+    def format(self):
+        with self._lock:
+            if self._format is None:
+                with Image.open(io.BytesIO(self._data)) as img:
+                    self._format = img.format
+                    self._size = img.size
+            return self._format
+
+    @property
+    def mime_type(self):
+        return _MIME_TYPES.get(self.format, "image/jpeg")
+
+    @property
+    def size(self):
+        with self._lock:
+            if self._size is None:
+                # Reads the header only
+                with Image.open(io.BytesIO(self._data)) as img:
+                    self._size = img.size
+                    self._format = img.format
+            return self._size
+
+    @property
+    def pil(self):
+        """Decoded RGB image. Treat as read-only; it is shared across stages."""
+        with self._lock:
+            if self._pil is None:
+                img = Image.open(io.BytesIO(self._data))
+                self._format = img.format
+                img = img.convert("RGB")
+                self._pil = img
+                self._size = img.size
+            return self._pil
+
+    @property
+    def bgr(self):
+        """Decoded image as an OpenCV BGR ndarray. Copy before drawing on it."""
+        with self._lock:
+            if self._bgr is None:
+                self._bgr = np.ascontiguousarray(np.asarray(self.pil)[:, :, ::-1])
+            return self._bgr
+
+    @property
+    def base64(self):
+        with self._lock:
+            if self._base64 is None:
+                self._base64 = base64.b64encode(self.data).decode("utf-8")
+            return self._base64
+
+    @property
+    def content_hash(self):
+        with self._lock:
+            if self._hash is None:
+                self._hash = hash_bytes(self.data)
+            return self._hash
+
+    def derived(self, key, build):
+        """Memoise a value computed from this page (e.g. an OCR payload for given settings)."""
+        with self._lock:
+            if key not in self._derived:
+                self._derived[key] = build(self)
+            return self._derived[key]
+
+    def release(self):
+        """Drop decoded buffers once the page is finished."""
+        with self._lock:
+            self._bgr = None
+            self._derived.clear()
+            if self._data is not None:
+                self._pil = None
+
+
+# Formats HunyuanOCR (vLLM) accepts as-is; anything else is re-encoded before sending
+OCR_PASSTHROUGH_FORMATS = ("JPEG", "PNG", "WEBP")
+
+
+class OCRPayload:
+    def __init__(self, base64_data, mime_type, sent_size, original_size):
+        self.base64 = base64_data
+        self.mime_type = mime_type
+        self.sent_size = sent_size
+        self.original_size = original_size
+
+    @property
+    def scale(self):
+        return self.sent_size[0] / self.original_size[0] if self.original_size[0] else 1.0
+
+
+def _fit_pixels(size, max_pixels):
+    w, h = size
+    if not max_pixels or w * h <= max_pixels:
+        return size
+    ratio = (max_pixels / float(w * h)) ** 0.5
+    return max(1, int(w * ratio)), max(1, int(h * ratio))
+
+
+def prepare_for_ocr(page, max_pixels=None, jpeg_quality=None):
+    """Build the image payload sent to HunyuanOCR.
+
+    The page is downscaled to at most `max_pixels` (aspect ratio kept) and re-encoded
+    as JPEG at `jpeg_quality` when given; otherwise the original bytes are sent when
+    the format allows. `sent_size` / `original_size` let callers map boxes back.
+    """
+    original_size = page.size
+    sent_size = _fit_pixels(original_size, max_pixels)
+    if sent_size == original_size and jpeg_quality is None and page.format in OCR_PASSTHROUGH_FORMATS:
+        return OCRPayload(page.base64, page.mime_type, original_size, original_size)
+
+    img = page.pil
+    if sent_size != original_size:
+        img = img.resize(sent_size, Image.BICUBIC)
+    buffer = io.BytesIO()
+    if jpeg_quality is None and page.format == "PNG":
+        img.save(buffer, "PNG")
+        mime_type = "image/png"
+    else:
+        img.save(buffer, "JPEG", quality=jpeg_quality or PAGE_JPEG_QUALITY)
+        mime_type = "image/jpeg"
+    return OCRPayload(base64.b64encode(buffer.getvalue()).decode("utf-8"), mime_type, sent_size, original_size)
+
+
+def tile_boxes(size, rows, cols, overlap):
+    """Split a (w, h) page into rows x cols crop boxes (x0, y0, x1, y1) overlapping by `overlap` px."""
+    w, h = size
+
+    def spans(length, n):
+        step = length / float(n)
+        return [(max(0, int(i * step) - overlap // 2), min(length, int((i + 1) * step) + overlap // 2))
+                for i in range(n)]
+
+    return [(x0, y0, x1, y1) for y0, y1 in spans(h, rows) for x0, x1 in spans(w, cols)]
+
+
+def crop_page(page, box, name=None):
+    """A new in-memory PageImage for the `box` region of `page`."""
+    return PageImage.from_pil(page.pil.crop(box), name=name or f"{page.name}_crop")
+
+
+def as_page(image):
+    """Accept either a PageImage or a path, as the ocr_service entry points do."""
+    if isinstance(image, PageImage):
+        return image
+    return PageImage.from_path(image)
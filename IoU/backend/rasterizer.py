@@ -0,0 +1,66 @@
+import asyncio
+import functools
+
+import time
+
+from metrics import STAGE_SECONDS
+
+# Rendering settings for PDF pages
+PDF_DPI = 200
+# Pages rendered per pdftoppm call; at most two windows are held in memory at once
+PDF_WINDOW = 4
+
+
+def count_pdf_pages(pdf_path):
+    from pdf2image import pdfinfo_from_path
+    return int(pdfinfo_from_path(pdf_path)["Pages"])
+
+
+def render_pdf_window(pdf_path, first_page, last_page, dpi=PDF_DPI):
+    from pdf2image import convert_from_path
+    start = time.perf_counter()
+    images = convert_from_path(pdf_path, dpi=dpi, first_page=first_page, last_page=last_page)
+    if images:
+        # Per-page cost, so it lines up with the other stages
+        per_page = (time.perf_counter() - start) / len(images)
+        for _ in images:
+            STAGE_SECONDS.observe(per_page, stage="rasterize")
+    return images
+
+
+def iter_pdf_pages(pdf_path, dpi=PDF_DPI, window=PDF_WINDOW, total_pages=None):
+    """Yield (page_num, PIL image) one window at a time, page numbers starting at 1."""
+    if total_pages is None:
+        total_pages = count_pdf_pages(pdf_path)
+    for first in range(1, total_pages + 1, window):
+        last = min(first + window - 1, total_pages)
+        for offset, img in enumerate(render_pdf_window(pdf_path, first, last, dpi)):
+            yield first + offset, img
+
+
+async def stream_pdf_pages(pdf_path, executor, dpi=PDF_DPI, window=PDF_WINDOW, total_pages=None):
+    """Async version of iter_pdf_pages that renders in `executor`.
+
+    The next window is rendered while the caller consumes the current one, so the
+    first page is available after one window instead of after the whole document.
+    """
+    loop = asyncio.get_running_loop()
+    if total_pages is None:
+        total_pages = await loop.run_in_executor(executor, count_pdf_pages, pdf_path)
+
+    def submit(first):
+        last = min(first + window - 1, total_pages)
+        return loop.run_in_executor(executor, functools.partial(render_pdf_window, pdf_path, first, last, dpi))
+
+    starts = list(range(1, total_pages + 1, window))
+    pending = submit(starts[0]) if starts else None
+    try:
+        for k, first in enumerate(starts):
+            images = await pending
+            pending = submit(starts[k + 1]) if k + 1 < len(starts) else None
+            for offset, img in enumerate(images):
+                yield first + offset, img
+            del images
+    finally:
+        if pending is not None:
+            pending.cancel()
@@ -0,0 +1,111 @@
+import json
+import os
+import threading
+
+import numpy as np
+
+# Output formats for a document's results
+JSON = "json"        # one JSON array of pages, written when the document is done
+NDJSON = "ndjson"    # one {"page", "results"} line per page, appended as pages finish
+NPZ = "npz"          # columnar NumPy arrays (page, text, boxes, ...), for bulk consumers
+OUTPUT_FORMATS = (JSON, NDJSON, NPZ)
+
+# Box encodings
+POINTS = "points"    # [[x1, y1], [x2, y1], [x2, y2], [x1, y2]], as produced by the pipeline
+XYXY = "xyxy"        # [x1, y1, x2, y2]
+FLAT = "flat"        # [x1, y1, x2, y2, x3, y3, x4, y4]
+BOX_FORMATS = (POINTS, XYXY, FLAT)
+
+
+def encode_box(points, box_format=POINTS):
+    if box_format == XYXY:
+        xs = [p[0] for p in points]
+        ys = [p[1] for p in points]
+        return [min(xs), min(ys), max(xs), max(ys)]
+    if box_format == FLAT:
+        return [v for p in points for v in p]
+    return points
+
+
+def encode_results(results, box_format=POINTS):
+    if box_format == POINTS:
+        return results
+    return [{**item, "box": encode_box(item["box"], box_format)} for item in results]
+
+
+def result_filename(file_id, output_format):
+    return f"{file_id}.{output_format}"
+
+
+class ResultWriter:
+    """Writes a document's results in one of OUTPUT_FORMATS.
+
+    `write_page` is called as pages complete, in any order; `close` finishes the
+    file. NDJSON lines hit the disk immediately, so the file can be read while the
+    rest of the document is still being processed.
+    """
+
+    def __init__(self, result_dir, file_id, output_format=JSON, box_format=POINTS):
+        if output_format not in OUTPUT_FORMATS:
+            raise ValueError(f"Unknown output format: {output_format}")
+        if box_format not in BOX_FORMATS:
+            raise ValueError(f"Unknown box format: {box_format}")
+        self.output_format = output_format
+        self.box_format = box_format
+        self.filename = result_filename(file_id, output_format)
+        self.path = os.path.join(result_dir, self.filename)
+        self._pages = {}
+        self._lock = threading.Lock()
+        self._file = None
+        if output_format == NDJSON:
+            self._file = open(self.path, "w", encoding="utf-8")
+
+    def write_page(self, page_num, results):
+        with self._lock:
+            if self.output_format == NDJSON:
+                line = {"page": page_num, "results": encode_results(results, self.box_format)}
+                self._file.write(json.dumps(line, ensure_ascii=False, separators=(",", ":")) + "\n")
+                self._file.flush()
+            elif self.output_format == NPZ:
+                self._pages[page_num] = self._columns(page_num, results)
+            else:
+                self._pages[page_num] = encode_results(results, self.box_format)
+
+    def _columns(self, page_num, results):
+        # Kept as arrays per page, which is far smaller than the result dicts
+        boxes = [encode_box(item["box"], self.box_format) for item in results]
+        box_shape = {POINTS: (0, 4, 2), XYXY: (0, 4), FLAT: (0, 8)}[self.box_format]
+        return {
+            "page": np.full(len(results), page_num, dtype=np.int32),
+            "text": np.array([item.get("text", "") for item in results], dtype=str),
+            "boxes": np.array(boxes, dtype=np.int32) if boxes else np.zeros(box_shape, dtype=np.int32),
+            "is_table_cell": np.array([bool(item.get("is_table_cell")) for item in results], dtype=bool),
+            "cell_id": np.array([item.get("cell_id", -1) for item in results], dtype=np.int32),
+        }
+
+    def close(self):
+        with self._lock:
+            if self.output_format == NDJSON:
+                self._file.close()
+            elif self.output_format == NPZ:
+                pages = [self._pages[n] for n in sorted(self._pages)]
+                if pages:
+                    columns = {name: np.concatenate([p[name] for p in pages]) for name in pages[0]}
+                else:
+                    columns = self._columns(0, [])
+                np.savez(self.path, **columns)
+            else:
+                data = [{"page": n, "results": self._pages[n]} for n in sorted(self._pages)]
+                with open(self.path, "w", encoding="utf-8") as f:
+                    if self.box_format == POINTS:
+                        json.dump(data, f, ensure_ascii=False, indent=2)
+                    else:
+                        json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+            self._pages = {}
+
+    def abort(self):
+        """Close without finishing; a partial NDJSON file stays as far as it got."""
+        with self._lock:
+            if self._file is not None and not self._file.closed:
+                self._file.close()
+            self._pages = {}
@@ -0,0 +1,158 @@
+import numpy as np
+
+# Ruling-line check runs on a downscaled grayscale copy of the page
+GATE_MAX_SIDE = 1200
+# A ruled table needs at least this many long horizontal and vertical lines and crossings;
+# a plain page frame (2 + 2 lines, 4 crossings) does not count
+GATE_MIN_LINES = 3
+GATE_MIN_INTERSECTIONS = 9
+# Lines shorter than 1/GATE_LINE_FRACTION of the page side are ignored (underlines, text strokes)
+GATE_LINE_FRACTION = 10
+# OCR layout check: rows with at least GATE_MIN_COLUMNS segments whose left edges line up
+# in at least GATE_MIN_ROWS rows
+GATE_MIN_ROWS = 3
+GATE_MIN_COLUMNS = 3
+GATE_ALIGN_TOLERANCE = 0.015
+
+# Decisions
+RULED = "ruled"      # ruling lines form a grid: a wired table
+LAYOUT = "layout"    # no grid, but the OCR boxes sit in aligned columns: likely a lineless table
+NONE = "none"        # no table found; structure recognition is skipped
+
+
+class GateDecision:
+    def __init__(self, decision, h_lines=0, v_lines=0, intersections=0, aligned_rows=0, aligned_columns=0):
+        self.decision = decision
+        self.h_lines = h_lines
+        self.v_lines = v_lines
+        self.intersections = intersections
+        self.aligned_rows = aligned_rows
+        self.aligned_columns = aligned_columns
+
+    @property
+    def has_table(self):
+        return self.decision != NONE
+
+    def to_dict(self):
+        return {
+            "decision": self.decision,
+            "h_lines": self.h_lines,
+            "v_lines": self.v_lines,
+            "intersections": self.intersections,
+            "aligned_rows": self.aligned_rows,
+            "aligned_columns": self.aligned_columns,
+        }
+
+
+def gate_image(pil, max_side=GATE_MAX_SIDE):
+    """Downscaled grayscale ndarray of an already decoded PIL page, for detect_ruling."""
+    from PIL import Image
+    w, h = pil.size
+    if max(w, h) > max_side:
+        ratio = max_side / float(max(w, h))
+        # Box filter, like cv2.INTER_AREA; only the small copy is ever converted
+        pil = pil.resize((max(1, int(w * ratio)), max(1, int(h * ratio))), Image.BOX)
+    return np.asarray(pil.convert("L"))
+
+
+def _count_components(mask, min_size=0, axis=None):
+    import cv2
+    n, _, stats, _ = cv2.connectedComponentsWithStats(mask, connectivity=8)
+    count = 0
+    for i in range(1, n):
+        size = stats[i, cv2.CC_STAT_WIDTH] if axis == "h" else stats[i, cv2.CC_STAT_HEIGHT] if axis == "v" else 1
+        if size >= min_size:
+            count += 1
+    return count
+
+
+def detect_ruling(bgr, max_side=GATE_MAX_SIDE):
+    """Count long horizontal / vertical ruling lines and their crossings.
+
+    Returns (h_lines, v_lines, intersections).
+    """
+    import cv2
+    gray = cv2.cvtColor(bgr, cv2.COLOR_BGR2GRAY) if bgr.ndim == 3 else bgr
+    h, w = gray.shape[:2]
+    if max(h, w) > max_side:
+        ratio = max_side / float(max(h, w))
+        gray = cv2.resize(gray, (max(1, int(w * ratio)), max(1, int(h * ratio))), interpolation=cv2.INTER_AREA)
+        h, w = gray.shape[:2]
+    binary = cv2.adaptiveThreshold(255 - gray, 255, cv2.ADAPTIVE_THRESH_MEAN_C, cv2.THRESH_BINARY, 15, -2)
+
+    min_h_len = max(10, w // GATE_LINE_FRACTION)
+    min_v_len = max(10, h // GATE_LINE_FRACTION)
+    horizontal = cv2.morphologyEx(binary, cv2.MORPH_OPEN, cv2.getStructuringElement(cv2.MORPH_RECT, (min_h_len, 1)))
+    vertical = cv2.morphologyEx(binary, cv2.MORPH_OPEN, cv2.getStructuringElement(cv2.MORPH_RECT, (1, min_v_len)))
+
+    h_lines = _count_components(horizontal, min_h_len, axis="h")
+    v_lines = _count_components(vertical, min_v_len, axis="v")
+    if h_lines == 0 or v_lines == 0:
+        return h_lines, v_lines, 0
+    # Thicken a little so lines that meet without overlapping exactly still cross
+    kernel = np.ones((3, 3), np.uint8)
+    crossings = cv2.bitwise_and(cv2.dilate(horizontal, kernel), cv2.dilate(vertical, kernel))
+    return h_lines, v_lines, _count_components(crossings)
+
+
+def layout_alignment(segments, page_width):
+    """(aligned_rows, aligned_columns) for OCR segments laid out like a table.
+
+    Segments are grouped into rows by vertical overlap; left edges of rows with several
+    segments are clustered, and a column counts when it recurs in GATE_MIN_ROWS rows.
+    """
+    boxes = []
+    for item in segments:
+        xs = [p[0] for p in item["box"]]
+        ys = [p[1] for p in item["box"]]
+        boxes.append((min(xs), min(ys), max(xs), max(ys)))
+    if len(boxes) < GATE_MIN_ROWS * GATE_MIN_COLUMNS:
+        return 0, 0
+
+    rows = []
+    for box in sorted(boxes, key=lambda b: (b[1] + b[3]) / 2.0):
+        center = (box[1] + box[3]) / 2.0
+        if rows and abs(center - rows[-1]["center"]) <= max(1.0, (box[3] - box[1]) / 2.0):
+            rows[-1]["lefts"].append(box[0])
+        else:
+            rows.append({"center": center, "lefts": [box[0]]})
+    multi = [row["lefts"] for row in rows if len(row["lefts"]) >= GATE_MIN_COLUMNS]
+    if len(multi) < GATE_MIN_ROWS:
+        return len(multi), 0
+
+    # 1-D clustering of left edges; each cluster remembers which rows it was seen in
+    tolerance = max(2.0, page_width * GATE_ALIGN_TOLERANCE)
+    points = sorted((x, r) for r, lefts in enumerate(multi) for x in lefts)
+    columns = []
+    for x, r in points:
+        if columns and x - columns[-1]["last"] <= tolerance:
+            columns[-1]["rows"].add(r)
+            columns[-1]["last"] = x
+        else:
+            columns.append({"last": x, "rows": {r}})
+    aligned = [c for c in columns if len(c["rows"]) >= GATE_MIN_ROWS]
+    # Rows that actually have a segment in GATE_MIN_COLUMNS of those columns
+    hits = {}
+    for column in aligned:
+        for r in column["rows"]:
+            hits[r] = hits.get(r, 0) + 1
+    aligned_rows = sum(1 for count in hits.values() if count >= GATE_MIN_COLUMNS)
+    return aligned_rows, len(aligned)
+
+
+def check_ruling(bgr):
+    """Image-only part of the gate: RULED when ruling lines form a grid, else NONE."""
+    h_lines, v_lines, intersections = detect_ruling(bgr)
+    ruled = (h_lines >= GATE_MIN_LINES and v_lines >= GATE_MIN_LINES
+             and intersections >= GATE_MIN_INTERSECTIONS)
+    return GateDecision(RULED if ruled else NONE, h_lines, v_lines, intersections)
+
+
+def check_layout(decision, segments, page_width):
+    """Second part of the gate, once OCR is done: upgrade NONE to LAYOUT for aligned columns."""
+    aligned_rows, aligned_columns = layout_alignment(segments, page_width)
+    decision.aligned_rows = aligned_rows
+    decision.aligned_columns = aligned_columns
+    if decision.decision == NONE and aligned_rows >= GATE_MIN_ROWS and aligned_columns >= GATE_MIN_COLUMNS:
+        decision.decision = LAYOUT
+    return decision
@@ -0,0 +1,252 @@
+import multiprocessing
+import queue
+import threading
+from concurrent.futures import CancelledError, Future, InvalidStateError, ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+# Table-structure kinds served by the pool
+LORE = "lore"
+WIRED = "wired"
+
+# How long warm_up() waits for all workers to finish starting
+WARMUP_TIMEOUT = 600
+# How long recognize() waits for one page; a warm pool that takes longer is assumed hung
+# and its worker processes are restarted
+RECOGNIZE_TIMEOUT = 300
+# Times a page is sent again after its worker process died under it (e.g. another page
+# of its batch crashed the process); a page that keeps killing workers then fails
+RECOGNIZE_RETRIES = 1
+
+
+# --- Worker process side ---
+
+_warmup_error = None
+_warmup_barrier = None
+
+
+def _init_worker(kind, warmup_page, barrier):
+    # Load the model once per worker process (and run it once), before any page arrives
+    global _warmup_error, _warmup_barrier
+    _warmup_barrier = barrier
+    try:
+        if warmup_page is not None:
+            _probe_batch(kind, [warmup_page])
+        else:
+            import ocr_service
+            if ocr_service.get_table_pipeline(kind) is None:
+                raise RuntimeError(f"{kind} model could not be loaded")
+        print(f"[table-worker] {kind} model ready")
+    except Exception as e:
+        _warmup_error = str(e)
+        print(f"[table-worker] {kind} model unavailable: {e}")
+
+
+def _warmup_report(timeout):
+    # Every report task holds its worker at the barrier until all workers have one,
+    # so each worker process (started and initialized by now) answers exactly once
+    try:
+        _warmup_barrier.wait(timeout)
+    except threading.BrokenBarrierError:
+        return "timed out waiting for the other workers to start"
+    return _warmup_error
+
+
+def _infer_batch(kind, encoded_pages):
+    import ocr_service
+    from page_image import PageImage
+    images = [PageImage.from_bytes(data).pil for data in encoded_pages]
+    return ocr_service.run_table_pipeline(kind, images)
+
+
+def _probe_batch(kind, encoded_pages):
+    import ocr_service
+    from page_image import PageImage
+    ocr_service.probe_table_model(kind, [PageImage.from_bytes(data).pil for data in encoded_pages])
+
+
+# --- Parent side ---
+
+def _settle(future, result=None, error=None):
+    """Complete `future` unless it already is (a timed-out caller settled it); True if this did."""
+    try:
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+    except InvalidStateError:
+        return False
+    return True
+
+
+class _Request:
+    def __init__(self, data):
+        self.data = data
+        self.future = Future()
+        self.attempts = 0
+
+
+class TableStructurePool:
+    """Process pool for one table-structure model (LORE or wired).
+
+    Every worker loads the model once in its initializer and, given `warmup_page`, runs
+    one inference on it there. Requests queue up in the parent; whenever a worker is free,
+    everything waiting (up to `max_batch`) is sent to it as one batched inference call.
+
+    When a worker process dies (OOM kill, crash in native code) the executor is broken for
+    good, so it is replaced by a new one and `on_restart()` is called in the background to
+    warm it up again (default: warm_up()). A page hanging past RECOGNIZE_TIMEOUT gets the
+    same treatment.
+    """
+
+    def __init__(self, kind, workers=2, max_batch=4, warmup_page=None, on_restart=None):
+        self.kind = kind
+        self.workers = workers
+        self.max_batch = max_batch
+        self.warmup_page = warmup_page
+        self.on_restart = on_restart or self.warm_up
+        self.restarts = 0
+        self._lock = threading.Lock()
+        self._warm = False
+        self._executor = self._new_executor()
+        self._requests = queue.Queue()
+        self._free_workers = threading.Semaphore(workers)
+        self._dispatcher = threading.Thread(target=self._dispatch_loop, name=f"table-{self.kind}-dispatch", daemon=True)
+        self._dispatcher.start()
+
+    def _new_executor(self):
+        # "spawn" keeps CUDA and ModelScope state out of forked children
+        context = multiprocessing.get_context("spawn")
+        return ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=context,
+            initializer=_init_worker,
+            initargs=(self.kind, self.warmup_page, context.Barrier(self.workers))
+        )
+
+    def warm_up(self, timeout=WARMUP_TIMEOUT):
+        """Start every worker process now and wait for their initializers (model load and
+        warm-up inference); raises if any worker's model failed to load or to run.
+
+        Call before submitting pages: the workers are held until all of them have started.
+        """
+        executor = self._executor
+        futures = [executor.submit(_warmup_report, timeout) for _ in range(self.workers)]
+        errors = [error for error in (future.result() for future in futures) if error]
+        if errors:
+            raise RuntimeError(f"{self.kind} warm-up failed in {len(errors)} of {self.workers} workers: {errors[0]}")
+        with self._lock:
+            if executor is self._executor:
+                self._warm = True
+
+    def submit(self, encoded_page):
+        request = _Request(encoded_page)
+        self._requests.put(request)
+        return request.future
+
+    def recognize(self, encoded_page, timeout=RECOGNIZE_TIMEOUT):
+        future = self.submit(encoded_page)
+        try:
+            return future.result(timeout)
+        except TimeoutError:
+            error = TimeoutError(f"{self.kind} structure recognition timed out after {timeout}s")
+            if not _settle(future, error=error):
+                # Finished just now
+                return future.result()
+            with self._lock:
+                # Waiting for a (re)starting pool to load its model is slow, not hung
+                hung = self._warm
+            if hung:
+                self._restart(self._executor, "page timed out")
+            raise error
+
+    def _dispatch_loop(self):
+        while True:
+            first = self._requests.get()
+            if first is None:
+                return
+            self._free_workers.acquire()
+            # Pages that queued up while every worker was busy go out together
+            batch = [first]
+            while len(batch) < self.max_batch:
+                try:
+                    request = self._requests.get_nowait()
+                except queue.Empty:
+                    break
+                if request is None:
+                    self._requests.put(None)
+                    break
+                batch.append(request)
+            # Pages whose caller gave up (timed out) are not sent
+            batch = [request for request in batch if not request.future.done()]
+            if not batch:
+                self._free_workers.release()
+                continue
+            executor = self._executor
+            try:
+                future = executor.submit(_infer_batch, self.kind, [r.data for r in batch])
+            except BrokenProcessPool as e:
+                self._free_workers.release()
+                self._restart(executor, str(e))
+                self._retry(batch, e)
+                continue
+            except Exception as e:
+                self._free_workers.release()
+                for request in batch:
+                    self._fail(request, e)
+                continue
+            future.add_done_callback(lambda f, batch=batch, executor=executor: self._finish(f, batch, executor))
+
+    def _finish(self, future, batch, executor):
+        self._free_workers.release()
+        try:
+            outputs = future.result()
+        except (BrokenProcessPool, CancelledError) as e:
+            self._restart(executor, str(e))
+            self._retry(batch, e)
+            return
+        except Exception as e:
+            for request in batch:
+                self._fail(request, e)
+            return
+        with self._lock:
+            if executor is self._executor:
+                self._warm = True
+        for request, cells in zip(batch, outputs):
+            _settle(request.future, cells)
+
+    def _fail(self, request, error):
+        _settle(request.future, error=error)
+
+    def _retry(self, batch, error):
+        for request in batch:
+            request.attempts += 1
+            if request.attempts > RECOGNIZE_RETRIES:
+                self._fail(request, error)
+            elif not request.future.done():
+                self._requests.put(request)
+
+    def _restart(self, executor, reason):
+        """Replace `executor` (broken or hung) with a fresh one, once, and warm it up in the background."""
+        with self._lock:
+            if executor is not self._executor:
+                return
+            self._executor = self._new_executor()
+            self._warm = False
+            self.restarts += 1
+        print(f"[table-pool] {self.kind} workers restarted ({reason})")
+        # Kill the old workers too (ProcessPoolExecutor has no public way): a hung one would
+        # never exit. The old executor's pending futures fail and come back for a retry.
+        for process in list((executor._processes or {}).values()):
+            process.terminate()
+        executor.shutdown(wait=False)
+        threading.Thread(target=self._warm_up_after_restart, name=f"table-{self.kind}-restart", daemon=True).start()
+
+    def _warm_up_after_restart(self):
+        try:
+            self.on_restart()
+        except Exception as e:
+            print(f"[table-pool] {self.kind} warm-up after restart failed: {e}")
+
+    def shutdown(self):
+        self._requests.put(None)
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,97 @@
+import asyncio
+import hashlib
+import os
+import re
+import time
+import uuid
+
+# Uploads are written in chunks of this size, off the event loop
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+# Size limits per uploaded file and per request (all files together)
+MAX_UPLOAD_FILE_BYTES = 512 * 1024 * 1024
+MAX_UPLOAD_REQUEST_BYTES = 2 * 1024 * 1024 * 1024
+
+
+class UploadTooLarge(Exception):
+    """Raised when an upload goes over a size limit; its partial file is already removed."""
+
+
+class UploadBudget:
+    """Bytes a request may still upload, shared by all of its files."""
+
+    def __init__(self, max_bytes=MAX_UPLOAD_REQUEST_BYTES):
+        self.max_bytes = max_bytes
+        self.remaining = max_bytes
+
+    def consume(self, n):
+        self.remaining -= n
+        if self.remaining < 0:
+            raise UploadTooLarge(f"Upload exceeds the request limit of {self.max_bytes} bytes")
+
+
+class IngestedFile:
+    def __init__(self, path, size, sha256):
+        self.path = path
+        self.size = size
+        self.sha256 = sha256
+
+
+def safe_name(filename):
+    """File name without directories or extension, reduced to characters safe in a path."""
+    stem = os.path.splitext(os.path.basename(filename.replace("\\", "/")))[0]
+    return re.sub(r"[^\w.-]+", "_", stem).strip("._")[:80] or "file"
+
+
+def new_file_id(filename):
+    """Job ID: millisecond timestamp (sorts by upload time), random part (never collides), readable name."""
+    return f"{int(time.time() * 1000)}_{uuid.uuid4().hex[:8]}_{safe_name(filename)}"
+
+
+async def iter_upload(upload, chunk_size=UPLOAD_CHUNK_SIZE):
+    """Chunks of a FastAPI UploadFile."""
+    while True:
+        chunk = await upload.read(chunk_size)
+        if not chunk:
+            return
+        yield chunk
+
+
+def _write_chunk(f, hasher, chunk):
+    f.write(chunk)
+    hasher.update(chunk)
+
+
+async def ingest(chunks, dest_dir, ext="", max_bytes=MAX_UPLOAD_FILE_BYTES, budget=None,
+                 chunk_size=UPLOAD_CHUNK_SIZE):
+    """Write an async iterable of byte chunks to a new file in `dest_dir`, hashing it on the way.
+
+    Small chunks (a raw request body arrives in pieces of a few KB) are gathered into
+    `chunk_size` writes; writing and hashing run in the default executor so the event
+    loop stays free. Going over `max_bytes` or the request's `budget` removes the file
+    and raises UploadTooLarge. The caller moves the returned file into place.
+    """
+    loop = asyncio.get_running_loop()
+    path = os.path.join(dest_dir, f".incoming_{uuid.uuid4().hex}{ext}")
+    hasher = hashlib.sha256()
+    size = 0
+    pending = bytearray()
+    f = await loop.run_in_executor(None, open, path, "wb")
+    try:
+        async for chunk in chunks:
+            size += len(chunk)
+            if size > max_bytes:
+                raise UploadTooLarge(f"File exceeds the limit of {max_bytes} bytes")
+            if budget is not None:
+                budget.consume(len(chunk))
+            pending += chunk
+            if len(pending) >= chunk_size:
+                data, pending = bytes(pending), bytearray()
+                await loop.run_in_executor(None, _write_chunk, f, hasher, data)
+        if pending:
+            await loop.run_in_executor(None, _write_chunk, f, hasher, bytes(pending))
+    except BaseException:
+        await loop.run_in_executor(None, f.close)
+        os.remove(path)
+        raise
+    await loop.run_in_executor(None, f.close)
+    return IngestedFile(path, size, hasher.hexdigest())
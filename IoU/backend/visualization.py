@@ -0,0 +1,119 @@
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+
+from ocr_service import draw_results, remerge
+from page_image import PageImage
+
+VIS_JPEG_QUALITY = 90
+# Rendered JPEGs kept in memory (full-resolution and previews alike)
+VIS_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+
+class RemergeUnavailable(Exception):
+    """Raised when a stored page has table cells but no raw OCR segments to merge again."""
+
+
+def page_data_path(result_dir, file_id, page_num):
+    return os.path.join(result_dir, f"{file_id}_page_{page_num}_data.json")
+
+
+def stored_pages(result_dir, file_id):
+    """Page numbers of `file_id` that have stored page data, in order."""
+    pattern = re.compile(re.escape(file_id) + r"_page_(\d+)_data\.json$")
+    pages = []
+    for name in os.listdir(result_dir):
+        match = pattern.match(name)
+        if match:
+            pages.append(int(match.group(1)))
+    return sorted(pages)
+
+
+def save_page_data(path, image_name, results, table_cells, ocr_results=None):
+    """Store what a visualization or a re-merge needs: the page image's file name in the
+    upload directory, results, cells and, for pages that went through the merge, the raw
+    OCR segments. Page data is served under /results, so it never holds a server path."""
+    data = {"image": os.path.basename(image_name), "results": results, "table_cells": table_cells}
+    if ocr_results is not None:
+        data["ocr_results"] = ocr_results
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+
+
+def load_page_data(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def page_image_path(data, upload_dir):
+    """Where a stored page's image is now. Older page data held an absolute path; only its
+    file name is used, so those pages also survive a moved install."""
+    return os.path.join(upload_dir, os.path.basename(data["image"]))
+
+
+def remerge_page_data(data, thresholds):
+    """Results of a stored page merged again at each of `thresholds`."""
+    if "ocr_results" in data:
+        return remerge(data["ocr_results"], data["table_cells"], thresholds)
+    if not data.get("table_cells"):
+        # Pure OCR page, or no cells to merge into: the stored results are the answer
+        return [data["results"] for _ in thresholds]
+    raise RemergeUnavailable("Page was processed before raw OCR segments were stored")
+
+
+def render_visualization(data_path, upload_dir, max_side=None, quality=VIS_JPEG_QUALITY, iou_threshold=None):
+    """Draw a stored page and return JPEG bytes, optionally downscaled so the longer side is `max_side`.
+
+    With `iou_threshold`, the page is drawn as re-merged at that threshold instead.
+    """
+    import cv2
+    data = load_page_data(data_path)
+    results = data["results"]
+    if iou_threshold is not None:
+        results = remerge_page_data(data, [iou_threshold])[0]
+    canvas = draw_results(PageImage.from_path(page_image_path(data, upload_dir)), results, data.get("table_cells"))
+    h, w = canvas.shape[:2]
+    if max_side and max(h, w) > max_side:
+        ratio = max_side / float(max(h, w))
+        canvas = cv2.resize(canvas, (max(1, int(w * ratio)), max(1, int(h * ratio))), interpolation=cv2.INTER_AREA)
+    ok, buffer = cv2.imencode(".jpg", canvas, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    if not ok:
+        raise ValueError(f"Failed to encode visualization for {data_path}")
+    return buffer.tobytes()
+
+
+class VisualizationCache:
+    """LRU of rendered visualizations, bounded by total JPEG bytes."""
+
+    def __init__(self, max_bytes=VIS_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_render(self, key, render):
+        with self._lock:
+            content = self._items.get(key)
+            if content is not None:
+                self._items.move_to_end(key)
+                return content
+
+        content = render()
+
+        with self._lock:
+            if key not in self._items:
+                self._items[key] = content
+                self.total_bytes += len(content)
+            while self.total_bytes > self.max_bytes and len(self._items) > 1:
+                _, evicted = self._items.popitem(last=False)
+                self.total_bytes -= len(evicted)
+        return content
+
+    def invalidate(self, file_id=None):
+        """Forget renders for one file (keys start with its file_id), or everything."""
+        with self._lock:
+            for key in list(self._items):
+                if file_id is None or key[0] == file_id:
+                    self.total_bytes -= len(self._items.pop(key))
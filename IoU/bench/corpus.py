@@ -0,0 +1,83 @@
+import json
+import random
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+
+def grid_cells(width, height, rows, cols, margin=0.05):
+    """Table cells as 4-point polygons covering the page in a rows x cols grid."""
+    x0, y0 = int(width * margin), int(height * margin)
+    cell_w = (width - 2 * x0) / float(cols)
+    cell_h = (height - 2 * y0) / float(rows)
+    cells = []
+    for r in range(rows):
+        for c in range(cols):
+            x1, y1 = int(x0 + c * cell_w), int(y0 + r * cell_h)
+            x2, y2 = int(x0 + (c + 1) * cell_w), int(y0 + (r + 1) * cell_h)
+            cells.append([[x1, y1], [x2, y1], [x2, y2], [x1, y2]])
+    return cells
+
+
+def grid_shape(m_cells):
+    cols = max(1, int(round(m_cells ** 0.5)))
+    rows = max(1, -(-m_cells // cols))
+    return rows, cols
+
+
+def synthetic_segments(width, height, n_segments, cells=None, seed=0):
+    """OCR segments in pixel coordinates; when cells are given most segments sit inside one."""
+    rng = random.Random(seed)
+    segments = []
+    for i in range(n_segments):
+        if cells and rng.random() < 0.8:
+            (cx1, cy1), _, (cx2, cy2), _ = rng.choice(cells)
+            w = max(2, int((cx2 - cx1) * rng.uniform(0.3, 0.9)))
+            h = max(2, int((cy2 - cy1) * rng.uniform(0.2, 0.5)))
+            x1 = cx1 + rng.randint(0, max(0, cx2 - cx1 - w))
+            y1 = cy1 + rng.randint(0, max(0, cy2 - cy1 - h))
+        else:
+            w, h = rng.randint(20, max(21, width // 5)), rng.randint(8, max(9, height // 40))
+            x1, y1 = rng.randint(0, max(0, width - w)), rng.randint(0, max(0, height - h))
+        x2, y2 = x1 + w, y1 + h
+        segments.append({"text": f"seg{i}", "box": [[x1, y1], [x2, y1], [x2, y2], [x1, y2]]})
+    return segments
+
+
+def normalized_bboxes(n_segments, seed=0):
+    """[x1, y1, x2, y2] boxes in HunyuanOCR's 0-1000 coordinate space."""
+    rng = random.Random(seed)
+    boxes = []
+    for _ in range(n_segments):
+        x1, y1 = rng.randint(0, 900), rng.randint(0, 980)
+        boxes.append([x1, y1, x1 + rng.randint(10, 99), y1 + rng.randint(5, 19)])
+    return boxes
+
+
+def ocr_response_text(n_segments, fmt="json", seed=0):
+    """Model output text in either format parse_ocr_result understands."""
+    boxes = normalized_bboxes(n_segments, seed)
+    if fmt == "json":
+        items = [{"text": f"文本{i}", "bbox": box} for i, box in enumerate(boxes)]
+        return "```json\n" + json.dumps(items, ensure_ascii=False) + "\n```"
+    return "".join(f"文本{i}({x1},{y1}),({x2},{y2})" for i, (x1, y1, x2, y2) in enumerate(boxes))
+
+
+def make_page(width=1654, height=2339, m_cells=0, seed=0):
+    """A white page with a drawn table grid (and some noise so pages hash differently)."""
+    img = Image.new("RGB", (width, height), (255, 255, 255))
+    draw = ImageDraw.Draw(img)
+    if m_cells:
+        for (x1, y1), _, (x2, y2), _ in grid_cells(width, height, *grid_shape(m_cells)):
+            draw.rectangle([x1, y1, x2, y2], outline=(0, 0, 0), width=2)
+    rng = np.random.default_rng(seed)
+    for _ in range(50):
+        x, y = int(rng.integers(0, width - 40)), int(rng.integers(0, height - 10))
+        draw.rectangle([x, y, x + 30, y + 6], fill=(40, 40, 40))
+    return img
+
+
+def make_pdf(path, n_pages, width=1654, height=2339, m_cells=40, dpi=200):
+    pages = [make_page(width, height, m_cells, seed=i) for i in range(n_pages)]
+    pages[0].save(path, "PDF", resolution=dpi, save_all=True, append_images=pages[1:])
+    return path
@@ -0,0 +1,122 @@
+import asyncio
+import json
+import socket
+import threading
+import time
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+
+from corpus import grid_cells, grid_shape, ocr_response_text
+
+
+def create_fake_hunyuan_app(latency=0.5, per_segment_latency=0.0, n_segments=100, fmt="json"):
+    """OpenAI-compatible /v1/chat/completions that answers like HunyuanOCR.
+
+    Each response waits `latency + n_segments * per_segment_latency` seconds (simulating
+    generation) and returns `n_segments` boxes in the requested output format. Requests
+    with stream=true get the same text as server-sent events, spread over that time.
+    """
+    app = FastAPI()
+    app.state.requests = 0
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        app.state.requests += 1
+        content = ocr_response_text(n_segments, fmt, seed=app.state.requests)
+        completion_tokens = len(content) // 2
+        if body.get("stream"):
+            return StreamingResponse(_stream_chunks(body, app.state.requests, content, completion_tokens),
+                                     media_type="text/event-stream")
+        await asyncio.sleep(latency + n_segments * per_segment_latency)
+        return {
+            "id": f"chatcmpl-fake-{app.state.requests}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "tencent/HunyuanOCR"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop"
+            }],
+            "usage": {"prompt_tokens": 1000, "completion_tokens": completion_tokens,
+                      "total_tokens": 1000 + completion_tokens}
+        }
+
+    async def _stream_chunks(body, request_id, content, completion_tokens, chunk_chars=16):
+        base = {"id": f"chatcmpl-fake-{request_id}", "object": "chat.completion.chunk",
+                "created": int(time.time()), "model": body.get("model", "tencent/HunyuanOCR")}
+        pieces = [content[i:i + chunk_chars] for i in range(0, len(content), chunk_chars)]
+        delay = (latency + n_segments * per_segment_latency) / max(1, len(pieces))
+        for i, piece in enumerate(pieces):
+            await asyncio.sleep(delay)
+            choice = {"index": 0, "delta": {"content": piece},
+                      "finish_reason": "stop" if i == len(pieces) - 1 else None}
+            yield f"data: {json.dumps({**base, 'choices': [choice]})}\n\n"
+        if (body.get("stream_options") or {}).get("include_usage"):
+            usage = {"prompt_tokens": 1000, "completion_tokens": completion_tokens,
+                     "total_tokens": 1000 + completion_tokens}
+            yield f"data: {json.dumps({**base, 'choices': [], 'usage': usage})}\n\n"
+        yield "data: [DONE]\n\n"
+
+    return app
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class FakeHunyuanServer:
+    """Runs the fake app with uvicorn on a background thread; use as a context manager."""
+
+    def __init__(self, **app_kwargs):
+        self.app = create_fake_hunyuan_app(**app_kwargs)
+        self.port = _free_port()
+        self.base_url = f"http://127.0.0.1:{self.port}/v1"
+        config = uvicorn.Config(self.app, host="127.0.0.1", port=self.port, log_level="warning")
+        self.server = uvicorn.Server(config)
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+
+    @property
+    def requests(self):
+        return self.app.state.requests
+
+    def __enter__(self):
+        self.thread.start()
+        while not self.server.started:
+            time.sleep(0.01)
+        return self
+
+    def __exit__(self, *exc):
+        self.server.should_exit = True
+        self.thread.join(timeout=5)
+
+
+class SyntheticTablePipeline:
+    """Stand-in for the LORE / Cycle-CenterNet ModelScope pipelines.
+
+    Returns a grid of `m_cells` cells over the input image after `latency` seconds,
+    in the same {"polygons": [[x1, y1, ..., x4, y4], ...]} shape as the real models.
+    """
+
+    def __init__(self, m_cells=100, latency=0.2):
+        self.m_cells = m_cells
+        self.latency = latency
+        self.calls = 0
+
+    def _single(self, img):
+        self.calls += 1
+        time.sleep(self.latency)
+        width, height = img.size
+        polygons = [[v for point in cell for v in point]
+                    for cell in grid_cells(width, height, *grid_shape(self.m_cells))]
+        return {"polygons": polygons[:self.m_cells]}
+
+    def __call__(self, inputs, batch_size=None):
+        if isinstance(inputs, list):
+            return [self._single(img) for img in inputs]
+        return self._single(inputs)
@@ -0,0 +1,239 @@
+"""Offline benchmark for the OCR pipeline.
+
+Runs without a GPU or a live vLLM server: HunyuanOCR is replaced by a local fake
+OpenAI-compatible server and the table models by synthetic cell grids. Writes a JSON
+report that can be compared against an earlier run:
+
+    python bench/run_bench.py --output bench_report.json
+    python bench/run_bench.py --output new.json --compare bench_report.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(BENCH_DIR), "backend"))
+
+from corpus import grid_cells, grid_shape, make_page, make_pdf, ocr_response_text, synthetic_segments
+from fake_backends import FakeHunyuanServer, SyntheticTablePipeline
+
+
+def summarize(samples):
+    ordered = sorted(samples)
+    return {
+        "n": len(ordered),
+        "mean_ms": statistics.mean(ordered) * 1000,
+        "p50_ms": ordered[len(ordered) // 2] * 1000,
+        "p95_ms": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000,
+        "min_ms": ordered[0] * 1000,
+        "max_ms": ordered[-1] * 1000,
+    }
+
+
+def time_calls(fn, repeat, warmup=1):
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def page_fixture(args):
+    cells = grid_cells(args.width, args.height, *grid_shape(args.cells))[:args.cells]
+    segments = synthetic_segments(args.width, args.height, args.segments, cells)
+    return cells, segments
+
+
+def bench_parse(args):
+    import ocr_service
+    report = {}
+    for fmt in ("json", "coords"):
+        text = ocr_response_text(args.segments, fmt)
+        samples = time_calls(lambda: ocr_service.parse_ocr_result(text, (args.width, args.height)), args.repeat)
+        report[f"parse_ocr_result[{fmt}]"] = summarize(samples)
+    return report
+
+
+def bench_merge(args):
+    import ocr_service
+    cells, segments = page_fixture(args)
+    samples = time_calls(lambda: ocr_service.merge_results(segments, cells, 0.8), args.repeat)
+    return {"merge_results": summarize(samples)}
+
+
+def bench_visualize(args, tmpdir):
+    import ocr_service
+    from page_image import PageImage
+    cells, segments = page_fixture(args)
+    merged = ocr_service.merge_results(segments, cells, 0.8)
+    page = PageImage.from_pil(make_page(args.width, args.height, args.cells))
+    out_path = os.path.join(tmpdir, "vis.jpg")
+    samples = time_calls(lambda: ocr_service.visualize_results(page, merged, out_path, cells), args.repeat)
+    return {"visualize_results": summarize(samples)}
+
+
+def bench_rasterize(args, tmpdir):
+    from rasterizer import iter_pdf_pages
+    pdf_path = make_pdf(os.path.join(tmpdir, "raster.pdf"), args.pdf_pages, args.width, args.height, args.cells)
+    try:
+        start = time.perf_counter()
+        samples = []
+        last = start
+        for _, img in iter_pdf_pages(pdf_path):
+            img.close()
+            now = time.perf_counter()
+            samples.append(now - last)
+            last = now
+        total = time.perf_counter() - start
+    except Exception as e:
+        return {"pdf_rasterization": {"skipped": f"{type(e).__name__}: {e}"}}
+    if not samples:
+        return {"pdf_rasterization": {"skipped": "no pages rendered"}}
+    result = summarize(samples)
+    result["pages_per_sec"] = len(samples) / total if total else None
+    result["time_to_first_page_ms"] = samples[0] * 1000 if samples else None
+    return {"pdf_rasterization": result}
+
+
+def bench_end_to_end(args, tmpdir):
+    import ocr_service
+    from ocr_client import HunyuanOCRClient
+    from result_cache import ResultCache
+
+    stub = SyntheticTablePipeline(args.cells, args.table_latency)
+    ocr_service.TABLE_WORKER_PROCESSES = 0
+    ocr_service._lore_pipeline = stub
+    ocr_service._wired_pipeline = stub
+    # A fresh cache so every page really goes through both stages
+    ocr_service.result_cache = ResultCache(os.path.join(tmpdir, "cache"))
+
+    # Creates its uploads/results/work directories and job database under IOU_DATA_DIR,
+    # which main() pointed at `tmpdir`
+    import main
+    upload_dir = main.UPLOAD_DIR
+
+    async def quiet_broadcast(message):
+        pass
+    main.manager.broadcast = quiet_broadcast
+
+    # One multi-page PDF when poppler is available, otherwise one image per page
+    documents = []
+    try:
+        pdf_path = make_pdf(os.path.join(upload_dir, "bench_doc.pdf"), args.e2e_pages, args.width, args.height, args.cells)
+        from rasterizer import count_pdf_pages
+        if count_pdf_pages(pdf_path) != args.e2e_pages:
+            raise RuntimeError("PDF rasterization unavailable")
+        documents.append((pdf_path, "bench_doc.pdf", "bench_doc"))
+        source = "pdf"
+    except Exception:
+        for i in range(args.e2e_pages):
+            path = os.path.join(upload_dir, f"bench_page_{i}.png")
+            make_page(args.width, args.height, args.cells, seed=i).save(path)
+            documents.append((path, f"bench_page_{i}.png", f"bench_page_{i}"))
+        source = "images"
+
+    with FakeHunyuanServer(latency=args.ocr_latency, n_segments=args.segments) as server:
+        ocr_service.client = HunyuanOCRClient([server.base_url], max_retries=0)
+
+        async def run_all():
+            return await asyncio.gather(*[
+                main.process_file_async(path, name, file_id, args.mode, "bench", 0.8)
+                for path, name, file_id in documents
+            ])
+
+        start = time.perf_counter()
+        statuses = asyncio.run(run_all())
+        elapsed = time.perf_counter() - start
+        ocr_requests = server.requests
+
+    return {"end_to_end": {
+        "source": source,
+        "mode": args.mode,
+        "pages": args.e2e_pages,
+        "statuses": statuses,
+        "elapsed_s": elapsed,
+        "pages_per_sec": args.e2e_pages / elapsed if elapsed else None,
+        "ocr_requests": ocr_requests,
+        "table_calls": stub.calls,
+    }}
+
+
+def compare(report, baseline):
+    """Print current vs baseline for every timing / throughput metric."""
+    print(f"{'metric':45s} {'baseline':>12s} {'current':>12s} {'change':>8s}")
+    for name, current in report["results"].items():
+        old = baseline.get("results", {}).get(name)
+        if not old:
+            continue
+        for key in ("mean_ms", "p95_ms", "pages_per_sec"):
+            if current.get(key) is None or old.get(key) is None:
+                continue
+            change = (current[key] - old[key]) / old[key] * 100 if old[key] else 0.0
+            print(f"{name + '.' + key:45s} {old[key]:12.2f} {current[key]:12.2f} {change:+7.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", default="bench_report.json", help="where to write the JSON report")
+    parser.add_argument("--compare", help="earlier report to compare against")
+    parser.add_argument("--segments", type=int, default=300, help="OCR segments per page")
+    parser.add_argument("--cells", type=int, default=400, help="table cells per page")
+    parser.add_argument("--width", type=int, default=1654)
+    parser.add_argument("--height", type=int, default=2339)
+    parser.add_argument("--repeat", type=int, default=20, help="iterations per micro-benchmark")
+    parser.add_argument("--pdf-pages", type=int, default=10, help="pages for the rasterization benchmark")
+    parser.add_argument("--e2e-pages", type=int, default=20, help="pages for the end-to-end benchmark")
+    parser.add_argument("--mode", default="Table", choices=["Table", "NoTable", "Auto", "Hunyuanocr"])
+    parser.add_argument("--ocr-latency", type=float, default=0.5, help="fake HunyuanOCR latency per page (s)")
+    parser.add_argument("--table-latency", type=float, default=0.2, help="stub table model latency per page (s)")
+    parser.add_argument("--only", nargs="*", choices=["parse", "merge", "visualize", "rasterize", "e2e"],
+                        help="run a subset of the benchmarks")
+    args = parser.parse_args()
+
+    selected = set(args.only or ["parse", "merge", "visualize", "rasterize", "e2e"])
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="iou_bench_") as tmpdir:
+        # Before the backend modules are imported, so nothing is written into the checkout
+        os.environ["IOU_DATA_DIR"] = tmpdir
+        if "parse" in selected:
+            results.update(bench_parse(args))
+        if "merge" in selected:
+            results.update(bench_merge(args))
+        if "visualize" in selected:
+            results.update(bench_visualize(args, tmpdir))
+        if "rasterize" in selected:
+            results.update(bench_rasterize(args, tmpdir))
+        if "e2e" in selected:
+            results.update(bench_end_to_end(args, tmpdir))
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "config": vars(args),
+        },
+        "results": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+    print(f"Report written to {args.output}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            compare(report, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
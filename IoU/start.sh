@@ -34,11 +34,11 @@ conda activate "$CONDA_ENV"
 # 3. Check Dependencies
 echo "[*] Checking Dependencies..."
 # Simple check for python packages
-if python -c "import fastapi, uvicorn, pdf2image" &> /dev/null; then
+if python -c "import fastapi, uvicorn, pdf2image, unoserver" &> /dev/null; then
     echo "    -> Core Python packages found."
 else
     echo "    -> Installing missing packages..."
-    pip install fastapi uvicorn python-multipart jinja2 aiofiles docx2pdf pdf2image opencv-python-headless pillow shapely modelscope
+    pip install fastapi uvicorn python-multipart jinja2 aiofiles docx2pdf pdf2image opencv-python-headless pillow shapely modelscope openai httpx unoserver
 fi
 
 # 4. Check System Dependencies (LibreOffice for Word)
@@ -49,6 +49,14 @@ else
     echo "    -> Warning: LibreOffice not found. Word (.doc/.docx) files may fail to convert."
     # Optionally try to install or just warn
 fi
+# Word conversions go to long-running LibreOffice listeners started through unoserver,
+# which needs LibreOffice's Python UNO bindings (e.g. the python3-uno package)
+if command -v unoserver &> /dev/null && command -v unoconvert &> /dev/null && python -c "import uno" &> /dev/null; then
+    echo "    -> unoserver found (LibreOffice listeners enabled)."
+else
+    echo "    -> Warning: unoserver/unoconvert or the uno module not available. Every Word file"
+    echo "       will start its own LibreOffice (slow). Install python3-uno and 'pip install unoserver'."
+fi
 
 # 5. Start Service
 echo "[*] Starting FastAPI Server..."
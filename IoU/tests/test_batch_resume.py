@@ -0,0 +1,97 @@
+import json
+import os
+
+import pytest
+from PIL import Image
+
+import batch
+from batch import BatchRunner, Checkpoint, find_inputs
+
+SETTINGS = {"mode": "Hunyuanocr", "prompt": "p", "iou_threshold": 0.8}
+PAGES = 5
+
+
+@pytest.fixture
+def fake_pipeline(monkeypatch):
+    """A 5-page "PDF" and a process_image that records its pages; pages in `fail` raise."""
+    state = {"calls": [], "fail": set()}
+
+    def render(path, first, last, dpi):
+        return [Image.new("RGB", (20, 20), "white") for _ in range(first, last + 1)]
+
+    def process_image(page, mode, prompt, iou_threshold, vis_path):
+        page_num = int(page.name.rsplit(" ", 1)[1])
+        state["calls"].append(page_num)
+        if page_num in state["fail"]:
+            raise RuntimeError(f"page {page_num} failed")
+        return [{"text": f"p{page_num}", "box": [[0, 0], [1, 0], [1, 1], [0, 1]]}]
+
+    monkeypatch.setattr(batch, "count_pdf_pages", lambda path: PAGES)
+    monkeypatch.setattr(batch, "render_pdf_window", render)
+    monkeypatch.setattr(batch.ocr_service, "process_image", process_image)
+    return state
+
+
+def _run(source, output, restart=False):
+    os.makedirs(output, exist_ok=True)
+    checkpoint = Checkpoint(os.path.join(output, batch.CHECKPOINT_NAME), SETTINGS, restart=restart)
+    runner = BatchRunner(output, checkpoint, "Hunyuanocr", "p", 0.8, pages_in_flight=2, window=2)
+    try:
+        runner.run(find_inputs(source, exclude=output))
+    finally:
+        checkpoint.close()
+    return runner.stats
+
+
+def test_resume_only_runs_missing_pages(tmp_path, fake_pipeline):
+    source, output = tmp_path / "in", tmp_path / "out"
+    (source / "sub").mkdir(parents=True)
+    (source / "sub" / "doc.pdf").write_bytes(b"%PDF")
+    fake_pipeline["fail"] = {3}
+
+    stats = _run(str(source), str(output))
+    assert stats["documents_failed"] == 1 and stats["pages_processed"] == PAGES - 1
+    assert not (output / "sub" / "doc.pdf.json").exists()
+
+    # A page that reached the partial file but not the checkpoint, and a torn checkpoint line
+    with open(output / "sub" / "doc.pdf.partial.ndjson", "a", encoding="utf-8") as f:
+        f.write(json.dumps({"page": 3, "results": [{"text": "stale", "box": []}]}) + "\n")
+    with open(output / batch.CHECKPOINT_NAME, "a", encoding="utf-8") as f:
+        f.write('{"input": "sub/doc.pdf", "pa')
+
+    fake_pipeline["fail"] = set()
+    fake_pipeline["calls"] = []
+    stats = _run(str(source), str(output))
+    assert fake_pipeline["calls"] == [3]
+    assert stats["pages_resumed"] == PAGES - 1 and stats["documents_done"] == 1
+    with open(output / "sub" / "doc.pdf.json", encoding="utf-8") as f:
+        pages = json.load(f)
+    assert [p["page"] for p in pages] == list(range(1, PAGES + 1))
+    assert [p["results"][0]["text"] for p in pages] == [f"p{n}" for n in range(1, PAGES + 1)]
+    assert not (output / "sub" / "doc.pdf.partial.ndjson").exists()
+
+    # Finished documents are skipped
+    fake_pipeline["calls"] = []
+    stats = _run(str(source), str(output))
+    assert fake_pipeline["calls"] == [] and stats["documents_skipped"] == 1
+
+    # --restart starts over
+    stats = _run(str(source), str(output), restart=True)
+    assert sorted(fake_pipeline["calls"]) == list(range(1, PAGES + 1)) and stats["documents_done"] == 1
+
+
+def test_checkpoint_rejects_other_settings(tmp_path):
+    path = str(tmp_path / batch.CHECKPOINT_NAME)
+    Checkpoint(path, SETTINGS).close()
+    with pytest.raises(ValueError):
+        Checkpoint(path, {**SETTINGS, "mode": "Table"})
+
+
+def test_find_inputs_manifest_and_output_exclusion(tmp_path):
+    (tmp_path / "a.pdf").write_bytes(b"")
+    (tmp_path / "out").mkdir()
+    (tmp_path / "out" / "old.png").write_bytes(b"")
+    assert find_inputs(str(tmp_path), exclude=str(tmp_path / "out")) == [("a.pdf", str(tmp_path / "a.pdf"))]
+    manifest = tmp_path / "list.txt"
+    manifest.write_text("# inputs\n\na.pdf\na.pdf\n" + str(tmp_path / "out" / "old.png") + "\n")
+    assert [key for key, _ in find_inputs(str(manifest))] == ["a.pdf", "out/old.png"]
@@ -0,0 +1,134 @@
+import asyncio
+import os
+import socket
+import stat
+import sys
+import textwrap
+
+import pytest
+
+from doc_converter import ConversionService, LibreOfficeConverter
+
+# Stand-ins for unoserver (listens on --port, logs each start) and unoconvert (writes the PDF)
+FAKE_SERVER = """
+    import socket, sys
+    args = sys.argv[1:]
+    port = int(args[args.index("--port") + 1])
+    with open(__file__ + ".starts", "a") as log:
+        log.write(args[args.index("--user-installation") + 1] + "\\n")
+    server = socket.socket()
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server.bind(("127.0.0.1", port))
+    server.listen()
+    while True:
+        server.accept()[0].close()
+"""
+FAKE_CLIENT = """
+    import sys
+    with open(sys.argv[-1], "wb") as f:
+        f.write(b"%PDF-1.4 " + sys.argv[sys.argv.index("--port") + 1].encode())
+"""
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture
+def fake_unoserver(tmp_path, monkeypatch):
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    for name, source in (("unoserver", FAKE_SERVER), ("unoconvert", FAKE_CLIENT)):
+        path = bin_dir / name
+        path.write_text(f"#!{sys.executable}\n" + textwrap.dedent(source))
+        path.chmod(path.stat().st_mode | stat.S_IEXEC)
+    monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+    return bin_dir / "unoserver.starts"
+
+
+def _starts(log):
+    return log.read_text().splitlines() if log.exists() else []
+
+
+def test_listener_started_once_and_reused(tmp_path, fake_unoserver):
+    src = tmp_path / "report.docx"
+    src.write_bytes(b"docx")
+    port = _free_port()
+
+    async def run():
+        converter = LibreOfficeConverter(str(tmp_path / "profile"), port=port)
+        assert converter.listening
+        out_dir = tmp_path / "out"
+        out_dir.mkdir()
+        try:
+            first = await converter.convert(str(src), str(out_dir))
+            second = await converter.convert(str(src), str(out_dir))
+            # A listener that went away is started again
+            converter._server.kill()
+            await converter._server.wait()
+            third = await converter.convert(str(src), str(out_dir))
+        finally:
+            await converter.aclose()
+        return first, second, third
+
+    first, second, third = asyncio.run(run())
+    assert first == second == third == str(tmp_path / "out" / "report.pdf")
+    assert open(first, "rb").read() == b"%PDF-1.4 " + str(port).encode()
+    assert _starts(fake_unoserver) == [str(tmp_path / "profile")] * 2
+
+
+def test_service_workers_have_own_listeners(tmp_path, fake_unoserver, monkeypatch):
+    import doc_converter
+    base = _free_port()
+    monkeypatch.setattr(doc_converter, "DOC_CONVERT_PORT", base)
+    docs = []
+    for i in range(4):
+        docs.append(tmp_path / f"doc{i}.docx")
+        docs[-1].write_bytes(b"docx")
+
+    async def run():
+        service = ConversionService(str(tmp_path / "work"), workers=2)
+        assert [w.port for w in service.workers] == [base, base + 2]
+        try:
+            await service.start()
+            return await asyncio.gather(*(service.convert(str(d), str(tmp_path / f"{d.stem}.pdf"), job_id=d.stem)
+                                          for d in docs))
+        finally:
+            await service.aclose()
+
+    outputs = asyncio.run(run())
+    assert all(os.path.exists(p) for p in outputs)
+    profiles = sorted(_starts(fake_unoserver))
+    assert profiles == [str(tmp_path / "work" / "profile_0"), str(tmp_path / "work" / "profile_1")]
+
+
+def test_warns_when_falling_back_to_one_shot(tmp_path, monkeypatch, capsys):
+    monkeypatch.setenv("PATH", str(tmp_path))
+    service = ConversionService(str(tmp_path / "work"), workers=1)
+    assert not service.workers[0].listening
+    asyncio.run(service.start())
+    assert "unoserver/unoconvert not found" in capsys.readouterr().out
+
+
+def test_listener_that_does_not_start_falls_back_to_one_shot(tmp_path, fake_unoserver):
+    # unoserver present but broken (e.g. no uno module), so LibreOffice converts directly
+    (fake_unoserver.parent / "unoserver").write_text(f"#!{sys.executable}\nimport sys\nsys.exit(1)\n")
+    soffice = tmp_path / "soffice"
+    soffice.write_text(f"#!{sys.executable}\n" + textwrap.dedent("""
+        import os, sys
+        args = sys.argv[1:]
+        out_dir, src = args[args.index("--outdir") + 1], args[-1]
+        name = os.path.splitext(os.path.basename(src))[0] + ".pdf"
+        open(os.path.join(out_dir, name), "wb").write(b"%PDF one-shot")
+    """))
+    soffice.chmod(soffice.stat().st_mode | stat.S_IEXEC)
+    src = tmp_path / "report.docx"
+    src.write_bytes(b"docx")
+
+    async def run():
+        converter = LibreOfficeConverter(str(tmp_path / "profile"), port=_free_port(), binary=str(soffice))
+        return await converter.convert(str(src), str(tmp_path))
+
+    assert open(asyncio.run(run()), "rb").read() == b"%PDF one-shot"
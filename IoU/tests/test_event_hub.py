@@ -0,0 +1,148 @@
+import asyncio
+import json
+
+import pytest
+
+import event_hub
+from event_hub import CLOSE_TOO_SLOW, EventHub
+
+
+class FakeWebSocket:
+    def __init__(self, send_delay=0.0):
+        self.send_delay = send_delay
+        self.sent = []
+        self.closed_with = None
+        self.inbox = asyncio.Queue()
+        self.close_calls = 0
+
+    async def accept(self):
+        pass
+
+    async def receive_text(self):
+        text = await self.inbox.get()
+        if text is None:
+            raise RuntimeError("disconnected")
+        return text
+
+    async def send_json(self, message):
+        await asyncio.sleep(self.send_delay)
+        self.sent.append(message)
+
+    async def close(self, code=1000):
+        self.close_calls += 1
+        self.closed_with = code
+        self.inbox.put_nowait(None)
+
+    def request(self, **request):
+        self.inbox.put_nowait(json.dumps(request))
+
+
+async def connect(hub, ws, **subscribe):
+    task = asyncio.create_task(hub.serve(ws))
+    if subscribe:
+        ws.request(action="subscribe", **subscribe)
+    await asyncio.sleep(0.01)
+    return task
+
+
+async def disconnect(ws, task):
+    ws.inbox.put_nowait(None)
+    await task
+
+
+def log(file_id, n):
+    return {"type": "log", "file_id": file_id, "message": n}
+
+
+def test_subscriptions_filter_and_do_not_duplicate():
+    async def run():
+        hub = EventHub()
+        ws = FakeWebSocket()
+        task = await connect(hub, ws, file_ids=["a", "*"])
+        await hub.broadcast(log("a", 1))
+        await hub.broadcast(log("b", 2))
+        ws.request(action="unsubscribe", file_ids=["*"])
+        await asyncio.sleep(0.01)
+        await hub.broadcast(log("b", 3))
+        await hub.broadcast(log("a", 4))
+        await asyncio.sleep(0.01)
+        await disconnect(ws, task)
+        return ws.sent, hub
+
+    sent, hub = asyncio.run(run())
+    assert [(m["file_id"], m["message"]) for m in sent] == [("a", 1), ("b", 2), ("a", 4)]
+    assert hub.client_count == 0
+
+
+def test_progress_coalesced_and_replayed_after_reconnect(monkeypatch):
+    monkeypatch.setattr(event_hub, "PROGRESS_INTERVAL", 0.05)
+
+    async def run():
+        hub = EventHub()
+        ws = FakeWebSocket()
+        task = await connect(hub, ws, file_ids=["a"])
+        for page in range(1, 6):
+            await hub.broadcast({"type": "progress", "file_id": "a", "current": page, "total": 5, "page": page})
+        await hub.broadcast({"type": "complete", "file_id": "a", "result": {}})
+        await asyncio.sleep(0.01)
+        await disconnect(ws, task)
+
+        again = FakeWebSocket()
+        task = await connect(hub, again, file_ids=["a"], since={"a": 1})
+        await disconnect(again, task)
+        return ws.sent, again.sent
+
+    live, replayed = asyncio.run(run())
+    assert [(m["type"], m.get("current"), m.get("pages_done")) for m in live] == [
+        ("progress", 1, [1]), ("progress", 5, [2, 3, 4, 5]), ("complete", None, None)]
+    assert [m["seq"] for m in live] == [1, 2, 3]
+    # History keeps one progress entry covering all pages
+    assert [(m["type"], m["seq"], m.get("pages_done")) for m in replayed] == [
+        ("progress", 2, [1, 2, 3, 4, 5]), ("complete", 3, None)]
+
+
+def test_slow_client_dropped_once(monkeypatch):
+    monkeypatch.setattr(event_hub, "CLIENT_QUEUE_SIZE", 3)
+
+    async def run():
+        hub = EventHub()
+        fast, slow = FakeWebSocket(), FakeWebSocket(send_delay=10)
+        tasks = [await connect(hub, ws, file_ids=["*"]) for ws in (fast, slow)]
+        for i in range(10):
+            await hub.broadcast(log("a", i))
+            await asyncio.sleep(0.001)
+        await asyncio.sleep(0.05)
+        await disconnect(fast, tasks[0])
+        await tasks[1]
+        return fast, slow, hub
+
+    fast, slow, hub = asyncio.run(run())
+    assert [m["message"] for m in fast.sent] == list(range(10))
+    assert slow.closed_with == CLOSE_TOO_SLOW and slow.close_calls == 1
+    assert hub.client_count == 0
+
+
+def test_idle_channels_expire(monkeypatch):
+    monkeypatch.setattr(event_hub, "EVENT_HISTORY_TTL", 0.05)
+
+    async def run():
+        hub = EventHub()
+        ws = FakeWebSocket()
+        task = await connect(hub, ws, file_ids=["unknown", "watched"])
+        await hub.broadcast(log("done", 1))
+        await asyncio.sleep(0.03)
+        await hub.broadcast(log("watched", 2))
+        await asyncio.sleep(0.04)
+        mid = set(hub._channels)
+        await asyncio.sleep(0.05)
+        expired_but_watched = set(hub._channels), len(hub._channels["watched"].history)
+        ws.request(action="unsubscribe", file_ids=["watched", "unknown"])
+        await asyncio.sleep(0.01)
+        await disconnect(ws, task)
+        return mid, expired_but_watched, set(hub._channels)
+
+    mid, expired_but_watched, end = asyncio.run(run())
+    # "done" and "unknown" are idle past the TTL; "watched" had an event since
+    assert mid == {"unknown", "watched"}
+    assert expired_but_watched == ({"unknown", "watched"}, 0)
+    assert end == set()
@@ -0,0 +1,83 @@
+import asyncio
+
+from job_queue import CANCELLED, COMPLETED, JobScheduler, JobStore, QueueFullError
+
+
+def make_job(file_id, priority=0):
+    return {"file_id": file_id, "filename": f"{file_id}.pdf", "file_path": f"/tmp/{file_id}.pdf",
+            "mode": "Table", "prompt": "p", "iou_threshold": 0.8, "priority": priority}
+
+
+def test_priority_order_and_positions(tmp_path):
+    async def run():
+        store = JobStore(str(tmp_path / "jobs.sqlite3"))
+        order = []
+
+        async def run_job(job, cancel_event):
+            order.append(job["file_id"])
+            return COMPLETED
+
+        scheduler = JobScheduler(store, run_job, workers=1)
+        for file_id, priority in [("low1", 0), ("low2", 0), ("high", 5), ("mid", 1)]:
+            await scheduler.submit(make_job(file_id, priority))
+        positions = {f: scheduler.position(f) for f in ("high", "mid", "low1", "low2")}
+        scheduler.cancel("mid")
+        after_cancel = scheduler.position("low1")
+        await scheduler.start()
+        await scheduler._queue.join()
+        await scheduler.stop()
+        return positions, after_cancel, order, store
+
+    positions, after_cancel, order, store = asyncio.run(run())
+    assert positions == {"high": 1, "mid": 2, "low1": 3, "low2": 4}
+    assert after_cancel == 2
+    assert order == ["high", "low1", "low2"]
+    assert store.get("mid")["status"] == CANCELLED
+    assert store.get("low2")["status"] == COMPLETED
+
+
+def test_cancel_frees_slot_and_queue_full(tmp_path):
+    async def run():
+        scheduler = JobScheduler(JobStore(str(tmp_path / "jobs.sqlite3")), None, workers=0, max_queued=2)
+        await scheduler.submit(make_job("a"))
+        await scheduler.submit(make_job("b"))
+        try:
+            await scheduler.submit(make_job("c"))
+            full = False
+        except QueueFullError:
+            full = True
+        waiter = asyncio.create_task(scheduler.submit(make_job("c"), timeout=1))
+        await asyncio.sleep(0)
+        scheduler.cancel("a")
+        await waiter
+        return full, scheduler.depth, scheduler.position("c"), scheduler.position("a")
+
+    full, depth, position_c, position_a = asyncio.run(run())
+    assert full
+    assert depth == 2
+    assert position_c == 2 and position_a is None
+
+
+def test_cancel_running_job_sets_its_event(tmp_path):
+    async def run():
+        started = asyncio.Event()
+
+        async def run_job(job, cancel_event):
+            started.set()
+            await cancel_event.wait()
+            return CANCELLED
+
+        store = JobStore(str(tmp_path / "jobs.sqlite3"))
+        scheduler = JobScheduler(store, run_job, workers=1)
+        await scheduler.start()
+        await scheduler.submit(make_job("a"))
+        await started.wait()
+        assert scheduler.running == 1 and scheduler.position("a") is None
+        assert scheduler.cancel("a")
+        await scheduler._queue.join()
+        await scheduler.stop()
+        return store.get("a")["status"], scheduler.cancel("a")
+
+    status, cancel_again = asyncio.run(run())
+    assert status == CANCELLED
+    assert not cancel_again
@@ -0,0 +1,86 @@
+import random
+
+import pytest
+
+from ocr_service import CellIndex, calculate_iou, match_cells, merge_results, remerge
+
+
+def brute_force_match(ocr_results, table_cells):
+    """The original O(n*m) scan merge_results used before the cell index."""
+    matches = []
+    for text_item in ocr_results:
+        best_iou = 0
+        best_cell_idx = -1
+        for j, cell_box in enumerate(table_cells):
+            iou = calculate_iou(text_item["box"], cell_box)
+            if iou > best_iou:
+                best_iou = iou
+                best_cell_idx = j
+        matches.append((best_iou, best_cell_idx))
+    return matches
+
+
+def rect(x0, y0, x1, y1):
+    return [[x0, y0], [x1, y0], [x1, y1], [x0, y1]]
+
+
+def random_box(rng, size):
+    # A coarse grid, so boxes often share edges, coincide, or tie on overlap
+    x0, y0 = rng.randrange(0, size, 5), rng.randrange(0, size, 5)
+    return rect(x0, y0, x0 + rng.randrange(0, 60, 5), y0 + rng.randrange(0, 40, 5))
+
+
+DEGENERATE = [
+    rect(10, 10, 10, 10),                    # a point
+    rect(10, 10, 50, 10),                    # a horizontal line
+    rect(30, 0, 30, 80),                     # a vertical line
+    [[0, 0], [40, 40], [40, 0], [0, 40]],    # bowtie, invalid until repaired
+    [[0, 0], [20, 0], [20, 20], [20, 0], [0, 20]],  # spike, invalid
+    [[0, 0], [10, 0]],                       # too few points to be a polygon
+    [],
+]
+
+
+def _segments(boxes):
+    return [{"text": f"t{i}", "box": box} for i, box in enumerate(boxes)]
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_index_matches_brute_force_on_random_boxes(seed):
+    rng = random.Random(seed)
+    cells = [random_box(rng, 200) for _ in range(rng.randrange(0, 40))]
+    segments = _segments([random_box(rng, 200) for _ in range(60)])
+    expected = brute_force_match(segments, cells)
+    assert match_cells(segments, cells) == expected
+    for threshold in (0.01, 0.3, 0.5, 0.8, 1.0):
+        assert merge_results(segments, cells, threshold) == merge_results(segments, cells, threshold, matches=expected)
+
+
+def test_index_matches_brute_force_on_degenerate_boxes():
+    cells = DEGENERATE + [rect(0, 0, 40, 40), rect(0, 0, 40, 40), rect(20, 0, 60, 40), rect(40, 0, 80, 40),
+                          rect(80, 0, 120, 40)]
+    segments = _segments(DEGENERATE + [
+        rect(10, 10, 30, 30),   # inside the bowtie, two identical cells and a third
+        rect(70, 0, 90, 40),    # half in each of two neighbours: a tie
+        rect(40, 40, 60, 60),   # only touches cells' edges
+        rect(100, 100, 120, 120),  # no cell at all
+    ])
+    expected = brute_force_match(segments, cells)
+    assert match_cells(segments, cells) == expected
+    # Ties go to the lowest cell index, as in the scan
+    assert expected[len(DEGENERATE) + 1] == (0.5, cells.index(rect(40, 0, 80, 40)))
+
+
+def test_no_cells_and_no_segments():
+    assert CellIndex([]).best_cell(rect(0, 0, 10, 10)) == (0, -1)
+    assert match_cells([], [rect(0, 0, 10, 10)]) == []
+    segments = _segments([rect(0, 0, 10, 10)])
+    assert merge_results(segments, [], 0.5) == [{**segments[0], "is_table_cell": False}]
+
+
+def test_remerge_equals_separate_merges():
+    rng = random.Random(7)
+    cells = [random_box(rng, 150) for _ in range(25)]
+    segments = _segments([random_box(rng, 150) for _ in range(40)])
+    thresholds = (0.2, 0.5, 0.9)
+    assert remerge(segments, cells, thresholds) == [merge_results(segments, cells, t) for t in thresholds]
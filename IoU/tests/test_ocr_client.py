@@ -0,0 +1,105 @@
+import asyncio
+
+import httpx
+import openai
+import pytest
+
+import ocr_client
+from ocr_client import CircuitBreaker, CircuitOpenError, Completion, HunyuanOCRClient
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(ocr_client.time, "monotonic", clock)
+    return clock
+
+
+def connection_error():
+    return openai.APIConnectionError(request=httpx.Request("POST", "http://ocr/v1/chat/completions"))
+
+
+def test_breaker_opens_after_threshold_and_recovers(clock):
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=10)
+    for _ in range(2):
+        breaker.record_failure()
+    assert breaker.state == "closed" and breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open" and not breaker.allow()
+
+    clock.now += 10
+    assert breaker.state == "half-open"
+    assert breaker.allow()
+    assert not breaker.allow()  # a single trial at a time
+
+    breaker.record_success()
+    assert breaker.state == "closed" and breaker.failures == 0
+
+
+def test_failed_trial_reopens(clock):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10)
+    breaker.record_failure()
+    clock.now += 10
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    clock.now += 9
+    assert not breaker.allow()
+    clock.now += 1
+    assert breaker.allow()
+
+
+def make_client(create, **kwargs):
+    client = HunyuanOCRClient(["http://a/v1", "http://b/v1"], backoff_base=0, **kwargs)
+    client._create = create
+    return client
+
+
+def test_retries_on_other_endpoint():
+    calls = []
+
+    async def create(endpoint, messages, timeout, on_delta, params):
+        calls.append(endpoint.base_url)
+        if len(calls) == 1:
+            raise connection_error()
+        return Completion("ok", "stop", 1, endpoint.base_url)
+
+    client = make_client(create)
+    completion = asyncio.run(client.complete([]))
+    assert completion.content == "ok"
+    assert len(set(calls)) == 2
+
+
+def test_all_circuits_open_raises(clock):
+    async def create(endpoint, messages, timeout, on_delta, params):
+        raise connection_error()
+
+    client = make_client(create, max_retries=5, failure_threshold=1)
+    with pytest.raises(CircuitOpenError):
+        asyncio.run(client.complete([]))
+
+
+@pytest.mark.parametrize("error", [asyncio.CancelledError, ValueError])
+def test_cancelled_or_final_trial_releases_slot(clock, error):
+    async def create(endpoint, messages, timeout, on_delta, params):
+        raise error()
+
+    client = make_client(create, max_retries=0)
+    client._ensure_endpoints()
+    for ep in client._endpoints:
+        ep.breaker.failures = ep.breaker.failure_threshold
+        ep.breaker.opened_at = clock.now - ep.breaker.reset_timeout
+    with pytest.raises(error):
+        asyncio.run(client.complete([]))
+    for ep in client._endpoints:
+        assert ep.breaker.state == "half-open"
+        assert not ep.breaker.trial_in_flight
+        assert ep.in_flight == 0
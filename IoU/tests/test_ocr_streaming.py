@@ -0,0 +1,73 @@
+import asyncio
+import json
+import random
+
+import pytest
+
+from ocr_service import StreamingOCRParser, parse_ocr_result
+from event_hub import EventHub
+
+IMAGE_SIZE = (1240, 1754)
+
+JSON_OUTPUT = json.dumps([
+    {"text": "发票号码", "bbox": [10, 20, 200, 40]},
+    {"text": "金额 {含税}", "bbox": [210, 20, 400, 40]},
+    {"text": "a \"quoted\" ] text", "bbox": [10, 60, 500, 80]},
+    {"text": "", "bbox": [600, 60, 700, 80]},
+    {"text": "no box", "bbox": [1, 2]},
+], ensure_ascii=False)
+
+OUTPUTS = [
+    JSON_OUTPUT,
+    "```json\n" + JSON_OUTPUT + "\n```",
+    json.dumps({"data": json.loads(JSON_OUTPUT)}, ensure_ascii=False),
+    "第一行(12,30),(400,60)第二行 (12,70),(380,100)\n合计(12,110),(200,140)",
+]
+
+
+def chunked(text, rng):
+    pos = 0
+    while pos < len(text):
+        size = rng.randint(1, 7)
+        yield text[pos:pos + size]
+        pos += size
+
+
+@pytest.mark.parametrize("output", OUTPUTS)
+@pytest.mark.parametrize("seed", range(5))
+def test_streamed_parse_matches_full_parse(output, seed):
+    parser = StreamingOCRParser(IMAGE_SIZE)
+    streamed = []
+    for chunk in chunked(output, random.Random(seed)):
+        streamed.extend(parser.feed(chunk))
+    expected = parse_ocr_result(output.strip(), IMAGE_SIZE)
+    assert streamed == expected
+    assert parser.finish() == expected
+
+
+def test_truncated_json_keeps_streamed_segments():
+    cut = JSON_OUTPUT[:JSON_OUTPUT.index('"a \\"quoted')]
+    parser = StreamingOCRParser(IMAGE_SIZE)
+    streamed = parser.feed(cut)
+    assert [s["text"] for s in streamed] == ["发票号码", "金额 {含税}"]
+    assert parser.finish() == streamed
+
+
+def test_replace_supersedes_pending_segments():
+    async def run():
+        hub = EventHub()
+        sent = []
+        hub._emit = lambda file_id, channel, message, keep=True: sent.append(message)
+
+        def publish(segments, replace=False):
+            hub.publish({"type": "segments", "file_id": "f", "page": 1, "segments": segments, "replace": replace})
+
+        publish(["a"])  # first one goes out at once
+        publish(["b"])
+        publish(["t1", "t2"], replace=True)
+        publish(["t3"])
+        hub._flush("f")
+        return sent
+
+    sent = asyncio.run(run())
+    assert [(m["segments"], m["replace"]) for m in sent] == [(["a"], False), (["t1", "t2", "t3"], True)]
@@ -0,0 +1,132 @@
+import asyncio
+
+import pytest
+from PIL import Image
+
+import ocr_service
+from ocr_client import Completion
+from ocr_service import _tile_segment, dedupe_tile_segments
+from page_image import PageImage
+
+
+def seg(text, x0, y0, x1, y1):
+    return {"text": text, "box": [[x0, y0], [x1, y0], [x1, y1], [x0, y1]]}
+
+
+def test_dedupe_keeps_one_copy_from_overlap():
+    # Same line seen by tile 0 (cut at its right edge) and tile 1 (whole)
+    a = (seg("Hello wor", 90, 10, 200, 30), True, 0)
+    b = (seg("Hello world", 92, 11, 230, 30), False, 1)
+    c = (seg("other", 10, 50, 60, 70), False, 0)
+    assert dedupe_tile_segments([a, b, c]) == [b[0], c[0]]
+
+
+def test_dedupe_keeps_repeats_within_a_tile_and_different_text():
+    a = (seg("total", 10, 10, 60, 30), False, 0)
+    b = (seg("total", 10, 10, 60, 30), False, 0)
+    c = (seg("amount", 12, 10, 60, 30), False, 1)
+    assert dedupe_tile_segments([a, b, c]) == [a[0], b[0], c[0]]
+
+
+def test_dedupe_degenerate_boxes():
+    a = (seg("x", 5, 5, 5, 5), False, 0)
+    b = (seg("x", 5, 5, 5, 5), False, 1)
+    c = (seg("x", 9, 9, 9, 9), False, 1)
+    assert dedupe_tile_segments([a, b, c]) == [a[0], c[0]]
+    assert dedupe_tile_segments([]) == []
+
+
+def test_tile_segment_shifts_and_flags_inner_edges():
+    segment, clipped, tile = _tile_segment(seg("t", 0, 10, 20, 20), 3, (100, 0, 300, 200), (400, 200))
+    assert segment["box"][0] == [100, 10] and tile == 3
+    assert clipped  # touches x0=100, an inner edge
+    _, clipped, _ = _tile_segment(seg("t", 50, 50, 60, 60), 0, (100, 0, 300, 200), (400, 200))
+    assert not clipped
+
+
+@pytest.fixture
+def fake_ocr(monkeypatch):
+    """Replace the HunyuanOCR round trip; tiles listed in `fail` raise, and concurrency is recorded."""
+    state = {"fail": set(), "active": 0, "peak": 0, "truncate_page": False}
+
+    def load_payload(page):
+        return page.name, page.size, "image/jpeg"
+
+    def request(messages, image_size, on_segments):
+        name = messages[0]["content"][0]["image_url"]["url"].split(",", 1)[1]
+
+        async def call():
+            state["active"] += 1
+            state["peak"] = max(state["peak"], state["active"])
+            await asyncio.sleep(0.01)
+            state["active"] -= 1
+            if name in state["fail"]:
+                raise RuntimeError(f"{name} failed")
+            truncated = state["truncate_page"] and "_tile_" not in name
+            return Completion(name, "length" if truncated else "stop", 1)
+
+        def parse(completion):
+            w, h = image_size
+            return [seg(completion.content, w // 2 - 5, h // 2 - 5, w // 2 + 5, h // 2 + 5)]
+        return call(), parse
+
+    async def direct(coro):
+        return await coro
+
+    monkeypatch.setattr(ocr_service, "_load_ocr_payload", load_payload)
+    monkeypatch.setattr(ocr_service, "_ocr_request", request)
+    monkeypatch.setattr(ocr_service, "run_on_client_loop", direct)
+    monkeypatch.setattr(ocr_service, "_ocr_request_slots", None)
+    return state
+
+
+def page(w=800, h=800, name="p"):
+    return PageImage.from_pil(Image.new("RGB", (w, h), "white"), name=name)
+
+
+def test_failed_tile_is_skipped(fake_ocr):
+    fake_ocr["fail"] = {"p_tile_1"}
+    segments = asyncio.run(ocr_service._ocr_tiled_async(page(), "prompt", (2, 2), 0))
+    assert sorted(s["text"] for s in segments) == ["p_tile_0", "p_tile_2", "p_tile_3"]
+
+
+def test_all_tiles_failing_raises(fake_ocr):
+    fake_ocr["fail"] = {f"p_tile_{i}" for i in range(4)}
+    with pytest.raises(RuntimeError):
+        asyncio.run(ocr_service._ocr_tiled_async(page(), "prompt", (2, 2), 0))
+
+
+def test_truncated_page_falls_back_when_tiles_fail(fake_ocr, monkeypatch):
+    monkeypatch.setattr(ocr_service, "OCR_TILE_PAGE_PIXELS", 10 ** 9)
+    fake_ocr["truncate_page"] = True
+    fake_ocr["fail"] = {"p_tile_0", "p_tile_1"}
+    segments = asyncio.run(ocr_service._ocr_page_async(page(), "prompt"))
+    # Both tiles failed; the truncated whole-page segment (page center) stands in for them
+    assert [s["text"] for s in segments] == ["p"]
+
+
+def test_tile_requests_respect_ocr_concurrency(fake_ocr, monkeypatch):
+    monkeypatch.setattr(ocr_service, "OCR_CONCURRENCY", 3)
+    asyncio.run(ocr_service._ocr_tiled_async(page(1600, 1600), "prompt", (4, 4), 0))
+    assert fake_ocr["peak"] == 3
+
+
+def test_streamed_truncated_page_sends_replacement(fake_ocr, monkeypatch):
+    monkeypatch.setattr(ocr_service, "OCR_TILE_PAGE_PIXELS", 10 ** 9)
+    fake_ocr["truncate_page"] = True
+    calls = []
+    segments = asyncio.run(ocr_service._ocr_page_async(page(), "prompt",
+                                                       on_segments=lambda s, replace=False: calls.append((s, replace))))
+    assert calls == [(segments, True)]
+    assert sorted(s["text"] for s in segments) == ["p_tile_0", "p_tile_1"]
+
+
+def test_incomplete_results_are_marked_partial(fake_ocr, monkeypatch):
+    monkeypatch.setattr(ocr_service, "OCR_TILE_PAGE_PIXELS", 10 ** 9)
+    fake_ocr["truncate_page"] = True
+    monkeypatch.setattr(ocr_service, "OCR_TILING", False)
+    assert isinstance(asyncio.run(ocr_service._ocr_page_async(page(), "prompt")), ocr_service.PartialResult)
+    monkeypatch.setattr(ocr_service, "OCR_TILING", True)
+    assert not isinstance(asyncio.run(ocr_service._ocr_page_async(page(), "prompt")), ocr_service.PartialResult)
+    fake_ocr["fail"] = {"p_tile_0"}
+    assert isinstance(asyncio.run(ocr_service._ocr_page_async(page(), "prompt")), ocr_service.PartialResult)
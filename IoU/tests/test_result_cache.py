@@ -0,0 +1,38 @@
+import ocr_service
+from result_cache import ResultCache
+
+
+def test_overwrite_does_not_grow_disk_bytes(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    cache.put("aa1", [1, 2, 3])
+    cache.put("aa1", [1, 2, 3])
+    cache.put("bb2", {"x": "y"})
+    cache.put("aa1", [1])
+    assert cache.stats()["disk_bytes"] == cache._scan_disk_bytes()
+
+
+def test_eviction_keeps_budget(tmp_path):
+    cache = ResultCache(str(tmp_path), max_memory_items=2, max_disk_bytes=200)
+    for i in range(20):
+        cache.put(f"{i:02d}key", ["x" * 20])
+        cache.put(f"{i:02d}key", ["y" * 20])
+    assert cache._scan_disk_bytes() <= 200
+    assert cache.stats()["disk_bytes"] == cache._scan_disk_bytes()
+
+
+def test_clear_removes_disk_entries(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    cache.put("aa1", [1])
+    cache.clear()
+    assert cache.get("aa1") is None
+
+
+def test_partial_results_are_not_cached(tmp_path, monkeypatch):
+    cache = ResultCache(str(tmp_path))
+    monkeypatch.setattr(ocr_service, "result_cache", cache)
+    partial = ocr_service._cached_stage("k1", ocr_service._ocr_slots, "HunyuanOCR",
+                                        lambda: ocr_service.PartialResult([{"text": "a"}]))
+    assert partial == [{"text": "a"}]
+    assert cache.get("k1") is None
+    ocr_service._cached_stage("k2", ocr_service._ocr_slots, "HunyuanOCR", lambda: [{"text": "a"}])
+    assert cache.get("k2") == [{"text": "a"}]
@@ -0,0 +1,105 @@
+import threading
+import time
+
+import pytest
+from PIL import Image
+
+import ocr_service
+from page_image import PageImage
+from table_gate import GATE_MAX_SIDE, LAYOUT, gate_image
+
+
+def test_gate_image_is_small_grayscale():
+    image = gate_image(Image.new("RGB", (3000, 1500), "white"))
+    assert image.ndim == 2 and image.shape == (GATE_MAX_SIDE // 2, GATE_MAX_SIDE)
+    small = gate_image(Image.new("RGB", (400, 300), "black"))
+    assert small.shape == (300, 400) and not small.any()
+
+
+class _NoCache:
+    def get(self, key):
+        return None
+
+    def put(self, key, value):
+        pass
+
+
+@pytest.fixture
+def stages(monkeypatch):
+    """Fake OCR and LORE stages; OCR waits for `release`, so the table stage can start first."""
+    state = {"layout": False, "lore_calls": 0, "release": threading.Event(), "lore_started": threading.Event()}
+
+    def ocr(page, prompt, on_segments=None):
+        state["release"].wait(5)
+        return [{"text": "a", "box": [[0, 0], [10, 0], [10, 10], [0, 10]]}]
+
+    def lore(page):
+        state["lore_calls"] += 1
+        state["lore_started"].set()
+        return [{"box": [[0, 0], [10, 0], [10, 10], [0, 10]]}]
+
+    def layout(gate, segments, page_width):
+        if state["layout"]:
+            gate.decision = LAYOUT
+        return gate
+
+    monkeypatch.setattr(ocr_service, "TABLE_GATE_SPECULATE", True)
+    monkeypatch.setattr(ocr_service, "result_cache", _NoCache())
+    monkeypatch.setattr(ocr_service, "get_hunyuan_ocr", ocr)
+    monkeypatch.setattr(ocr_service, "get_lore_structure", lore)
+    monkeypatch.setattr(ocr_service, "check_layout", layout)
+    monkeypatch.setattr(ocr_service, "merge_results", lambda ocr_results, cells, iou: list(ocr_results))
+    return state
+
+
+def _page():
+    return PageImage(pil=Image.new("RGB", (200, 100), "white"), name="blank.png")
+
+
+def test_structure_starts_while_ocr_runs_and_is_kept_for_a_layout_table(stages):
+    stages["layout"] = True
+    threading.Timer(0.05, stages["release"].set).start()
+    output = ocr_service.process_page(_page(), "Auto", "prompt", 0.5)
+    # LORE ran before OCR was released, i.e. next to it
+    assert stages["lore_started"].is_set() and stages["lore_calls"] == 1
+    assert output["table_cells"] and output["table_gate"]["structure"] == "NoTable"
+
+
+def _outcomes(outcome):
+    return ocr_service.TABLE_GATE_DECISIONS._values.get(("Auto", "none", outcome), 0)
+
+
+def test_speculative_structure_is_discarded_and_counted_as_wasted(stages):
+    threading.Timer(0.05, stages["release"].set).start()
+    wasted, skipped = _outcomes("speculated_wasted"), _outcomes("skipped")
+    output = ocr_service.process_page(_page(), "Auto", "prompt", 0.5)
+    assert output["table_cells"] == [] and output["table_gate"]["structure"] is None
+    # The model did run, so this page is no saving of the gate
+    assert stages["lore_calls"] == 1
+    assert _outcomes("speculated_wasted") == wasted + 1 and _outcomes("skipped") == skipped
+
+
+def test_without_speculation_no_table_skips_the_model(stages, monkeypatch):
+    monkeypatch.setattr(ocr_service, "TABLE_GATE_SPECULATE", False)
+    stages["release"].set()
+    skipped = _outcomes("skipped")
+    output = ocr_service.process_page(_page(), "Auto", "prompt", 0.5)
+    assert output["table_cells"] == [] and stages["lore_calls"] == 0
+    assert _outcomes("skipped") == skipped + 1
+
+
+def test_queued_speculative_structure_never_runs(stages):
+    stages["release"].set()
+    # Hold the only table slot until the page is done, so the speculative run is still queued
+    slots = ocr_service._table_slots
+    taken = 0
+    while slots.acquire(blocking=False):
+        taken += 1
+    try:
+        output = ocr_service.process_page(_page(), "Auto", "prompt", 0.5)
+    finally:
+        for _ in range(taken):
+            slots.release()
+    time.sleep(0.2)  # the speculative run gets its slot now, and must return without running
+    assert output["table_cells"] == []
+    assert stages["lore_calls"] == 0
@@ -0,0 +1,59 @@
+import os
+import threading
+import time
+
+import pytest
+
+import table_workers
+from table_workers import LORE, TableStructurePool
+
+
+def fake_infer_batch(kind, pages):
+    """Runs in the worker: b"crash:<path>" kills the process unless <path> exists (then creates
+    it first), b"hang" never returns, anything else comes back as its text."""
+    cells = []
+    for data in pages:
+        text = data.decode()
+        if text.startswith("crash:"):
+            path = text.split(":", 1)[1]
+            if not path or not os.path.exists(path):
+                if path:
+                    open(path, "w").close()
+                os._exit(1)
+        elif text == "hang":
+            time.sleep(120)
+        cells.append([text])
+    return cells
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    # Looked up by reference in the spawned workers, which import this module
+    monkeypatch.setattr(table_workers, "_infer_batch", fake_infer_batch)
+    restarted = threading.Event()
+    pool = TableStructurePool(LORE, workers=1, max_batch=1, on_restart=restarted.set)
+    pool.restarted = restarted
+    yield pool
+    pool.shutdown()
+
+
+def test_dead_worker_is_replaced_and_page_retried(pool, tmp_path):
+    assert pool.recognize(f"crash:{tmp_path / 'crashed'}".encode(), timeout=60) == ["crash:" + str(tmp_path / "crashed")]
+    assert pool.restarts == 1 and pool.restarted.wait(5)
+    assert pool.recognize(b"page", timeout=60) == ["page"]
+
+
+def test_page_that_keeps_crashing_fails_but_pool_recovers(pool):
+    with pytest.raises(table_workers.BrokenProcessPool):
+        pool.recognize(b"crash:", timeout=60)
+    assert pool.restarts == table_workers.RECOGNIZE_RETRIES + 1
+    assert pool.recognize(b"page", timeout=60) == ["page"]
+
+
+def test_hung_page_times_out_and_restarts_workers(pool):
+    assert pool.recognize(b"warm", timeout=60) == ["warm"]
+    start = time.monotonic()
+    with pytest.raises(table_workers.TimeoutError):
+        pool.recognize(b"hang", timeout=1)
+    assert time.monotonic() - start < 10 and pool.restarts == 1
+    assert pool.recognize(b"page", timeout=60) == ["page"]
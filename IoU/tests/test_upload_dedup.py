@@ -0,0 +1,67 @@
+import asyncio
+import hashlib
+
+import pytest
+
+from job_queue import COMPLETED, JobScheduler, JobStore
+from upload_ingest import UploadBudget, UploadTooLarge, ingest
+
+
+def make_job(file_id, content_key="k1"):
+    return {"file_id": file_id, "filename": f"{file_id}.pdf", "file_path": f"/tmp/{file_id}.pdf",
+            "mode": "Table", "prompt": "p", "iou_threshold": 0.8, "content_key": content_key}
+
+
+async def chunks(data, size):
+    for i in range(0, len(data), size):
+        yield data[i:i + size]
+
+
+def test_store_add_returns_existing_job_for_same_content(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.sqlite3"))
+    assert store.add(make_job("a")) is None
+    existing = store.add(make_job("b"))
+    assert existing["file_id"] == "a"
+    assert store.get("b") is None
+    assert store.add(make_job("c", content_key="k2")) is None
+
+
+def test_store_add_skips_failed_and_cleared_keys(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.sqlite3"))
+    store.add(make_job("a"))
+    store.update("a", status="failed")
+    assert store.add(make_job("b")) is None
+    store.update("b", status=COMPLETED, content_key=None)
+    assert store.add(make_job("c")) is None
+
+
+def test_identical_submits_in_flight_queue_one_job(tmp_path):
+    async def run():
+        store = JobStore(str(tmp_path / "jobs.sqlite3"))
+        scheduler = JobScheduler(store, run_job=None, workers=0)
+        results = await asyncio.gather(*(scheduler.submit(make_job(f"f{i}")) for i in range(5)))
+        return scheduler, results
+
+    scheduler, results = asyncio.run(run())
+    assert results[0] is None
+    assert [r["file_id"] for r in results[1:]] == ["f0"] * 4
+    assert scheduler.depth == 1
+
+
+def test_ingest_hashes_and_counts(tmp_path):
+    data = bytes(range(256)) * 1000
+    ingested = asyncio.run(ingest(chunks(data, 3000), str(tmp_path), ".pdf", chunk_size=64 * 1024))
+    assert ingested.size == len(data)
+    assert ingested.sha256 == hashlib.sha256(data).hexdigest()
+    with open(ingested.path, "rb") as f:
+        assert f.read() == data
+
+
+def test_ingest_limits_remove_partial_file(tmp_path):
+    with pytest.raises(UploadTooLarge):
+        asyncio.run(ingest(chunks(b"x" * 5000, 1000), str(tmp_path), max_bytes=4000))
+    budget = UploadBudget(6000)
+    asyncio.run(ingest(chunks(b"x" * 4000, 1000), str(tmp_path), budget=budget))
+    with pytest.raises(UploadTooLarge):
+        asyncio.run(ingest(chunks(b"x" * 4000, 1000), str(tmp_path), budget=budget))
+    assert len(list(tmp_path.iterdir())) == 1
@@ -0,0 +1,31 @@
+import json
+
+from PIL import Image
+
+from visualization import load_page_data, page_data_path, render_visualization, save_page_data
+
+BOX = [[10, 10], [60, 10], [60, 30], [10, 30]]
+
+
+def _upload(directory, name="f1_page_0.jpg"):
+    directory.mkdir(exist_ok=True)
+    Image.new("RGB", (100, 50), "white").save(directory / name)
+    return directory / name
+
+
+def test_page_data_keeps_only_the_image_name(tmp_path):
+    image = _upload(tmp_path / "uploads")
+    data_path = page_data_path(str(tmp_path), "f1", 1)
+    save_page_data(data_path, str(image), [{"text": "a", "box": BOX}], [])
+    assert load_page_data(data_path)["image"] == "f1_page_0.jpg"
+    assert str(tmp_path) not in open(data_path, encoding="utf-8").read()
+    assert render_visualization(data_path, str(tmp_path / "uploads"))[:2] == b"\xff\xd8"
+
+
+def test_old_absolute_path_resolved_in_current_upload_dir(tmp_path):
+    # Written by an install that has since moved: only the file name still matches
+    _upload(tmp_path / "uploads")
+    data_path = tmp_path / "f1_page_1_data.json"
+    data_path.write_text(json.dumps({"image": "/old/install/uploads/f1_page_0.jpg",
+                                     "results": [{"text": "a", "box": BOX}], "table_cells": []}))
+    assert render_visualization(str(data_path), str(tmp_path / "uploads"), max_side=50)[:2] == b"\xff\xd8"
@@ -0,0 +1,42 @@
+import importlib.util
+
+import pytest
+
+import ocr_service
+from ocr_service import FAILED, LOADING, READY
+
+
+@pytest.fixture
+def status(monkeypatch):
+    table = {}
+    monkeypatch.setattr(ocr_service, "_warmup_status", table)
+    return table
+
+
+def test_failed_optional_model_still_ready(status, monkeypatch):
+    monkeypatch.setattr(ocr_service, "WARMUP_REQUIRED_MODELS", ())
+    status.update(lore={"status": READY}, wired={"status": LOADING})
+    assert not ocr_service.warmup_status()[0]
+    status["wired"] = {"status": FAILED, "error": "boom"}
+    ready, models = ocr_service.warmup_status()
+    assert ready and models["wired"]["required"] is False
+
+
+def test_failed_required_model_not_ready(status, monkeypatch):
+    monkeypatch.setattr(ocr_service, "WARMUP_REQUIRED_MODELS", ("wired",))
+    status.update(lore={"status": READY}, wired={"status": FAILED, "error": "boom"})
+    assert not ocr_service.warmup_status()[0]
+
+
+def test_table_models_required_by_default(status):
+    status.update(lore={"status": FAILED, "error": "boom"}, wired={"status": FAILED, "error": "boom"})
+    ready, models = ocr_service.warmup_status()
+    assert not ready and models["lore"]["required"] and models["wired"]["required"]
+
+
+@pytest.mark.skipif(importlib.util.find_spec("modelscope") is not None, reason="modelscope is installed")
+def test_missing_modelscope_disables_table_models(monkeypatch):
+    monkeypatch.setattr(ocr_service, "TABLE_WORKER_PROCESSES", 0)
+    page = ocr_service._blank_page()
+    assert ocr_service.get_lore_structure(page) == []
+    assert ocr_service.get_wired_structure(page) == []